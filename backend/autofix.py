@@ -0,0 +1,198 @@
+import ast
+import collections
+import io
+import re
+import tokenize
+from logger import logger
+from render_worker import SCENE_CLASS_NAME
+
+
+"""
+Deterministic repairs for the mechanical errors in generated manim code.
+
+Many failed attempts fail for the same few reasons: markdown fences or a language name around the code, colors manim does not define (BROWN), a scene class that is not called VideoScene, or a missing numpy import. Each rule is keyed on the class of error it repairs and patches the source directly, so the scene can be validated and rendered again right away. Only errors no rule applies to cost an LLM round trip. Rule hits are counted, to see how many round trips the fixer saves.
+"""
+
+# colors the LLM likes to use that manim does not define, mapped to the closest ones it does
+COLOR_REPLACEMENTS = {
+    "BROWN": "DARK_BROWN",
+    "CYAN": "TEAL",
+    "LIGHT_BLUE": "BLUE_B",
+    "DARK_GREEN": "GREEN_E",
+    "LIGHT_GREEN": "GREEN_B",
+    "DARK_RED": "RED_E",
+    "LIGHT_RED": "RED_B",
+}
+
+# modules the LLM uses without importing them
+MISSING_IMPORTS = {
+    "np": "import numpy as np",
+    "numpy": "import numpy",
+    "math": "import math",
+    "random": "import random",
+}
+
+NAME_ERROR_PATTERN = re.compile(r"NameError: name '(\w+)' is not defined")
+SCENE_CLASS_ERROR_PATTERN = re.compile(r"root scene class must be called|Expected a single scene class|is not in the script|No scenes? (?:inside|found)")
+FENCE_PATTERN = re.compile(r"```[\w+-]*[ \t]*\n(.*?)(?:\n```|\Z)", re.DOTALL)
+LANGUAGE_TOKENS = ("python", "python3", "py")
+
+
+def parse_errors(error):
+    """
+    Parses an error message into the classes of errors it reports
+    :param error: Validation or render error (string)
+    :return: error classes mapped to their details, e.g. the undefined names of a NameError (dict of string to list)
+    """
+    errors = collections.defaultdict(list)
+    if "SyntaxError" in error or "IndentationError" in error:
+        errors["SyntaxError"].append(None)
+    for name in NAME_ERROR_PATTERN.findall(error):
+        errors["NameError"].append(name)
+    if SCENE_CLASS_ERROR_PATTERN.search(error):
+        errors["SceneClassError"].append(None)
+    return errors
+
+
+def replace_names(code, replacements):
+    """
+    Renames identifiers in the code, leaving strings and comments untouched
+    :param replacements: Old names mapped to new names (dict of string to string)
+    :return: code with the names replaced (string)
+    """
+    lines = code.splitlines(keepends=True)
+    positions = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.NAME and token.string in replacements:
+                positions.append(token.start)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return code
+    # replace from the end so earlier positions stay valid
+    for row, column in reversed(positions):
+        line = lines[row - 1]
+        name = re.match(r"\w+", line[column:]).group()
+        lines[row - 1] = line[:column] + replacements[name] + line[column + len(name):]
+    return "".join(lines)
+
+
+def strip_markdown(code, details):
+    """
+    Removes markdown fences and a leading language name around the code
+    """
+    first_line = next((line.strip().lower() for line in code.splitlines() if line.strip()), "")
+    if "```" not in code and first_line not in LANGUAGE_TOKENS:
+        return code
+    match = FENCE_PATTERN.search(code)
+    if match:
+        code = match.group(1)
+    lines = [line for line in code.strip().splitlines() if not line.strip().startswith("```")]
+    while lines and lines[0].strip().lower() in LANGUAGE_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines) + "\n"
+
+
+def replace_undefined_colors(code, names):
+    replacements = {name: COLOR_REPLACEMENTS[name] for name in names if name in COLOR_REPLACEMENTS}
+    return replace_names(code, replacements) if replacements else code
+
+
+def add_missing_imports(code, names):
+    imports = [MISSING_IMPORTS[name] for name in dict.fromkeys(names) if name in MISSING_IMPORTS]
+    if not imports:
+        return code
+    tree = ast.parse(code)
+    # after the imports at the top of the module
+    position = 0
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            break
+        position = node.end_lineno
+    lines = code.splitlines()
+    lines[position:position] = imports
+    return "\n".join(lines) + "\n"
+
+
+def rename_scene_class(code, details):
+    """
+    Renames the only scene class of the module to VideoScene
+    """
+    tree = ast.parse(code)
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+    if any(node.name == SCENE_CLASS_NAME for node in classes):
+        return code
+
+    def is_scene(node):
+        return any(
+            (isinstance(base, ast.Name) and base.id.endswith("Scene")) or (isinstance(base, ast.Attribute) and base.attr.endswith("Scene"))
+            for base in node.bases
+        )
+
+    scenes = [node for node in classes if is_scene(node)]
+    if len(scenes) != 1:
+        return code
+    return replace_names(code, {scenes[0].name: SCENE_CLASS_NAME})
+
+
+# rules with the classes of error they repair, in the order they are tried
+RULES = [
+    # a leading language name is valid python, it only fails once it is looked up
+    ("markdown_fence", ("SyntaxError", "NameError"), strip_markdown),
+    ("undefined_color", ("NameError",), replace_undefined_colors),
+    ("missing_import", ("NameError",), add_missing_imports),
+    ("scene_class_name", ("SceneClassError",), rename_scene_class),
+]
+
+
+class AutoFixer:
+    """
+    Initializes the AutoFixer, which applies the repair rules and counts how often each one hits
+    """
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.errors = 0
+        self.fixed = 0
+        self.hits = collections.Counter()
+
+    def fix(self, code, error):
+        """
+        Applies every rule that matches the error to the code
+        :param code: Code that failed (string)
+        :param error: Validation or render error (string)
+        :return: patched code, None if no rule changed anything (string)
+        """
+        self.errors += 1
+        errors = parse_errors(error)
+        applied = []
+        for name, error_classes, rule in self.rules:
+            if not any(error_class in errors for error_class in error_classes):
+                continue
+            try:
+                patched = rule(code, [detail for error_class in error_classes for detail in errors.get(error_class, [])])
+            except (SyntaxError, ValueError) as e:
+                logger.warning(f"Autofix rule {name} could not be applied: {e}")
+                continue
+            if patched != code:
+                code = patched
+                applied.append(name)
+
+        if not applied:
+            return None
+        self.fixed += 1
+        self.hits.update(applied)
+        logger.info(
+            f"Autofix applied {', '.join(applied)}, {self.fixed} of {self.errors} errors fixed without the LLM "
+            f"({', '.join(f'{rule}: {hits}' for rule, hits in self.hits.most_common())})"
+        )
+        return code
+
+    def stats(self):
+        return {
+            "errors": self.errors,
+            "fixed": self.fixed,
+            "hit_rate": self.fixed / self.errors if self.errors else 0.0,
+            "rules": {name: self.hits[name] for name, _, _ in self.rules},
+        }
+
+
+autofixer = AutoFixer()
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+"""
+Offline end-to-end benchmark of the video pipeline.
+
+Generates videos with the fake LLM and speech providers (see fakes.py), so throughput and latency can be measured without paying for API calls. Everything else is real: the transcript parser, codegen loop, autofixer, validation, manim renders, ffmpeg muxing and concatenation. Each video runs TranscriptGenerator and then SceneGenerator.generate_all_scenes, with up to --concurrency videos at a time, and the benchmark reports the p50 and p95 end-to-end latency, the time spent per stage, the CPU time and the peak RSS of the benchmark and of the manim and ffmpeg processes it started.
+
+    python benchmark.py --videos 8 --concurrency 4 --llm-latency 1 --failure-rate 0.2
+
+Videos, caches and renders go to a temporary directory that is removed afterwards, so every run starts cold.
+
+The benchmark also imports the API server in a fresh interpreter with python -X importtime, and reports how long that takes and which packages take the longest, so new replicas keep coming up fast. It exits with status 1 when the import takes longer than --import-budget.
+
+    python benchmark.py --imports-only
+"""
+
+# a line of python -X importtime: self and cumulative microseconds, and the module indented by its depth
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+# packages listed in the import report
+IMPORT_REPORT_PACKAGES = 10
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest rank percentile of the values
+    :param values: Measurements (list of floats)
+    :param fraction: Percentile as a fraction, e.g. 0.95 (float)
+    :return: the percentile, None if there are no values (float)
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def configure(args, work_dir):
+    """
+    Points the pipeline at the fake providers and the work directory. Has to run before the pipeline is imported, which reads its configuration from the environment.
+    """
+    os.environ.update({
+        "LLM_CLIENT": "fake",
+        "TTS_CLIENT": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_TTS_LATENCY": str(args.tts_latency),
+        "FAKE_LLM_FAILURE_RATE": str(args.failure_rate),
+        "FAKE_TRANSCRIPT_SCENES": str(args.scenes),
+        "FAKE_SEED": str(args.seed),
+        "GENERATIONS_PATH": f"{work_dir}/generated",
+        "SCENE_CACHE_PATH": f"{work_dir}/cache/scenes",
+        "SPEECH_CACHE_PATH": f"{work_dir}/cache/speech",
+        "RENDER_QUEUE_DIR": f"{work_dir}/render_queue",
+    })
+
+
+def measure_imports(module="main"):
+    """
+    Imports the module in a fresh interpreter with python -X importtime
+    :param module: Module to import (string)
+    :return: seconds the import and the whole interpreter took, and the seconds spent in the slowest packages (dict)
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    process_seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}: {result.stderr.strip().splitlines()[-1]}")
+
+    import_seconds = None
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if name == module and not indent:
+            import_seconds = int(cumulative_us) / 1e6
+        # the time of a module itself, without its imports, counts towards its top level package
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:IMPORT_REPORT_PACKAGES]
+    return {"module": module, "seconds": import_seconds, "process_seconds": process_seconds, "packages": dict(slowest)}
+
+
+async def run(args):
+    """
+    Generates the videos and collects their latencies and spans
+    :return: benchmark results (dict)
+    """
+    from transcript_generator import TranscriptGenerator
+    from scene_generator import SceneGenerator
+    from client import client
+    from limits import current_job
+    from metrics import current_spans, summarize
+    from render_queue import render_queue
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_video(index):
+        async with semaphore:
+            spans = []
+            current_spans.set(spans)
+            current_job.set(f"benchmark-{index}")
+            topic = f"{args.topic} (video {index + 1})"
+            start = time.perf_counter()
+            scene_generator = SceneGenerator([])
+            if args.streaming:
+                video_id = await scene_generator.generate_streamed_scenes(
+                    TranscriptGenerator().stream_transcript(topic, emotions=args.emotions)
+                )
+            else:
+                transcript = await TranscriptGenerator().generate_transcript(topic, emotions=args.emotions) or []
+                for scene_transcription in transcript:
+                    scene_generator.add_scene(scene_transcription)
+                video_id = await scene_generator.generate_all_scenes() if transcript else None
+            return {"latency": time.perf_counter() - start, "ok": video_id is not None, "spans": spans}
+
+    start = time.perf_counter()
+    try:
+        videos = await asyncio.gather(*(run_video(index) for index in range(args.videos)))
+    finally:
+        await render_queue.stop()
+    wall_seconds = time.perf_counter() - start
+
+    latencies = [video["latency"] for video in videos]
+    stages = summarize([record for video in videos for record in video["spans"]])["stages"]
+    for summary in stages.values():
+        summary["mean_seconds"] = summary["seconds"] / summary["count"]
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # kilobytes on linux, bytes on macos
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "videos": args.videos,
+        "succeeded": sum(video["ok"] for video in videos),
+        "concurrency": args.concurrency,
+        "wall_seconds": wall_seconds,
+        "videos_per_minute": args.videos / wall_seconds * 60,
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies),
+        },
+        "stages": stages,
+        "cpu_seconds": {
+            "benchmark": own.ru_utime + own.ru_stime,
+            "children": children.ru_utime + children.ru_stime,
+        },
+        "peak_rss_mb": {
+            "benchmark": own.ru_maxrss * rss_unit / 1024 ** 2,
+            "children": children.ru_maxrss * rss_unit / 1024 ** 2,
+        },
+        "injected_failures": getattr(client.chat.completions, "failures", {}),
+    }
+
+
+def print_import_report(imports, budget):
+    verdict = "within" if imports["seconds"] <= budget else "over"
+    print(f"import {imports['module']} {imports['seconds']:.2f}s ({verdict} the {budget:g}s budget), interpreter {imports['process_seconds']:.2f}s")
+    print(", ".join(f"{package} {seconds:.2f}s" for package, seconds in imports["packages"].items()))
+
+
+def print_report(results):
+    latency = results["latency_seconds"]
+    print(f"{results['succeeded']}/{results['videos']} videos in {results['wall_seconds']:.1f}s at concurrency {results['concurrency']} ({results['videos_per_minute']:.2f} videos/min)")
+    print(f"latency p50 {latency['p50']:.1f}s, p95 {latency['p95']:.1f}s, max {latency['max']:.1f}s")
+    print(f"cpu {results['cpu_seconds']['benchmark']:.1f}s benchmark, {results['cpu_seconds']['children']:.1f}s manim and ffmpeg")
+    print(f"peak rss {results['peak_rss_mb']['benchmark']:.0f}MB benchmark, {results['peak_rss_mb']['children']:.0f}MB largest child")
+    print(f"injected failures: {results['injected_failures']}")
+    print()
+    print(f"{'stage':<12}{'count':>7}{'total s':>10}{'mean s':>9}  errors")
+    for stage, summary in sorted(results["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{stage:<12}{summary['count']:>7}{summary['seconds']:>10.1f}{summary['mean_seconds']:>9.2f}  {summary['errors'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the video pipeline offline, with fake LLM and speech providers")
+    parser.add_argument("--videos", type=int, default=4, help="videos to generate")
+    parser.add_argument("--concurrency", type=int, default=2, help="videos generated at the same time")
+    parser.add_argument("--scenes", type=int, default=3, help="scenes per video")
+    parser.add_argument("--llm-latency", type=float, default=2, help="seconds every fake LLM response takes")
+    parser.add_argument("--tts-latency", type=float, default=0.5, help="seconds every fake speech synthesis takes")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="share of codegen responses that are broken on purpose")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fake providers")
+    parser.add_argument("--streaming", action="store_true", help="stream the transcript and start scenes as they arrive")
+    parser.add_argument("--topic", default="How does backpropagation work?", help="topic of the videos")
+    parser.add_argument("--emotions", default="curious, calm, focused", help="emotions of the student")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--keep", action="store_true", help="keep the generated videos")
+    parser.add_argument("--import-budget", type=float, default=1, help="seconds importing the API server may take")
+    parser.add_argument("--imports-only", action="store_true", help="only measure the import of the API server")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    configure(args, work_dir)
+    try:
+        imports = measure_imports()
+        results = {} if args.imports_only else asyncio.run(run(args))
+    finally:
+        if args.keep:
+            print(f"Generated videos are in {work_dir}/generated", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, True)
+    results["imports"] = imports
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        if not args.imports_only:
+            print_report(results)
+            print()
+        print_import_report(imports, args.import_budget)
+    if imports["seconds"] > args.import_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
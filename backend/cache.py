@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from logger import logger
+
+
+"""
+Content addressed disk cache with size based LRU eviction.
+
+Every entry is a directory named after the hash of its key, holding one or more files. Reading an entry bumps its modification time, and when the cache grows past its size limit the least recently used entries are removed. Entries are written to a temporary directory first and renamed into place, so a half written entry is never visible.
+"""
+
+
+def hash_key(*parts):
+    """
+    Hashes the given key parts into a cache key
+    :param parts: Parts of the key (json serializable)
+    :return: hex digest (string)
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def normalize_text(text):
+    """
+    Normalizes text for use in a cache key, so that differences in case and whitespace still hit the same entry
+    """
+    return " ".join(text.split()).casefold()
+
+
+class DiskCache:
+    """
+    Initializes the DiskCache in the given directory
+    :param root: Directory the entries are stored in (string)
+    :param max_bytes: Size the cache is trimmed to (int)
+    """
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def entry_path(self, key):
+        return f"{self.root}/{key[:2]}/{key}"
+
+    def get(self, key):
+        """
+        Looks up the entry for the key
+        :param key: Cache key (string)
+        :return: directory holding the files of the entry, or None on a miss (string)
+        """
+        path = self.entry_path(key)
+        if os.path.isdir(path):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # evicted in the meantime
+                path = None
+        else:
+            path = None
+
+        with self.lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def put(self, key, files):
+        """
+        Stores an entry for the key, replacing any existing one
+        :param key: Cache key (string)
+        :param files: File names of the entry mapped to either a path to copy from or the contents (dict of string to string or bytes)
+        :return: directory holding the files of the entry (string)
+        """
+        path = self.entry_path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temporary_path, exist_ok=True)
+        try:
+            for name, source in files.items():
+                target = f"{temporary_path}/{name}"
+                if isinstance(source, bytes):
+                    with open(target, "wb") as target_file:
+                        target_file.write(source)
+                else:
+                    # copy rather than link, so rewriting the source later can not change the entry
+                    shutil.copyfile(source, target)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.rename(temporary_path, path)
+        except Exception:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+
+        self.evict()
+        return path
+
+    def entries(self):
+        """
+        Lists all entries with their size and last use
+        :return: list of (last use, size in bytes, path) (list of tuples)
+        """
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if not entry.is_dir() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits its size limit
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            with self.lock:
+                self.evictions += 1
+            logger.info(f"Evicted cache entry {path}")
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def link_or_copy(source, target):
+    """
+    Hard links the file if possible, which costs no extra space, and copies it otherwise
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
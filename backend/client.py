@@ -1,23 +1,77 @@
-import dotenv
-dotenv.load_dotenv()
 import os
+from types import SimpleNamespace
+from lazy import LazyObject
 
-llm_client_choice = os.getenv("LLM_CLIENT")
+# anthropic requires an upper bound on the length of the response
+ANTHROPIC_MAX_TOKENS = int(os.getenv("ANTHROPIC_MAX_TOKENS") or 4096)
 
 
-if llm_client_choice == "groq":
-    from groq import AsyncGroq
-    client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+class AnthropicCompletions:
+    """
+    Serves the chat.completions.create interface of the openai client with the anthropic messages api, so the generators work with either.
+    System prompts are marked for prompt caching, so retries and later scenes reuse the cached prefix instead of processing the large static prompt again.
+    :param client: Anthropic client (AsyncAnthropic)
+    """
+    def __init__(self, client):
+        self.client = client
 
-elif llm_client_choice == "anthropic":
-    from anthropic import AsyncAnthropic
-    class AsyncAnthropicClient:
-        def __init__(self, api_key: str):
-            self.chat = AsyncAnthropic(api_key=api_key)
-    client = AsyncAnthropicClient(
-        api_key=os.getenv("ANTHROPIC_API_KEY"),
-    )
-    
-else:
+    async def create(self, model, messages, temperature=None, stream=False):
+        request = {
+            "model": model,
+            "max_tokens": ANTHROPIC_MAX_TOKENS,
+            "system": [
+                {"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}
+                for message in messages if message["role"] == "system"
+            ],
+            "messages": [
+                {"role": message["role"], "content": message["content"]}
+                for message in messages if message["role"] != "system"
+            ],
+        }
+        if temperature is not None:
+            request["temperature"] = temperature
+
+        if stream:
+            return self.stream(request)
+
+        response = await self.client.messages.create(**request)
+        content = "".join(block.text for block in response.content if block.type == "text")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+            usage=response.usage,
+        )
+
+    async def stream(self, request):
+        async with self.client.messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def create_client(choice=None):
+    """
+    Creates the client of the LLM provider, importing its SDK
+    :param choice: groq, anthropic, fake or openai, the default, LLM_CLIENT if not given (string)
+    :return: client with the chat.completions.create interface of the openai client
+    """
+    choice = choice or os.getenv("LLM_CLIENT")
+    if choice == "groq":
+        from groq import AsyncGroq
+        return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+    if choice == "anthropic":
+        from anthropic import AsyncAnthropic
+        anthropic_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY") or os.getenv("ANTHROPIC_KEY"))
+        return SimpleNamespace(chat=SimpleNamespace(completions=AnthropicCompletions(anthropic_client)))
+
+    if choice == "fake":
+        # canned responses for benchmarks and offline development, see fakes.py
+        from fakes import FakeCompletions
+        return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+    # openai caches prompt prefixes on its own, the static system prompt always comes first
     from openai import AsyncOpenAI
-    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
\ No newline at end of file
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+# the SDK is imported on the first request, see lazy.py
+client = LazyObject(create_client)
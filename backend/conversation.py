@@ -0,0 +1,128 @@
+import os
+import re
+
+
+"""
+Bounded conversation history for the LLM retry loops.
+
+Every retry used to append the whole generated output and the whole error to the conversation, so by the last attempt the prompt was several times larger than the first one. A Conversation only sends the static system prompt, the request, the latest attempt and its error, plus the one line summary of every earlier error so the model does not repeat them. Errors are trimmed to the traceback frames of the generated code, the frame that raised and the exception itself.
+
+The system prompt is always the first message and never changes between attempts, so providers that cache prompt prefixes can reuse it.
+"""
+
+# longest error that is sent back to the LLM (characters)
+MAX_ERROR_LENGTH = int(os.getenv("MAX_ERROR_LENGTH") or 2000)
+
+# earlier errors that are summarized in the retry message
+MAX_EARLIER_ERRORS = 4
+
+FRAME_PATTERN = re.compile(r'^  File "(?P<path>[^"]+)", line \d+')
+RICH_FRAME_PATTERN = re.compile(r"^│ (?P<path>\S+):\d+ in \S+")
+LOG_LINE_PATTERN = re.compile(r"^\[\d{2}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}\]\s+INFO\b")
+
+LIBRARY_PATH_MARKERS = ("site-packages", "dist-packages", "/lib/python", "render_worker.py")
+
+
+def is_library_path(path):
+    return any(marker in path for marker in LIBRARY_PATH_MARKERS)
+
+
+def split_frames(lines, pattern):
+    """
+    Splits traceback lines into the lines before the first frame, the frames and the lines after the last frame
+    :return: head, frames as (path, lines) and tail (list of strings, list of tuples, list of strings)
+    """
+    head, frames, tail = [], [], []
+    for line in lines:
+        match = pattern.match(line)
+        if match:
+            frames.append((match.group("path"), [line]))
+        elif not frames:
+            head.append(line)
+        elif line.startswith("  ") or line.startswith("│"):
+            frames[-1][1].append(line)
+        else:
+            tail.append(line)
+    return head, frames, tail
+
+
+def trim_traceback(error):
+    """
+    Trims an error message to the parts that help fixing the generated code: the frames outside of libraries, the frame that raised and the exception
+    :param error: Error message, possibly containing a plain or a rich formatted traceback (string)
+    :return: trimmed error message (string)
+    """
+    lines = [line for line in error.splitlines() if not LOG_LINE_PATTERN.match(line)]
+
+    for pattern in (FRAME_PATTERN, RICH_FRAME_PATTERN):
+        head, frames, tail = split_frames(lines, pattern)
+        if not frames:
+            continue
+        kept = []
+        for index, (path, frame_lines) in enumerate(frames):
+            if not is_library_path(path) or index == len(frames) - 1:
+                kept += frame_lines
+            elif not kept or kept[-1] != "  ...":
+                kept.append("  ...")
+        lines = head + kept + tail
+        break
+
+    trimmed = "\n".join(lines).strip()
+    if len(trimmed) > MAX_ERROR_LENGTH:
+        # the end of the error is the useful part
+        trimmed = "..." + trimmed[-MAX_ERROR_LENGTH:]
+    return trimmed
+
+
+def summarize_error(error):
+    """
+    Returns the last non empty line of an error, which usually names the exception
+    """
+    lines = [line.strip(" │╰─╯") for line in error.strip().splitlines()]
+    lines = [line for line in lines if line]
+    return lines[-1] if lines else error
+
+
+class Conversation:
+    """
+    Initializes the Conversation with the static system prompt and the request
+    :param system_prompt: System prompt, identical for every attempt (string)
+    :param request: First user message (string)
+    """
+    def __init__(self, system_prompt, request):
+        self.system_prompt = system_prompt
+        self.request = request
+        self.last_output = None
+        self.last_error = None
+        self.earlier_errors = []
+
+    def add_attempt(self, output, error):
+        """
+        Records a failed attempt, replacing the previous one
+        :param output: Output of the model (string)
+        :param error: Why the output was rejected (string)
+        """
+        if self.last_error is not None and summarize_error(self.last_error) not in self.earlier_errors:
+            self.earlier_errors.append(summarize_error(self.last_error))
+        self.last_output = output
+        self.last_error = error
+
+    def get_messages(self):
+        """
+        :return: messages for the next attempt (list of dicts)
+        """
+        messages = [{
+            "role": "system", "content": self.system_prompt
+        }, {
+            "role": "user", "content": self.request
+        }]
+        if self.last_output is None:
+            return messages
+
+        feedback = f"Error: {trim_traceback(self.last_error)}"
+        earlier_errors = self.earlier_errors[-MAX_EARLIER_ERRORS:]
+        if earlier_errors:
+            feedback += "\n\nEarlier attempts failed with:\n" + "\n".join(f"- {error}" for error in earlier_errors)
+        messages.append({"role": "assistant", "content": self.last_output})
+        messages.append({"role": "user", "content": feedback})
+        return messages
@@ -0,0 +1,255 @@
+import ast
+import os
+import wave
+from logger import logger
+from render_worker import SCENE_CLASS_NAME
+
+
+"""
+Plans the length of a scene's animation around the length of its narration.
+
+The narration is synthesized first, so its exact duration is known before any manim code is generated. That duration is given to the LLM as a target, and the generated code is checked against it before rendering by statically adding up its self.play run times and self.wait durations. Animations that come out a little short are padded with a final self.wait, so the rendered clip already matches the narration and muxing stays a stream copy.
+"""
+
+# manim's default run_time of an animation and duration of a wait (seconds)
+DEFAULT_RUN_TIME = 1.0
+
+# relative difference between the estimated and the target duration that is tolerated before asking for new code
+DURATION_TOLERANCE = float(os.getenv("DURATION_TOLERANCE") or 0.2)
+
+# differences below this are not worth padding for (seconds)
+PADDING_EPSILON = 0.1
+
+
+def get_audio_duration(path):
+    """
+    Reads the duration of a wav file from its header
+    :param path: Path to the wav file (string)
+    :return: duration in seconds, None if the file can not be read as wav (float)
+    """
+    try:
+        with wave.open(path, "rb") as wav_file:
+            frames = wav_file.getnframes()
+            frame_size = wav_file.getsampwidth() * wav_file.getnchannels()
+            rate = wav_file.getframerate()
+    except (OSError, EOFError, wave.Error) as e:
+        logger.warning(f"Could not read the duration of {path}: {e}")
+        return None
+
+    # streamed wav files may carry a placeholder length, fall back to the size of the file
+    frames_in_file = os.path.getsize(path) // frame_size
+    if frames == 0 or frames > frames_in_file:
+        frames = frames_in_file
+    return frames / rate
+
+
+def evaluate_number(node):
+    """
+    Evaluates a constant numeric expression
+    :return: value, None if the expression is not a constant number (float)
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return float(node.value)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = evaluate_number(node.operand)
+        if value is None:
+            return None
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        left, right = evaluate_number(node.left), evaluate_number(node.right)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if isinstance(node.op, ast.Div) and right != 0:
+            return left / right
+    return None
+
+
+def count_iterations(node):
+    """
+    Counts the iterations of a for loop over range() with constant arguments or over a literal sequence
+    :return: number of iterations, None if it can not be known without running the code (int)
+    """
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return len(node.elts)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range" and not node.keywords:
+        arguments = [evaluate_number(argument) for argument in node.args]
+        if not arguments or None in arguments or any(argument != int(argument) for argument in arguments):
+            return None
+        try:
+            return len(range(*(int(argument) for argument in arguments)))
+        except ValueError:
+            return None
+    return None
+
+
+class DurationEstimator:
+    """
+    Initializes the DurationEstimator for the methods of a scene class
+    :param methods: Methods of the scene class by name (dict of string to ast.FunctionDef)
+    """
+    def __init__(self, methods):
+        self.methods = methods
+        self.exact = True
+        self.call_stack = []
+
+    def estimate_method(self, name):
+        if name in self.call_stack:
+            # recursion can not be followed statically
+            self.exact = False
+            return 0.0
+        self.call_stack.append(name)
+        try:
+            return self.estimate_body(self.methods[name].body)
+        finally:
+            self.call_stack.pop()
+
+    def estimate_body(self, statements):
+        return sum(self.estimate_statement(statement) for statement in statements)
+
+    def estimate_statement(self, statement):
+        if isinstance(statement, (ast.For, ast.AsyncFor)):
+            iterations = count_iterations(statement.iter)
+            if iterations is None:
+                self.exact = False
+                iterations = 1
+            return iterations * self.estimate_body(statement.body) + self.estimate_body(statement.orelse)
+        if isinstance(statement, ast.While):
+            self.exact = False
+            return self.estimate_body(statement.body)
+        if isinstance(statement, ast.If):
+            body, orelse = self.estimate_body(statement.body), self.estimate_body(statement.orelse)
+            if body != orelse:
+                self.exact = False
+            return max(body, orelse)
+        if isinstance(statement, (ast.With, ast.AsyncWith)):
+            return self.estimate_body(statement.body)
+        if isinstance(statement, ast.Try):
+            return self.estimate_body(statement.body) + self.estimate_body(statement.orelse) + self.estimate_body(statement.finalbody)
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            return 0.0
+        return sum(self.estimate_call(node) for node in ast.walk(statement) if isinstance(node, ast.Call))
+
+    def estimate_call(self, call):
+        function = call.func
+        if not (isinstance(function, ast.Attribute) and isinstance(function.value, ast.Name) and function.value.id == "self"):
+            return 0.0
+        if function.attr == "play":
+            if any(item.arg == "run_time" for item in call.keywords):
+                return self.get_argument(call, None, "run_time")
+            # without a run_time on the play call, the longest of the animations' own run times applies
+            return max((
+                self.get_argument(argument, None, "run_time") for argument in call.args
+                if isinstance(argument, ast.Call) and any(item.arg == "run_time" for item in argument.keywords)
+            ), default=DEFAULT_RUN_TIME)
+        if function.attr in ("wait", "pause"):
+            return self.get_argument(call, 0, "duration")
+        if function.attr in self.methods:
+            return self.estimate_method(function.attr)
+        return 0.0
+
+    def get_argument(self, call, position, keyword):
+        node = next((item.value for item in call.keywords if item.arg == keyword), None)
+        if node is None and position is not None and len(call.args) > position:
+            node = call.args[position]
+        if node is None:
+            return DEFAULT_RUN_TIME
+        value = evaluate_number(node)
+        if value is None:
+            self.exact = False
+            return DEFAULT_RUN_TIME
+        return max(value, 0.0)
+
+
+def find_construct(tree):
+    """
+    Finds the scene class of the module and its construct method
+    :return: scene class and construct method, None if there is none (ast.ClassDef, ast.FunctionDef)
+    """
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+    scene_class = next((node for node in classes if node.name == SCENE_CLASS_NAME), None)
+    if scene_class is None and len(classes) == 1:
+        scene_class = classes[0]
+    if scene_class is None:
+        return None, None
+    construct = next((node for node in scene_class.body if isinstance(node, ast.FunctionDef) and node.name == "construct"), None)
+    return scene_class, construct
+
+
+def estimate_scene_duration(code):
+    """
+    Statically estimates how long the animation of a manim scene lasts, by adding up its self.play run times and self.wait durations
+    :param code: Manim code (string)
+    :return: estimated duration in seconds and whether the estimate is exact, None if the code has no scene to estimate (float, bool)
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None, False
+    scene_class, construct = find_construct(tree)
+    if construct is None:
+        return None, False
+
+    methods = {node.name: node for node in scene_class.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    estimator = DurationEstimator(methods)
+    return estimator.estimate_method("construct"), estimator.exact
+
+
+def get_line_prefix(line, col_offset):
+    # ast column offsets count utf-8 bytes, not characters
+    return line.encode()[:col_offset].decode()
+
+
+def append_wait(code, seconds):
+    """
+    Adds a self.wait of the given length to the end of the scene's construct method
+    :param code: Manim code (string)
+    :param seconds: Length of the wait (float)
+    :return: code with the wait added (string)
+    """
+    _, construct = find_construct(ast.parse(code))
+    lines = code.splitlines()
+    wait = f"self.wait({seconds:.2f})"
+    last = construct.body[-1]
+    # a wait after a final return would never run
+    before = isinstance(last, ast.Return)
+    prefix = get_line_prefix(lines[last.lineno - 1], last.col_offset)
+    if not prefix.strip():
+        # the statement starts its own line, the wait gets one with the same indentation
+        lines.insert(last.lineno - 1 if before else last.end_lineno, f"{prefix}{wait}")
+    elif before:
+        lines[last.lineno - 1] = f"{prefix}{wait}; {lines[last.lineno - 1][len(prefix):]}"
+    else:
+        # the statement shares its line with the def or other statements, e.g. def construct(self): self.play(...)
+        end_prefix = get_line_prefix(lines[last.end_lineno - 1], last.end_col_offset)
+        lines[last.end_lineno - 1] = f"{end_prefix}; {wait}{lines[last.end_lineno - 1][len(end_prefix):]}"
+    return "\n".join(lines) + "\n"
+
+
+def fit_scene_duration(code, target_duration):
+    """
+    Checks the estimated length of the scene against the length of its narration, and pads scenes that are too short with a final wait
+    :param code: Manim code (string)
+    :param target_duration: Length of the narration in seconds (float)
+    :return: code, padded if needed, and an error message if the scene is far too long, None otherwise (string, string)
+    """
+    estimate, exact = estimate_scene_duration(code)
+    if estimate is None:
+        return code, None
+    logger.info(f"Estimated scene duration: {estimate:.2f}s ({'exact' if exact else 'approximate'}), target: {target_duration:.2f}s")
+
+    if exact and target_duration - estimate > PADDING_EPSILON:
+        logger.info(f"Padding scene with a {target_duration - estimate:.2f}s wait")
+        return append_wait(code, target_duration - estimate), None
+
+    if estimate > target_duration * (1 + DURATION_TOLERANCE) + DEFAULT_RUN_TIME:
+        return code, (
+            f"The animation lasts about {estimate:.1f} seconds, but the narration only lasts {target_duration:.1f} seconds. "
+            f"Shorten the run_time and wait calls so the animation lasts {target_duration:.1f} seconds."
+        )
+    return code, None
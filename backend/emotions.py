@@ -0,0 +1,352 @@
+import abc
+import asyncio
+import base64
+import contextlib
+import hashlib
+import os
+from logger import logger
+
+
+"""
+Emotion analysis of webcam frames, behind a provider interface.
+
+An EmotionProvider turns a batch of frames into emotion scores per frame. The hume provider sends the frames to the Hume streaming api, the stub provider scores them locally and deterministically, so the /ws socket works offline, in tests and under load tests without an API key. Frames of all clients go through the EmotionBatcher, which collects the frames that arrive within a few milliseconds of each other into one batch for the provider. Every client smooths the scores of its frames with an exponential moving average, and only the top emotions of the smoothed scores are sent to the browser.
+
+The hume provider keeps HUME_POOL_SIZE warm Hume streams, shared by all clients, instead of one stream per browser tab. A stream answers its requests in order, so it is lent to one analysis at a time and the answer goes back to whoever sent the frame. A stream is ready once its handshake is done and it has answered a job details request, instead of after a fixed sleep, and streams that fail or are abandoned in the middle of a request are closed and reopened on their next use. The streaming api takes a single image per message, so a batch becomes concurrent requests on the pooled streams. Faces are not identified across frames, since the frames on a stream come from different people.
+"""
+
+# hume or stub
+EMOTION_PROVIDER = os.getenv("EMOTION_PROVIDER") or "hume"
+
+# frames analyzed in one batch, and seconds the batcher waits for more frames
+EMOTION_BATCH_SIZE = int(os.getenv("EMOTION_BATCH_SIZE") or 8)
+EMOTION_BATCH_WAIT = float(os.getenv("EMOTION_BATCH_WAIT") or 0.02)
+
+# weight of the newest scores in the moving average
+EMOTION_SMOOTHING = float(os.getenv("EMOTION_SMOOTHING") or 0.3)
+
+# number of emotions sent to the browser, and passed on to /generate/
+EMOTION_TOP_K = int(os.getenv("EMOTION_TOP_K") or 3)
+
+# expressions the stub provider scores, named like the ones of the Hume face model
+STUB_EMOTIONS = (
+    "Boredom", "Calmness", "Concentration", "Confusion", "Contemplation", "Determination",
+    "Doubt", "Excitement", "Interest", "Joy", "Sadness", "Tiredness",
+)
+
+# Hume streams kept open for all clients
+HUME_POOL_SIZE = int(os.getenv("HUME_POOL_SIZE") or 4)
+
+# seconds a stream may take to open and answer the readiness check
+HUME_CONNECT_TIMEOUT = float(os.getenv("HUME_CONNECT_TIMEOUT") or 10)
+
+
+def load_hume():
+    """
+    Imports the hume SDK
+    :return: the HumeStreamClient and FaceConfig classes
+    """
+    from hume import HumeStreamClient
+    from hume.models.config import FaceConfig
+    return HumeStreamClient, FaceConfig
+
+
+class HumeSession:
+    """
+    Initializes the HumeSession, a single Hume stream that is opened on demand
+    :param client: Hume streaming client (HumeStreamClient)
+    :param configs: Model configurations of the stream (list)
+    """
+    def __init__(self, client, configs):
+        self.client = client
+        self.configs = configs
+        self.socket = None
+        self.stack = None
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    async def connect(self):
+        """
+        Opens the stream and waits until it answers
+        """
+        stack = contextlib.AsyncExitStack()
+        try:
+            self.socket = await asyncio.wait_for(
+                stack.enter_async_context(self.client.connect(self.configs)), timeout=HUME_CONNECT_TIMEOUT
+            )
+            # the first answer shows the stream is ready for frames
+            await asyncio.wait_for(self.socket.get_job_details(), timeout=HUME_CONNECT_TIMEOUT)
+        except BaseException:
+            self.socket = None
+            await stack.aclose()
+            raise
+        self.stack = stack
+        logger.info("Connected to Hume API")
+
+    async def close(self):
+        if self.stack is not None:
+            try:
+                await self.stack.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing Hume stream: {e}")
+        self.socket = None
+        self.stack = None
+
+
+class HumePool:
+    """
+    Initializes the HumePool with the given number of streams
+    :param size: Number of streams kept open (int)
+    """
+    def __init__(self, size=HUME_POOL_SIZE):
+        self.size = max(1, size)
+        self.sessions = []
+        self.idle = None
+
+    async def create_sessions(self):
+        if self.idle is not None:
+            return
+        # the SDK is imported off the event loop, and only by the hume provider
+        HumeStreamClient, FaceConfig = await asyncio.to_thread(load_hume)
+        if self.idle is not None:
+            # created by another caller in the meantime
+            return
+        client = HumeStreamClient(api_key=os.getenv("HUME_API_KEY"))
+        configs = [FaceConfig(identify_faces=False)]
+        self.sessions = [HumeSession(client, configs) for _ in range(self.size)]
+        self.idle = asyncio.Queue()
+        for session in self.sessions:
+            self.idle.put_nowait(session)
+
+    async def start(self):
+        """
+        Opens all streams ahead of the first client, a stream that can not be opened is retried on its first use
+        """
+        await self.create_sessions()
+        results = await asyncio.gather(*(self.open_session() for _ in self.sessions), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.warning(f"Could not open {len(errors)} of {self.size} Hume streams: {errors[0]}")
+
+    async def stop(self):
+        await asyncio.gather(*(session.close() for session in self.sessions), return_exceptions=True)
+
+    async def open_session(self):
+        # borrowed like for a request, so a stream a client is already opening is not opened twice
+        async with self.session():
+            pass
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Lends an open stream for a single request
+        """
+        await self.create_sessions()
+        session = await self.idle.get()
+        try:
+            if not session.connected:
+                await session.connect()
+            yield session.socket
+        except BaseException:
+            # the stream may still owe an answer, which would go to the next request
+            await session.close()
+            raise
+        finally:
+            self.idle.put_nowait(session)
+
+    async def analyze(self, frame):
+        """
+        Predicts the facial expressions in a frame
+        :param frame: Encoded JPEG, WebP or PNG image (bytes)
+        :return: predictions of the Hume face model (dict)
+        """
+        for attempt in range(2):
+            try:
+                async with self.session() as socket:
+                    # the streaming api takes the image base64 encoded
+                    return await socket.send_bytes(base64.b64encode(frame))
+            except Exception as e:
+                # streams are closed by Hume after a while, the second attempt gets a fresh one
+                if attempt == 1:
+                    raise
+                logger.warning(f"Hume stream failed, retrying on a new stream: {e}")
+
+
+class EmotionProvider(abc.ABC):
+    """
+    Interface of the emotion backends: frames go in, emotion scores come out
+    """
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def analyze_batch(self, frames):
+        """
+        Scores the emotions in each frame
+        :param frames: Encoded images (list of bytes)
+        :return: per frame the emotion names mapped to scores between 0 and 1, empty if there is no face, or the exception its analysis failed with (list of dicts or Exceptions)
+        """
+        raise NotImplementedError
+
+
+class HumeProvider(EmotionProvider):
+    """
+    Initializes the HumeProvider, which analyzes frames with the Hume face model on a pool of streams
+    :param pool: Pool of Hume streams (HumePool)
+    """
+    def __init__(self, pool=None):
+        self.pool = pool or HumePool()
+
+    async def start(self):
+        await self.pool.start()
+
+    async def stop(self):
+        await self.pool.stop()
+
+    async def analyze_batch(self, frames):
+        results = await asyncio.gather(*(self.pool.analyze(frame) for frame in frames), return_exceptions=True)
+        return [result if isinstance(result, BaseException) else self.parse(result) for result in results]
+
+    def parse(self, result):
+        if "error" in result:
+            return RuntimeError(f"Hume could not analyze the frame: {result['error']}")
+        # without a face there are no predictions, only a warning
+        predictions = (result.get("face") or {}).get("predictions") or []
+        if not predictions:
+            return {}
+        return {emotion["name"]: emotion["score"] for emotion in predictions[0]["emotions"]}
+
+
+class StubEmotionProvider(EmotionProvider):
+    """
+    Initializes the StubEmotionProvider, which derives scores from the bytes of the frame, so the same frame always gets the same scores
+    """
+    async def analyze_batch(self, frames):
+        return [self.score(frame) for frame in frames]
+
+    def score(self, frame):
+        digest = hashlib.sha256(frame).digest()
+        return {emotion: digest[index] / 255 for index, emotion in enumerate(STUB_EMOTIONS)}
+
+
+class EmotionBatcher:
+    """
+    Initializes the EmotionBatcher, which collects frames from all clients into batches for the provider
+    :param provider: Emotion backend (EmotionProvider)
+    :param batch_size: Maximum number of frames in a batch (int)
+    :param wait: Seconds to wait for more frames once the first frame of a batch arrived (float)
+    """
+    def __init__(self, provider, batch_size=EMOTION_BATCH_SIZE, wait=EMOTION_BATCH_WAIT):
+        self.provider = provider
+        self.batch_size = max(1, batch_size)
+        self.wait = wait
+        self.queue = None
+        self.worker_task = None
+
+    def start(self):
+        """
+        Starts the worker task on the running event loop, if it is not running yet
+        """
+        if self.worker_task is not None:
+            return
+        self.queue = asyncio.Queue()
+        self.worker_task = asyncio.create_task(self.worker())
+
+    async def stop(self):
+        if self.worker_task is not None:
+            self.worker_task.cancel()
+            await asyncio.gather(self.worker_task, return_exceptions=True)
+        self.worker_task = None
+        self.queue = None
+
+    async def analyze(self, frame):
+        """
+        Queues the frame for the next batch and waits for its scores
+        :param frame: Encoded image (bytes)
+        :return: emotion names mapped to scores, empty if there is no face (dict)
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((frame, future))
+        return await future
+
+    async def worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # clients that went away in the meantime do not need their frames analyzed
+            batch = [(frame, future) for frame, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                results = await self.provider.analyze_batch([frame for frame, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class EmotionSmoother:
+    """
+    Initializes the EmotionSmoother, which keeps an exponential moving average of the scores of a single client
+    :param smoothing: Weight of the newest scores (float)
+    :param top_k: Number of emotions in the summary (int)
+    """
+    def __init__(self, smoothing=EMOTION_SMOOTHING, top_k=EMOTION_TOP_K):
+        self.smoothing = smoothing
+        self.top_k = top_k
+        self.scores = {}
+
+    def update(self, scores):
+        """
+        Adds the scores of a frame to the average
+        :param scores: Emotion names mapped to scores, empty if there was no face (dict)
+        :return: the top emotions of the average, comma separated (string)
+        """
+        if scores:
+            if not self.scores:
+                self.scores = dict(scores)
+            else:
+                for emotion in self.scores.keys() | scores.keys():
+                    self.scores[emotion] = self.smoothing * scores.get(emotion, 0) + (1 - self.smoothing) * self.scores.get(emotion, 0)
+        return self.summary()
+
+    def summary(self):
+        ranked = sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+        return ", ".join(emotion for emotion, _ in ranked[:self.top_k])
+
+
+def create_emotion_provider(provider=EMOTION_PROVIDER):
+    """
+    Creates the emotion backend
+    :param provider: hume or stub (string)
+    :return: the emotion backend (EmotionProvider)
+    """
+    if provider == "hume":
+        return HumeProvider()
+    if provider == "stub":
+        return StubEmotionProvider()
+    raise ValueError(f"Unknown emotion provider {provider}, expected hume or stub")
+
+
+emotion_provider = create_emotion_provider()
+emotion_batcher = EmotionBatcher(emotion_provider)
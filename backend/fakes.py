@@ -0,0 +1,184 @@
+import asyncio
+import glob
+import io
+import json
+import math
+import os
+import random
+import re
+import struct
+import wave
+from types import SimpleNamespace
+from logger import logger
+
+
+"""
+Offline stand-ins for the LLM and speech providers, for benchmarks and development without API keys.
+
+Selected with LLM_CLIENT=fake and TTS_CLIENT=fake. The fake LLM serves the chat.completions.create interface of the openai client. Transcript requests get a JSON array of scenes about the topic, and codegen requests replay the manim programs in experimentation/claude and experimentation/openai, renamed to the VideoScene class the pipeline renders. A share of the codegen responses is broken on purpose, in the ways real responses break, so the autofixer and the retry loop are exercised too. The fake speech provider returns a tone as a WAV file, as long as the text would take to read aloud.
+
+Both wait a configurable time before answering, to stand in for the provider's latency. Responses are drawn from a seeded random generator, so two runs with the same settings make the same choices.
+"""
+
+# directories of the manim programs the fake LLM replays
+FAKE_LLM_PROGRAMS_PATH = os.getenv("FAKE_LLM_PROGRAMS_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "experimentation"
+)
+
+# seconds the fake providers take to answer
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY") or 2)
+FAKE_TTS_LATENCY = float(os.getenv("FAKE_TTS_LATENCY") or 0.5)
+
+# share of codegen responses that are broken on purpose
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE") or 0.1)
+
+# number of scenes in a fake transcript
+FAKE_TRANSCRIPT_SCENES = int(os.getenv("FAKE_TRANSCRIPT_SCENES") or 3)
+
+FAKE_SEED = int(os.getenv("FAKE_SEED") or 0)
+
+# reading speed of the fake narration, about the speed of the real voice
+FAKE_TTS_WORDS_PER_SECOND = 2.5
+FAKE_TTS_SAMPLE_RATE = 16000
+
+# long enough to narrate the longest replayed program, so scenes are padded instead of regenerated
+FAKE_SCENE_TEMPLATE = (
+    "Part {number} of our look at {topic}. On the screen we start with a simple picture and build it up one piece at a time, "
+    "so that every new idea rests on the one before it. Watch how each shape moves into place, and notice which parts stay "
+    "the same while others change. Take a moment to think about why that happens, because that is the heart of {topic}. "
+    "Once you see the pattern here, the next step will feel natural rather than surprising."
+)
+
+SCENE_CLASS_PATTERN = re.compile(r"^class \w+\((\w*Scene)\):", re.MULTILINE)
+
+# ways a codegen response is broken, the last one needs another LLM round trip
+FAILURES = ("markdown_fence", "undefined_color", "scene_class_name", "truncated")
+
+
+def load_programs(path=FAKE_LLM_PROGRAMS_PATH):
+    """
+    Reads the manim programs the fake LLM replays
+    :param path: Directory with a folder of programs per model (string)
+    :return: source code of the programs, in a stable order (list of strings)
+    """
+    programs = []
+    for program_path in sorted(glob.glob(f"{path}/*/*.py")):
+        with open(program_path) as program_file:
+            code = program_file.read()
+        if SCENE_CLASS_PATTERN.search(code):
+            programs.append(code)
+    if not programs:
+        raise RuntimeError(f"No manim programs to replay in {path}")
+    return programs
+
+
+def break_program(code, failure):
+    """
+    Breaks the program the way LLM responses break
+    :param code: Working program, with the VideoScene class (string)
+    :param failure: One of FAILURES (string)
+    :return: broken program (string)
+    """
+    if failure == "markdown_fence":
+        return f"python\n{code}\n"
+    if failure == "undefined_color":
+        return re.sub(r"\b(BLUE|RED|GREEN|YELLOW|WHITE)\b", "BROWN", code, count=1)
+    if failure == "scene_class_name":
+        return code.replace("class VideoScene(", "class GeneratedScene(", 1)
+    return code[:len(code) // 2]
+
+
+class FakeCompletions:
+    """
+    Initializes the FakeCompletions, which answer like the chat.completions api of the openai client
+    :param programs: Manim programs to replay (list of strings)
+    :param latency: Seconds every response takes (float)
+    :param failure_rate: Share of codegen responses that are broken (float)
+    :param seed: Seed of the random choices (int)
+    """
+    def __init__(self, programs=None, latency=FAKE_LLM_LATENCY, failure_rate=FAKE_LLM_FAILURE_RATE, seed=FAKE_SEED):
+        self.programs = programs if programs is not None else load_programs()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.failures = {failure: 0 for failure in FAILURES}
+
+    async def create(self, model, messages, temperature=None, stream=False):
+        system_prompt = next((message["content"] for message in messages if message["role"] == "system"), "")
+        request = messages[-1]["content"]
+        if "Manim code" in system_prompt:
+            content = self.generate_code()
+        else:
+            content = self.generate_transcript(request)
+
+        if stream:
+            return self.stream(content)
+        await asyncio.sleep(self.latency)
+        return self.respond(content, messages)
+
+    def respond(self, content, messages):
+        prompt_length = sum(len(message["content"]) for message in messages)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+            # about four characters per token
+            usage=SimpleNamespace(prompt_tokens=prompt_length // 4, completion_tokens=len(content) // 4),
+        )
+
+    async def stream(self, content, chunk_size=32):
+        chunks = [content[start:start + chunk_size] for start in range(0, len(content), chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))])
+
+    def generate_transcript(self, topic):
+        topic = " ".join(topic.split()) or "this topic"
+        return json.dumps([
+            FAKE_SCENE_TEMPLATE.format(number=number + 1, topic=topic) for number in range(FAKE_TRANSCRIPT_SCENES)
+        ], indent=4)
+
+    def generate_code(self):
+        code = SCENE_CLASS_PATTERN.sub(r"class VideoScene(\1):", self.random.choice(self.programs), count=1)
+        if self.random.random() < self.failure_rate:
+            failure = self.random.choice(FAILURES)
+            self.failures[failure] += 1
+            logger.info(f"Fake LLM is answering with a {failure} failure")
+            code = break_program(code, failure)
+        return code
+
+
+class FakeSpeech:
+    """
+    Initializes the FakeSpeech, which synthesizes a tone as long as the text would take to read aloud
+    :param latency: Seconds every synthesis takes (float)
+    """
+    def __init__(self, latency=FAKE_TTS_LATENCY):
+        self.latency = latency
+
+    async def synthesize(self, text, voice, format="wav", temperature=None):
+        await asyncio.sleep(self.latency)
+        duration = max(1.0, len(text.split()) / FAKE_TTS_WORDS_PER_SECOND)
+        return {"audio": synthesize_tone(duration)}
+
+
+def synthesize_tone(duration, frequency=220, sample_rate=FAKE_TTS_SAMPLE_RATE):
+    """
+    Returns a quiet sine tone as a mono 16 bit WAV file
+    :param duration: Length of the tone in seconds (float)
+    :return: WAV file (bytes)
+    """
+    # one period repeated, instead of computing every sample
+    period = [
+        int(3000 * math.sin(2 * math.pi * index / (sample_rate / frequency)))
+        for index in range(int(sample_rate / frequency))
+    ]
+    samples = int(duration * sample_rate)
+    period_bytes = struct.pack(f"<{len(period)}h", *period)
+    frames = (period_bytes * (samples // len(period) + 1))[:samples * 2]
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(frames)
+    return buffer.getvalue()
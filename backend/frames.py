@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import binascii
+import functools
+import io
+import os
+import re
+import time
+from logger import logger
+
+
+"""
+Webcam frames sent over the /ws websocket for emotion analysis.
+
+Frames arrive as binary websocket messages holding a JPEG or WebP image, and are passed on to the emotion backend as bytes, without ever touching the disk. Older clients that send a base64 data URL as text are still understood.
+
+Only the newest frame that has not been analyzed yet is kept, a frame that arrives while the previous one waits replaces it, so a slow emotion backend never builds a backlog of stale frames. Frames that look the same as the last analyzed frame, compared by a difference hash of a tiny grayscale thumbnail, are skipped. The time between analyses follows the measured latency of the emotion backend, so when it slows down every connection backs off instead of piling more requests on it.
+"""
+
+# larger frames are dropped, a webcam frame for emotion analysis is a few dozen kilobytes
+MAX_FRAME_BYTES = int(os.getenv("MAX_FRAME_BYTES") or 1024 ** 2)
+
+# bounds of the time between two analyses of a connection (seconds)
+FRAME_MIN_INTERVAL = float(os.getenv("FRAME_MIN_INTERVAL") or 1)
+FRAME_MAX_INTERVAL = float(os.getenv("FRAME_MAX_INTERVAL") or 5)
+
+# the time between analyses is this many times the average latency of the emotion backend
+FRAME_LATENCY_FACTOR = float(os.getenv("FRAME_LATENCY_FACTOR") or 2)
+
+# frames whose hash differs from the last analyzed frame in at most this many of 64 bits look the same
+FRAME_CHANGE_THRESHOLD = int(os.getenv("FRAME_CHANGE_THRESHOLD") or 4)
+
+# a frame that looks the same is still analyzed once the last analysis is this old (seconds)
+FRAME_REFRESH_SECONDS = float(os.getenv("FRAME_REFRESH_SECONDS") or 10)
+
+# weight of the newest latency in the moving average
+LATENCY_SMOOTHING = 0.3
+
+DATA_URL_PATTERN = re.compile(r"data:image/(?:png|jpeg|webp);base64,")
+
+
+def decode_frame(message):
+    """
+    Reads the image out of a websocket message
+    :param message: Message as returned by WebSocket.receive (dict)
+    :return: encoded image, None if the message does not hold a usable frame (bytes)
+    """
+    frame = message.get("bytes")
+    if frame is None:
+        text = message.get("text") or ""
+        match = DATA_URL_PATTERN.match(text)
+        if match is None:
+            logger.warning(f"Received unexpected data format: {text[:50]}...")
+            return None
+        try:
+            frame = base64.b64decode(text[match.end():], validate=True)
+        except binascii.Error as e:
+            logger.warning(f"Received a data URL that is not valid base64: {e}")
+            return None
+
+    if not frame:
+        return None
+    if len(frame) > MAX_FRAME_BYTES:
+        logger.warning(f"Dropping a frame of {len(frame)} bytes, frames may be at most {MAX_FRAME_BYTES} bytes")
+        return None
+    return frame
+
+
+@functools.cache
+def load_pillow():
+    """
+    Imports pillow on the first frame instead of when the server starts
+    :return: the PIL.Image module, None if pillow is missing
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        # without pillow every frame is analyzed
+        return None
+    return Image
+
+
+def difference_hash(frame):
+    """
+    Computes the difference hash of an image: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour
+    :param frame: Encoded image (bytes)
+    :return: 64 bit hash, None if pillow is missing or the image can not be decoded (int)
+    """
+    Image = load_pillow()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(frame)) as image:
+            # lets jpeg decode at a fraction of the resolution
+            image.draft("L", (36, 32))
+            pixels = image.convert("L").resize((9, 8)).tobytes()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not decode frame: {e}")
+        return None
+    frame_hash = 0
+    for row in range(8):
+        for column in range(8):
+            left, right = pixels[row * 9 + column], pixels[row * 9 + column + 1]
+            frame_hash = frame_hash << 1 | (left > right)
+    return frame_hash
+
+
+class LatestFrame:
+    """
+    Initializes the LatestFrame, which holds the newest frame that has not been analyzed yet
+    """
+    def __init__(self):
+        self.frame = None
+        self.available = asyncio.Event()
+        # frames that were replaced by a newer one before they were analyzed
+        self.superseded = 0
+
+    def put(self, frame):
+        if self.frame is not None:
+            self.superseded += 1
+        self.frame = frame
+        self.available.set()
+
+    async def get(self):
+        """
+        Waits for a frame, and takes it
+        :return: encoded image (bytes)
+        """
+        while self.frame is None:
+            self.available.clear()
+            await self.available.wait()
+        frame, self.frame = self.frame, None
+        return frame
+
+
+class FrameThrottle:
+    """
+    Initializes the FrameThrottle, which decides when the next frame of a connection is analyzed and whether it is worth analyzing
+    """
+    def __init__(self):
+        self.latency = None
+        self.last_hash = None
+        self.last_analyzed_at = None
+        self.skipped = 0
+
+    @property
+    def interval(self):
+        if self.latency is None:
+            return FRAME_MIN_INTERVAL
+        return min(FRAME_MAX_INTERVAL, max(FRAME_MIN_INTERVAL, self.latency * FRAME_LATENCY_FACTOR))
+
+    async def wait(self):
+        """
+        Waits until the next analysis is due
+        """
+        if self.last_analyzed_at is not None:
+            await asyncio.sleep(self.last_analyzed_at + self.interval - time.monotonic())
+
+    def is_unchanged(self, frame_hash):
+        """
+        Checks whether the frame looks the same as the last analyzed frame, and that analysis is still recent
+        :param frame_hash: Difference hash of the frame (int)
+        """
+        if frame_hash is None or self.last_hash is None:
+            return False
+        if time.monotonic() - self.last_analyzed_at > FRAME_REFRESH_SECONDS:
+            return False
+        if bin(frame_hash ^ self.last_hash).count("1") > FRAME_CHANGE_THRESHOLD:
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, started_at, frame_hash):
+        """
+        Records an analysis, to time the next one
+        :param started_at: time.monotonic() when the analysis started (float)
+        :param frame_hash: Difference hash of the analyzed frame (int)
+        """
+        latency = time.monotonic() - started_at
+        self.latency = latency if self.latency is None else LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+        self.last_analyzed_at = started_at
+        self.last_hash = frame_hash
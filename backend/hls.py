@@ -0,0 +1,143 @@
+import asyncio
+import csv
+import math
+import os
+from logger import logger
+import muxer
+
+
+"""
+Publishes narrated scenes as a growing HLS playlist while later scenes are still being generated.
+
+Scenes finish in any order, but are only appended to the playlist once every scene before them has been published or has failed, so the playlist always plays the video from the start. Each scene is cut into MPEG-TS segments with a stream copy, offset so its timestamps continue where the previous scene ended.
+"""
+
+PLAYLIST_NAME = "playlist.m3u8"
+
+# target length of a segment, segments are cut on keyframes so they may be longer
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS") or 6)
+
+
+class HlsPublisher:
+    """
+    Initializes the HlsPublisher for a single video
+    :param output_dir: Directory the playlist and segments are written to (string)
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.pending = {}
+        self.next_index = 0
+        self.segments = []
+        self.offset = 0.0
+        self.finished = False
+        self.lock = asyncio.Lock()
+        self.first_segment = asyncio.Event()
+
+    @property
+    def playlist_path(self):
+        return f"{self.output_dir}/{PLAYLIST_NAME}"
+
+    async def start(self):
+        """
+        Writes an empty playlist, so players can start polling it right away
+        """
+        async with self.lock:
+            self.write_playlist()
+
+    async def publish(self, index, scene_path):
+        """
+        Marks the scene at the given position as ready and publishes every scene that is now unblocked
+        :param index: Position of the scene in the video (int)
+        :param scene_path: Path to the narrated scene (string)
+        """
+        self.pending[index] = scene_path
+        await self.flush()
+
+    async def skip(self, index):
+        """
+        Marks the scene at the given position as failed, so later scenes are not held back by it
+        :param index: Position of the scene in the video (int)
+        """
+        self.pending[index] = None
+        await self.flush()
+
+    async def finish(self):
+        """
+        Ends the playlist, no more scenes will be added to it
+        """
+        async with self.lock:
+            self.finished = True
+            self.write_playlist()
+
+    async def flush(self):
+        async with self.lock:
+            while self.next_index in self.pending:
+                scene_path = self.pending.pop(self.next_index)
+                if scene_path is not None:
+                    try:
+                        await self.segment_scene(self.next_index, scene_path)
+                    except Exception as e:
+                        logger.error(f"Error publishing scene {self.next_index}: {e}")
+                self.next_index += 1
+            self.write_playlist()
+
+    async def segment_scene(self, index, scene_path):
+        """
+        Cuts the scene into MPEG-TS segments without re-encoding it
+        :param index: Position of the scene in the video (int)
+        :param scene_path: Path to the narrated scene (string)
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        list_path = f"{self.output_dir}/scene{index:02d}.csv"
+        await muxer.run_ffmpeg(
+            "-i", scene_path,
+            "-map", "0", "-c", "copy",
+            "-f", "segment",
+            "-segment_time", str(HLS_SEGMENT_SECONDS),
+            "-segment_format", "mpegts",
+            "-segment_list", list_path,
+            "-segment_list_type", "csv",
+            "-output_ts_offset", f"{self.offset:.6f}",
+            f"{self.output_dir}/scene{index:02d}_%03d.ts",
+        )
+
+        with open(list_path, newline="") as list_file:
+            rows = list(csv.reader(list_file))
+        os.remove(list_path)
+
+        # the reported end times include the offset, the first start time does not
+        for position, (name, _, end) in enumerate(rows):
+            duration = float(end) - self.offset
+            # scenes do not share timestamps or encoder state, tell the player to reset at the boundary
+            discontinuity = position == 0 and bool(self.segments)
+            self.segments.append((name, duration, discontinuity))
+            self.offset = float(end)
+
+        logger.info(f"Published scene {index} as {len(rows)} segments")
+        self.first_segment.set()
+
+    def write_playlist(self):
+        """
+        Atomically replaces the playlist with the currently published segments
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        longest = max((duration for _, duration, _ in self.segments), default=HLS_SEGMENT_SECONDS)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max(longest, HLS_SEGMENT_SECONDS))}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for name, duration, discontinuity in self.segments:
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(name)
+        if self.finished:
+            lines.append("#EXT-X-ENDLIST")
+
+        temporary_path = f"{self.playlist_path}.tmp"
+        with open(temporary_path, "w") as playlist_file:
+            playlist_file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, self.playlist_path)
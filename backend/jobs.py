@@ -0,0 +1,390 @@
+import asyncio
+import contextlib
+import os
+import shutil
+import time
+import uuid
+from transcript_generator import TranscriptGenerator
+from scene_generator import SceneGenerator, GENERATIONS_PATH, HLS_PATH
+from hls import PLAYLIST_NAME
+from limits import current_job
+from manifest import Manifest
+from metrics import current_spans, summarize
+from logger import logger
+
+
+"""
+Runs video generations as background jobs.
+
+Posting a topic creates a job and returns its id right away, unless too many jobs are already waiting. A fixed number of scheduler workers, sized independently of the web server, take jobs off a queue and run the transcript, codegen, render, speech, mux and concat stages, recording the progress of each stage per scene so clients can poll or subscribe to it.
+
+A job can be cancelled explicitly, and is cancelled when nobody has polled or subscribed to it for a while, since nobody will fetch its video. Cancelling a job cancels its task, which stops its LLM calls, speech syntheses and renders, and removes whatever it had generated so far.
+
+Every job keeps its progress in the manifest of its video. Jobs that were queued or running when the server stopped are queued again on startup, and a failed job can be retried. Either way the job skips every stage the manifest records as done, and only redoes the rest.
+"""
+
+# number of videos that are generated at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS") or 2)
+
+# start generating scenes while the transcript is still being written
+TRANSCRIPT_STREAMING = (os.getenv("TRANSCRIPT_STREAMING") or "1") != "0"
+
+# jobs that may wait for a worker before new ones are turned away
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS") or 20)
+
+# seconds a finished job is kept around for status requests
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS") or 3600)
+
+# seconds an unfinished job may go without being polled or subscribed to before it is cancelled, 0 never cancels
+JOB_ABANDON_SECONDS = float(os.getenv("JOB_ABANDON_SECONDS") or 300)
+
+# seconds between checks for abandoned jobs
+JOB_REAP_INTERVAL = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """
+    Initializes the Job for the given topic
+    :param text: Topic of the video (string)
+    :param emotions: Comma separated list of emotions of the student (string)
+    :param job_id: Id of a job that is resumed, a new id by default (string)
+    :param manifest: Manifest of a job that is resumed, a new one by default (Manifest)
+    """
+    def __init__(self, text, emotions, job_id=None, manifest=None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.text = text
+        self.emotions = emotions
+        self.manifest = manifest or Manifest.create(f"{GENERATIONS_PATH}/{self.job_id}", self.job_id, text, emotions)
+        self.status = QUEUED
+        self.error = None
+        self.stages = {}
+        self.scenes = []
+        self.transcript = []
+        self.scene_generator = None
+        # timing spans of every stage the job ran
+        self.spans = []
+        self.task = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.changed = asyncio.Event()
+        # last time a client asked about the job, and the number of clients subscribed to it
+        self.last_seen = self.created_at
+        self.watchers = 0
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def touch(self):
+        """
+        Records that a client is still interested in the job
+        """
+        self.last_seen = time.time()
+
+    def notify(self):
+        """
+        Wakes up everyone waiting for a change of the job
+        """
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        if self.finished:
+            self.finished_at = time.time()
+        # the files of a cancelled job are removed, writing its manifest would bring the folder back
+        if status != CANCELLED:
+            self.manifest.update(status=status, error=error)
+        self.notify()
+
+    def reset(self):
+        """
+        Forgets the progress of an earlier run, which is reported again as the job is resumed
+        """
+        self.error = None
+        self.stages = {}
+        self.scenes = []
+        self.transcript = []
+        self.scene_generator = None
+        self.spans.clear()
+        self.finished_at = None
+
+    def report(self, stage, state, scene_index=None, details=None):
+        """
+        Records the progress of a stage, passed to the SceneGenerator as its progress callback
+        :param stage: Name of the stage (string)
+        :param state: running, done or failed (string)
+        :param scene_index: Position of the scene the stage belongs to, None for stages of the whole video (int)
+        :param details: Extra information about the stage, e.g. the codegen attempt (dict)
+        """
+        stages = self.stages if scene_index is None else self.scenes[scene_index]["stages"]
+        stages[stage] = {"state": state, "updated_at": time.time(), **(details or {})}
+        self.notify()
+
+    def add_scene(self, transcription):
+        self.transcript.append(transcription)
+        self.scenes.append({"index": len(self.scenes), "transcription": transcription, "stages": {}})
+        self.notify()
+
+    def to_dict(self):
+        publisher = self.scene_generator.publisher if self.scene_generator else None
+        return {
+            "job_id": self.job_id,
+            "video_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "stages": self.stages,
+            "scenes": self.scenes,
+            "timings": summarize(self.spans),
+            "playlist": f"/videos/{self.job_id}/{HLS_PATH}/{PLAYLIST_NAME}",
+            "playlist_ready": bool(publisher and publisher.first_segment.is_set()),
+            "video": f"/videos/{self.job_id}" if self.status == DONE else None,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """
+    Initializes the JobScheduler with the given number of workers
+    :param workers: Number of jobs that run at the same time (int)
+    """
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = max(1, workers)
+        self.jobs = {}
+        self.queue = None
+        self.worker_tasks = []
+
+    def start(self):
+        """
+        Starts the worker tasks on the running event loop, if they are not running yet
+        """
+        if self.worker_tasks:
+            return
+        self.queue = asyncio.Queue()
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if JOB_ABANDON_SECONDS > 0:
+            self.worker_tasks.append(asyncio.create_task(self.reap_abandoned()))
+        logger.info(f"Started job scheduler with {self.workers} workers")
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+        self.queue = None
+
+    @property
+    def saturated(self):
+        return sum(job.status == QUEUED for job in self.jobs.values()) >= MAX_QUEUED_JOBS
+
+    def submit(self, text, emotions):
+        """
+        Queues a new job for the topic
+        :return: the queued job, None if too many jobs are waiting already (Job)
+        """
+        self.start()
+        self.prune()
+        if self.saturated:
+            logger.warning(f"Turning away a job, {MAX_QUEUED_JOBS} jobs are waiting already")
+            return None
+        job = Job(text, emotions)
+        job.set_status(QUEUED)
+        self.jobs[job.job_id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id) or self.load(job_id)
+
+    def load(self, job_id):
+        """
+        Restores a job of an earlier server run from the manifest of its video
+        :param job_id: Id of the job (string)
+        :return: the job, None if there is no manifest for it (Job)
+        """
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        manifest = Manifest.load(f"{GENERATIONS_PATH}/{job_id}")
+        if manifest is None:
+            return None
+        job = Job(manifest.data["text"], manifest.data["emotions"], job_id=job_id, manifest=manifest)
+        job.status = manifest.data["status"] or QUEUED
+        job.error = manifest.data["error"]
+        job.created_at = manifest.data["created_at"]
+        if job.finished:
+            job.finished_at = manifest.data["updated_at"]
+        self.jobs[job_id] = job
+        return job
+
+    def resume(self):
+        """
+        Queues the jobs that were queued or running when the server stopped
+        :return: number of resumed jobs (int)
+        """
+        self.start()
+        if not os.path.isdir(GENERATIONS_PATH):
+            return 0
+        resumed = 0
+        for job_id in sorted(os.listdir(GENERATIONS_PATH)):
+            if job_id in self.jobs:
+                continue
+            job = self.load(job_id)
+            if job is None:
+                continue
+            if job.finished:
+                # kept out of memory until someone asks for it
+                del self.jobs[job_id]
+                continue
+            logger.info(f"Resuming job {job_id}")
+            job.status = QUEUED
+            self.queue.put_nowait(job)
+            resumed += 1
+        return resumed
+
+    def retry(self, job):
+        """
+        Queues a failed job again, it only redoes the stages that did not finish
+        :param job: Job to retry (Job)
+        :return: false if the job did not fail (bool)
+        """
+        if job.status != FAILED:
+            return False
+        self.start()
+        logger.info(f"Retrying job {job.job_id}")
+        job.reset()
+        job.set_status(QUEUED)
+        job.touch()
+        self.queue.put_nowait(job)
+        return True
+
+    def prune(self):
+        """
+        Forgets finished jobs that are older than the retention period
+        """
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.finished_at > JOB_RETENTION_SECONDS:
+                del self.jobs[job_id]
+
+    async def cancel(self, job):
+        """
+        Cancels the job, stopping its LLM calls, speech syntheses and renders, and removes what it had generated so far
+        :param job: Job to cancel (Job)
+        :return: false if the job had already finished (bool)
+        """
+        if job.finished:
+            return False
+        logger.info(f"Cancelling job {job.job_id}")
+        if job.task is None:
+            # still queued, the worker skips it
+            job.set_status(CANCELLED, "Cancelled")
+        else:
+            job.task.cancel()
+            await asyncio.wait([job.task])
+        # a manifest write that lands after the removal would bring the folder back
+        await job.manifest.flush()
+        await asyncio.to_thread(shutil.rmtree, f"{GENERATIONS_PATH}/{job.job_id}", True)
+        return True
+
+    async def reap_abandoned(self):
+        """
+        Cancels unfinished jobs nobody has asked about for JOB_ABANDON_SECONDS
+        """
+        while True:
+            await asyncio.sleep(JOB_REAP_INTERVAL)
+            now = time.time()
+            for job in list(self.jobs.values()):
+                if not job.finished and job.watchers == 0 and now - job.last_seen > JOB_ABANDON_SECONDS:
+                    logger.info(f"Job {job.job_id} was abandoned")
+                    await self.cancel(job)
+            self.prune()
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.finished:
+                    # cancelled while it was queued
+                    continue
+                job.task = asyncio.create_task(self.run(job))
+                try:
+                    await asyncio.wait([job.task])
+                except asyncio.CancelledError:
+                    # the scheduler is being stopped
+                    job.task.cancel()
+                    await asyncio.wait([job.task])
+                    raise
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job):
+        """
+        Runs the whole pipeline for the job
+        :param job: Job to run (Job)
+        """
+        job.reset()
+        job.set_status(RUNNING)
+        # every task the job starts queues for llm, tts, render and encode slots as this job
+        current_job.set(job.job_id)
+        current_spans.set(job.spans)
+        try:
+            manifest = job.manifest
+            resumed = bool(manifest.data["transcript_done"] and manifest.scenes)
+            if not resumed and manifest.scenes:
+                # a transcript that was cut short can not be continued, the scenes start over
+                for scene in manifest.scenes:
+                    await asyncio.to_thread(shutil.rmtree, f"{GENERATIONS_PATH}/{job.job_id}/{scene['scene_id']}", True)
+                manifest.update(scenes=[])
+
+            job.report("transcript", "running")
+            job.scene_generator = SceneGenerator([], video_id=job.job_id, progress=job.report, manifest=manifest)
+            if resumed:
+                for scene in manifest.scenes:
+                    job.add_scene(scene["transcription"])
+                job.report("transcript", "done", details={"resumed": True})
+                video_id = await job.scene_generator.generate_all_scenes()
+            elif TRANSCRIPT_STREAMING:
+                video_id = await job.scene_generator.generate_streamed_scenes(self.stream_transcript(job))
+            else:
+                transcript = await TranscriptGenerator().generate_transcript(job.text, emotions=job.emotions) or []
+                for scene_transcription in transcript:
+                    job.add_scene(scene_transcription)
+                    job.scene_generator.add_scene(scene_transcription)
+                job.report("transcript", "done" if transcript else "failed")
+                video_id = await job.scene_generator.generate_all_scenes() if transcript else None
+
+            if not job.transcript:
+                job.set_status(FAILED, "Could not generate a transcript")
+            elif video_id is None:
+                job.set_status(FAILED, "No scenes were successfully generated")
+            else:
+                job.set_status(DONE)
+        except asyncio.CancelledError:
+            job.set_status(CANCELLED, "Cancelled")
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job.job_id} failed: {e}")
+            job.set_status(FAILED, str(e))
+
+    async def stream_transcript(self, job):
+        """
+        Streams the transcript of the job, recording every scene on the job as it arrives
+        """
+        async with contextlib.aclosing(TranscriptGenerator().stream_transcript(job.text, emotions=job.emotions)) as scene_transcriptions:
+            async for scene_transcription in scene_transcriptions:
+                job.add_scene(scene_transcription)
+                yield scene_transcription
+        job.report("transcript", "done" if job.transcript else "failed")
+
+
+job_scheduler = JobScheduler()
@@ -0,0 +1,34 @@
+import threading
+
+
+"""
+Objects created on their first use.
+
+The LLM and speech SDKs take most of the time it takes to import the backend, the openai SDK alone close to a second. Their clients are wrapped in a LazyObject, so a new replica starts serving requests without importing them, and they are imported when the first request needs them, or by the warm up the server starts in the background.
+"""
+
+
+class LazyObject:
+    """
+    Initializes the LazyObject, which stands in for the object the factory creates, and creates it when one of its attributes is first used
+    :param factory: Creates the object, e.g. by importing its SDK (function)
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        # the warm up thread and a request may both be first
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Creates the object, if it has not been created yet
+        :return: the object
+        """
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import os
+import time
+
+
+"""
+Per-resource concurrency and rate limits, shared by all jobs.
+
+Every scarce resource (LLM calls, speech syntheses, manim renders and ffmpeg encodes) gets a ResourceLimiter with a fixed number of slots and, optionally, a token bucket that caps requests per minute to stay under provider rate limits. Waiters are queued per job and slots are handed out round robin across jobs, so a job with many scenes can not starve the jobs that arrived after it.
+
+The job a piece of work belongs to is kept in a context variable set by the job scheduler, so it follows the work into every task the job starts without being passed around.
+"""
+
+# job the current task works for, used to queue fairly across jobs
+current_job = contextvars.ContextVar("current_job", default=None)
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY") or 8)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE") or 0)
+
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY") or 4)
+TTS_REQUESTS_PER_MINUTE = float(os.getenv("TTS_REQUESTS_PER_MINUTE") or 0)
+
+ENCODE_CONCURRENCY = int(os.getenv("ENCODE_CONCURRENCY") or os.cpu_count() or 1)
+
+# all limiters by name, for the stats endpoint
+limiters = {}
+
+
+class FairSemaphore:
+    """
+    Initializes the FairSemaphore with the given number of slots. Waiters are queued per owner, and a freed slot goes to the next owner in turn.
+    :param limit: Number of slots (int)
+    """
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.active = 0
+        # owner -> queue of waiting futures, in the order owners get their turn
+        self.waiters = collections.OrderedDict()
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self.waiters.values())
+
+    async def acquire(self, owner):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(owner, collections.deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as the waiter gave up, pass it on
+                self.release()
+            else:
+                queue = self.waiters.get(owner)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self.waiters[owner]
+            raise
+
+    def release(self):
+        while self.waiters:
+            owner, queue = next(iter(self.waiters.items()))
+            future = queue.popleft()
+            # the owner goes to the back of the line
+            del self.waiters[owner]
+            if queue:
+                self.waiters[owner] = queue
+            if not future.done():
+                # the slot moves to the waiter, so the number of active slots stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class TokenBucket:
+    """
+    Initializes the TokenBucket, which allows a steady rate of requests with short bursts
+    :param rate: Requests per second (float)
+    :param burst: Requests that may be made at once after a quiet period (int)
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self):
+        """
+        Waits until a request may be made
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ResourceLimiter:
+    """
+    Initializes the ResourceLimiter for a resource
+    :param name: Name of the resource, e.g. llm or render_pool, unique as it keys the stats (string)
+    :param concurrency: Number of requests that may run at the same time (int)
+    :param requests_per_minute: Maximum rate of requests, 0 for no limit (float)
+    """
+    def __init__(self, name, concurrency, requests_per_minute=0):
+        self.name = name
+        self.semaphore = FairSemaphore(concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60, concurrency) if requests_per_minute > 0 else None
+        limiters[name] = self
+
+    @contextlib.asynccontextmanager
+    async def slot(self, owner=None):
+        """
+        Waits for a slot of the resource, in turn with the other jobs waiting for it
+        :param owner: Job the request belongs to, defaults to the job of the current task (string)
+        """
+        await self.semaphore.acquire(owner or current_job.get())
+        try:
+            if self.bucket is not None:
+                await self.bucket.take()
+            yield
+        finally:
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.semaphore.limit,
+            "active": self.semaphore.active,
+            "waiting": self.semaphore.waiting,
+            "waiting_jobs": len(self.semaphore.waiters),
+        }
+
+
+def get_stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+llm_limiter = ResourceLimiter("llm", LLM_CONCURRENCY, LLM_REQUESTS_PER_MINUTE)
+tts_limiter = ResourceLimiter("tts", TTS_CONCURRENCY, TTS_REQUESTS_PER_MINUTE)
+encode_limiter = ResourceLimiter("encode", ENCODE_CONCURRENCY)
@@ -1,8 +1,12 @@
 import logging
+import os
+
+# DEBUG also logs the generated code and every span
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
 
 # Configure the logging
 logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
+    level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 # Create a logger
@@ -1,22 +1,34 @@
-import base64
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from hume import HumeStreamClient
-from hume.models.config import FaceConfig
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import os 
 from dotenv import load_dotenv
-import tempfile
 import time
 import sys
+import uuid
+import re
+import json
 from pydantic import BaseModel
-from transcript_generator import TranscriptGenerator
-from scene_generator import SceneGenerator
-from logger import logger
-import asyncio
 
+# before the modules below read their configuration from the environment
 load_dotenv()
 
+from scene_generator import GENERATIONS_PATH, HLS_PATH, scene_cache
+from jobs import job_scheduler
+from speech import speech_client, speech_synthesizer
+from client import client
+from hls import PLAYLIST_NAME
+from media import file_response
+from emotions import EmotionSmoother, emotion_batcher, emotion_provider
+from frames import FrameThrottle, LatestFrame, decode_frame, difference_hash, load_pillow
+from logger import logger
+from render_queue import render_queue
+from autofix import autofixer
+from validator import get_manim_names
+from limits import get_stats as get_limit_stats
+from metrics import render_metrics
+import asyncio
+
 app = FastAPI()
 
 origins = [
@@ -32,26 +44,172 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# playlist or segment names written by the HlsPublisher
+HLS_FILE_NAME = re.compile(r"playlist\.m3u8|scene\d+_\d+\.ts")
+
 class VideoRequest(BaseModel):
     text: str
     emotions: str # comma separated list of emotions (max 3)
 
+def warm_up():
+    """
+    Imports the SDKs and libraries that are loaded on first use, see lazy.py, and loads the names the validator checks against
+    """
+    start = time.perf_counter()
+    try:
+        client.load()
+        speech_client.load()
+        load_pillow()
+        get_manim_names()
+    except Exception as e:
+        # the first request that needs them gets the error
+        logger.warning(f"Could not warm up the clients: {e}")
+        return
+    logger.info(f"Warmed up the clients in {time.perf_counter() - start:.2f}s")
+
+def log_background_error(task):
+    """
+    Logs the error of a background task that failed, nobody awaits it to see the error otherwise
+    """
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed", exc_info=task.exception())
+
+@app.on_event("startup")
+async def startup():
+    # pick up the jobs an earlier run of the server did not finish
+    job_scheduler.resume()
+    app.state.background_tasks = [
+        # the first webcam frames do not have to wait for the emotion backend to start, e.g. for Hume streams to open
+        asyncio.create_task(emotion_provider.start(), name="emotion provider start"),
+        # the server is up before the SDKs are imported, the first request does not have to wait for them either
+        asyncio.create_task(asyncio.to_thread(warm_up), name="warm up"),
+    ]
+    for task in app.state.background_tasks:
+        task.add_done_callback(log_background_error)
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in app.state.background_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+    await job_scheduler.stop()
+    await render_queue.stop()
+    await emotion_batcher.stop()
+    await emotion_provider.stop()
+
 @app.get("/")
 def read_root():
     return {"message": "Hello world"}
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Returns the hit, miss and eviction counters of the caches
+    """
+    return {"scenes": scene_cache.stats(), "speech": speech_synthesizer.stats()}
+
+@app.get("/autofix/stats")
+def get_autofix_stats():
+    """
+    Returns how many codegen errors the autofixer repaired without the LLM, in total and per rule
+    """
+    return autofixer.stats()
+
+@app.get("/limits/stats")
+def get_limits_stats():
+    """
+    Returns the active and waiting requests of every limited resource
+    """
+    return get_limit_stats()
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Returns the duration histograms, error and byte counters of the pipeline stages in the Prometheus text format
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/render/stats")
+def get_render_stats():
+    """
+    Returns the renders waiting for and running on the render backend
+    """
+    return render_queue.stats()
+
 @app.post("/generate/")
 async def generate(request: VideoRequest):
     """
-    Takes in a topic and returns a video id for the generated video
+    Takes in a topic and queues the generation of a video for it
+    Returns right away with the id of the job, which is also the id of the video, or with 429 if too many jobs are waiting already
+    """
+    job = job_scheduler.submit(request.text, request.emotions)
+    if job is None:
+        raise HTTPException(status_code=429, detail="Too many videos are being generated, try again later", headers={"Retry-After": "30"})
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status of the job with the given job_id, including the progress of every stage of every scene
     """
-    text = request.text
-    transcript_generator = TranscriptGenerator()
-    transcriptions = await transcript_generator.generate_transcript(text, emotions=request.emotions)
-    scene_generator = SceneGenerator(transcriptions)
-    video_id = await scene_generator.generate_all_scenes()
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.touch()
+    return job.to_dict()
 
-    return {"video_id": video_id, "text": "\n".join(transcriptions)}
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Cancels the job with the given job_id, stopping all of its work and removing what it generated so far
+    Also called by the frontend with navigator.sendBeacon when the page is closed
+    """
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await job_scheduler.cancel(job)
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    """
+    Queues the failed job with the given job_id again, it skips every stage that already finished
+    """
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_scheduler.retry(job):
+        raise HTTPException(status_code=409, detail=f"Only failed jobs can be retried, the job is {job.status}")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """
+    Streams the status of the job with the given job_id as server-sent events, every time it changes, until the job is finished
+    """
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        # an open stream keeps the job from being cancelled as abandoned
+        job.watchers += 1
+        try:
+            while True:
+                changed = job.changed
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    # keep proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+        finally:
+            job.watchers -= 1
+            job.touch()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.post("/generate_stub")
 async def generate_stub(request: VideoRequest):
@@ -60,62 +218,103 @@ async def generate_stub(request: VideoRequest):
     """
     return {"video_id": "0dc1c87d-f027-43be-b443-2d573b03ab7a", "text": "This is a stub"}
 
-@app.get("/videos/{video_id}")
-async def get_video(video_id: str):
+@app.api_route("/videos/{video_id}", methods=["GET", "HEAD"])
+async def get_video(video_id: str, request: Request):
     """
-    Returns the video with the given video_id
+    Returns the video with the given video_id, supporting byte range requests for seeking
     """
-    video_path = f"generated/{video_id}/final_video.mp4"
-    def iterfile():
-        with open(video_path, mode="rb") as file_like:
-            yield from file_like
+    try:
+        uuid.UUID(video_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Video not found")
 
-    return StreamingResponse(iterfile(), media_type="video/mp4")
+    video_path = f"{GENERATIONS_PATH}/{video_id}/final_video.mp4"
+    # a finished video never changes, so browsers may keep it for as long as they like
+    return file_response(request, video_path, "video/mp4", cache_control="public, max-age=31536000, immutable")
+
+
+@app.api_route("/videos/{video_id}/hls/{file_name}", methods=["GET", "HEAD"])
+async def get_video_segment(video_id: str, file_name: str, request: Request):
+    """
+    Returns the HLS playlist or a segment of the video with the given video_id, while the video is still being generated
+    """
+    try:
+        uuid.UUID(video_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    if not HLS_FILE_NAME.fullmatch(file_name):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    job = job_scheduler.get(video_id)
+    if job is not None:
+        # a player that keeps reloading the playlist is still watching
+        job.touch()
+
+    file_path = f"{GENERATIONS_PATH}/{video_id}/{HLS_PATH}/{file_name}"
+    if file_name == PLAYLIST_NAME:
+        # the playlist grows until the last scene is published
+        return file_response(request, file_path, "application/vnd.apple.mpegurl")
+    return file_response(request, file_path, "video/mp2t", cache_control="public, max-age=31536000, immutable")
+
+
+async def analyze_frames(websocket, frames):
+    """
+    Analyzes the newest frame whenever the next analysis is due, skipping frames that look the same as the last one, and sends the top emotions of the smoothed scores back to the client when they change
+    :param websocket: Connection to the client (WebSocket)
+    :param frames: Newest frame received from the client (LatestFrame)
+    """
+    throttle = FrameThrottle()
+    smoother = EmotionSmoother()
+    sent = None
+    try:
+        while True:
+            await throttle.wait()
+            frame = await frames.get()
+            frame_hash = difference_hash(frame)
+            if throttle.is_unchanged(frame_hash):
+                continue
+
+            started_at = time.monotonic()
+            try:
+                scores = await emotion_batcher.analyze(frame)
+            except Exception as e:
+                logger.exception(f"Error processing frame: {e}")
+                # a failed analysis still counts towards the latency, so a struggling backend gets fewer requests
+                throttle.record(started_at, None)
+                continue
+            throttle.record(started_at, frame_hash)
+            emotions = smoother.update(scores)
+            if emotions and emotions != sent:
+                # in the format /generate/ takes as emotions
+                await websocket.send_json({"emotions": emotions})
+                sent = emotions
+    finally:
+        logger.info(f"Skipped {throttle.skipped} unchanged frames and {frames.superseded} superseded frames, last analysis interval {throttle.interval:.1f}s")
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    """
+    Analyzes the emotions in the webcam frames of the client. Frames are sent as binary JPEG or WebP images, and kept in memory from the socket to the emotion backend. Only the newest frame is analyzed, at a rate that follows the latency of the backend, and the client receives the top emotions of its recent frames as {"emotions": "Joy, Interest, Calmness"}.
+    """
     await websocket.accept()
-    client = HumeStreamClient(api_key=os.getenv("HUME_API_KEY"))
-    config = FaceConfig(identify_faces=True)
-    
+    frames = LatestFrame()
+    analyzer = asyncio.create_task(analyze_frames(websocket, frames))
     try:
-        async with client.connect([config]) as socket:
-            logger.info("Connected to Hume API")
-            await asyncio.sleep(3)  # wait for the socket to connect
-            
-            while True:
-                try:
-                    data = await websocket.receive_text()
-                    if data.startswith('data:image/png;base64,'):
-                        frame_data = base64.b64decode(data.split(",")[1])
-                        
-                        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_file:
-                            tmp_file.write(frame_data)
-                            tmp_file_path = tmp_file.name
-
-                        logger.debug(f"Temporary file saved at: {tmp_file_path}")
-
-                        try:
-                            if os.path.exists(tmp_file_path) and os.path.getsize(tmp_file_path) > 0:
-                                logger.debug(f"File size: {os.path.getsize(tmp_file_path)} bytes")
-                                result = await socket.send_file(tmp_file_path)
-                                await websocket.send_json(result)
-                            else:
-                                logger.error("Temporary file is empty or does not exist")
-                        except Exception as e:
-                            logger.exception(f"Error processing file: {e}")
-                        finally:
-                            os.unlink(tmp_file_path)  # Delete the temporary file
-                    else:
-                        logger.warning(f"Received unexpected data format: {data[:50]}...")
-                except WebSocketDisconnect:
-                    logger.info("WebSocket connection closed by client")
-                    break
-                except Exception as e:
-                    logger.exception(f"Unexpected error in WebSocket loop: {e}")
-                    await websocket.close(code=1011)  # Internal error
-                    break
+        while not analyzer.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                logger.info("WebSocket connection closed by client")
+                break
+            frame = decode_frame(message)
+            if frame is not None:
+                frames.put(frame)
+    except WebSocketDisconnect:
+        logger.info("WebSocket connection closed by client")
     except Exception as e:
-        logger.exception(f"Error setting up Hume client: {e}")
+        logger.exception(f"Error in WebSocket connection: {e}")
         await websocket.close(code=1011)  # Internal error
+    finally:
+        analyzer.cancel()
+        await asyncio.gather(analyzer, return_exceptions=True)
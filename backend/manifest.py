@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+
+
+"""
+On-disk record of a video's progress, so a job can be resumed after a restart or retried after a failure.
+
+Every video folder holds a manifest.json with the topic, the transcript in scene order, and per scene its id, transcription, code and which of the speech, render and mux stages have finished, plus the final video once there is one. The manifest is rewritten atomically after every stage, so a crash leaves either the old or the new version behind, never a half written one. On the event loop the writes happen on a background thread, one at a time in the order they were saved, so a newer version is never overwritten by an older one. A resumed job skips every stage the manifest records as done whose output is still on disk.
+"""
+
+MANIFEST_NAME = "manifest.json"
+
+# writes the manifests saved on the event loop
+manifest_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="manifest")
+
+
+def write_manifest(path, contents):
+    """
+    Atomically replaces the file at the path
+    :param path: Path to the manifest file (string)
+    :param contents: Serialized manifest (string)
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as manifest_file:
+            manifest_file.write(contents)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.error(f"Could not write manifest {path}: {e}")
+
+
+class Manifest:
+    """
+    Initializes the Manifest stored at the given path
+    :param path: Path to the manifest file (string)
+    :param data: Contents of the manifest (dict)
+    """
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        # last write handed to the manifest writer
+        self.pending = None
+
+    @classmethod
+    def create(cls, video_dir, video_id, text=None, emotions=None):
+        """
+        Creates an empty manifest for a new video, without writing it yet
+        :param video_dir: Folder of the video (string)
+        :param video_id: Id of the video (string)
+        """
+        return cls(f"{video_dir}/{MANIFEST_NAME}", {
+            "video_id": video_id,
+            "text": text,
+            "emotions": emotions,
+            "status": None,
+            "error": None,
+            "transcript_done": False,
+            "scenes": [],
+            "final_video": None,
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        })
+
+    @classmethod
+    def load(cls, video_dir):
+        """
+        Reads the manifest of a video
+        :param video_dir: Folder of the video (string)
+        :return: the manifest, None if there is none or it can not be read (Manifest)
+        """
+        path = f"{video_dir}/{MANIFEST_NAME}"
+        try:
+            with open(path) as manifest_file:
+                return cls(path, json.load(manifest_file))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read manifest {path}: {e}")
+            return None
+
+    def save(self):
+        """
+        Atomically replaces the manifest on disk, on the manifest writer if called on the event loop
+        """
+        self.data["updated_at"] = time.time()
+        contents = json.dumps(self.data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            write_manifest(self.path, contents)
+            return
+        self.pending = loop.run_in_executor(manifest_writer, write_manifest, self.path, contents)
+
+    async def flush(self):
+        """
+        Waits until every saved version of the manifest is on disk
+        """
+        if self.pending is not None:
+            # the writes are done in order, the last one finishes last
+            await asyncio.shield(self.pending)
+
+    def update(self, **fields):
+        self.data.update(fields)
+        self.save()
+
+    @property
+    def scenes(self):
+        return self.data["scenes"]
+
+    def add_scene(self, scene_id, transcription):
+        self.scenes.append({
+            "index": len(self.scenes),
+            "scene_id": scene_id,
+            "transcription": transcription,
+            "speech": False,
+            "code": None,
+            "render": False,
+            "mux": False,
+        })
+        self.save()
+
+    def get_scene(self, scene_id):
+        return next((scene for scene in self.scenes if scene["scene_id"] == scene_id), None)
+
+    def update_scene(self, scene_id, **fields):
+        """
+        Records the progress of a scene
+        :param scene_id: Scene id (string)
+        :param fields: Fields to change, e.g. speech=True (dict)
+        """
+        scene = self.get_scene(scene_id)
+        if scene is None:
+            return
+        scene.update(fields)
+        self.save()
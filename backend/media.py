@@ -0,0 +1,134 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+
+"""
+Serves generated media files with support for byte ranges and conditional requests, so that players can seek with a single small request and revisits are answered from the browser cache.
+"""
+
+# size of the reads used to stream a file
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_file(path, start, length):
+    """
+    Yields a byte range of the file in fixed size chunks
+    :param path: Path to the file (string)
+    :param start: Offset of the first byte (int)
+    :param length: Number of bytes to yield (int)
+    """
+    with open(path, mode="rb") as file_like:
+        file_like.seek(start)
+        while length > 0:
+            chunk = file_like.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def parse_range(range_header, size):
+    """
+    Parses a Range header for a single byte range
+    :param range_header: Value of the Range header (string)
+    :param size: Size of the file (int)
+    :return: first and last byte of the range (int, int), None if the range can not be satisfied, or an empty tuple if the header should be ignored
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        # only single byte ranges are supported, answer anything else with the full file
+        return ()
+
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # suffix range, the last n bytes
+            suffix_length = int(last)
+            if suffix_length <= 0:
+                return None
+            return max(0, size - suffix_length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return ()
+
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def is_not_modified(request, etag, modified_time):
+    """
+    Checks the conditional request headers against the current version of the file
+    :return: true if the client's cached copy is still valid (bool)
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(modified_time) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def range_is_current(request, etag, last_modified):
+    """
+    Checks the If-Range header, a range request for an outdated version gets the full file
+    """
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+def file_response(request, path, media_type, cache_control="no-cache"):
+    """
+    Creates a response for the file, honouring Range, If-Range, If-None-Match and If-Modified-Since headers
+    :param request: Incoming request (Request)
+    :param path: Path to the file (string)
+    :param media_type: Content type of the file (string)
+    :param cache_control: Value of the Cache-Control header (string)
+    :return: 200, 206, 304 or 416 response (Response)
+    :raises HTTPException: 404 if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": cache_control,
+    }
+
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and range_is_current(request, etag, last_modified):
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(iter_file(path, start, length), status_code=status_code, headers=headers, media_type=media_type)
@@ -0,0 +1,216 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import json
+import re
+import time
+from logger import logger
+
+
+"""
+Timing spans of the pipeline stages, exported as Prometheus metrics.
+
+Every stage of the pipeline (transcript, codegen, validate, render, tts, mux and concat) runs inside a span, which measures how long it took and records the scene and attempt it belongs to, the bytes it produced and the class of the error it failed with. Finished spans are added to the histograms and counters served on /metrics, and to the spans of the job they ran for, which the job status breaks down per stage and per scene.
+
+The spans of the current job are kept in a context variable set by the job scheduler, so they follow the work into every task the job starts without being passed around.
+"""
+
+# upper bounds of the duration histogram buckets (seconds), from a validation to a long render
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# spans of the job the current task works for
+current_spans = contextvars.ContextVar("current_spans", default=None)
+
+# last exception name in an error message, e.g. the NameError at the end of a render traceback
+ERROR_CLASS_PATTERN = re.compile(r"\b([A-Z]\w*(?:Error|Exception))\b")
+
+# all metrics in the order they are exported
+metrics = []
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """
+    Initializes the Counter, a Prometheus counter with labels
+    :param name: Metric name (string)
+    :param description: Help text of the metric (string)
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = collections.defaultdict(float)
+        metrics.append(self)
+
+    def inc(self, value=1, **labels):
+        self.values[tuple(sorted(labels.items()))] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Initializes the Histogram, a Prometheus histogram with labels
+    :param name: Metric name (string)
+    :param description: Help text of the metric (string)
+    :param buckets: Upper bounds of the buckets, in increasing order (tuple of floats)
+    """
+    def __init__(self, name, description, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # labels -> observations per bucket, the last one counts everything above the largest bound
+        self.counts = collections.defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.sums = collections.defaultdict(float)
+        metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        counts = self.counts[key]
+        index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        counts[index] += 1
+        self.sums[key] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {self.sums[labels]:g}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+def render_metrics():
+    """
+    Renders all metrics in the Prometheus text format
+    :return: exposition text (string)
+    """
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+stage_duration = Histogram("pipeline_stage_duration_seconds", "Duration of pipeline stages by outcome")
+stage_errors = Counter("pipeline_stage_errors_total", "Failed pipeline stages by error class")
+stage_bytes = Counter("pipeline_stage_bytes_total", "Bytes produced by pipeline stages")
+
+
+def get_error_class(error):
+    """
+    Returns the class of an error, for exceptions and for error messages like render tracebacks
+    :param error: Exception or error message (Exception or string)
+    :return: e.g. NameError, or Error if the message does not name one (string)
+    """
+    if isinstance(error, BaseException):
+        return type(error).__name__
+    names = ERROR_CLASS_PATTERN.findall(error or "")
+    return names[-1] if names else "Error"
+
+
+class Span:
+    """
+    Initializes the Span of a pipeline stage
+    :param stage: Name of the stage (string)
+    :param scene: Position of the scene, None for stages of the whole video (int)
+    :param attempt: Attempt of the stage, e.g. the codegen attempt (int)
+    """
+    def __init__(self, stage, scene=None, attempt=None):
+        self.stage = stage
+        self.scene = scene
+        self.attempt = attempt
+        self.bytes = 0
+        self.error = None
+        self.outcome = "ok"
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def fail(self, error):
+        """
+        Marks the stage as failed without raising, e.g. for a render that returned an error
+        :param error: Exception or error message (Exception or string)
+        """
+        self.outcome = "error"
+        self.error = get_error_class(error)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        stage_duration.observe(self.duration, stage=self.stage, outcome=self.outcome)
+        if self.error is not None:
+            stage_errors.inc(stage=self.stage, error=self.error)
+        if self.bytes:
+            stage_bytes.inc(self.bytes, stage=self.stage)
+
+        spans = current_spans.get()
+        if spans is not None:
+            spans.append(self.to_dict())
+        logger.debug(f"Span {json.dumps(self.to_dict())}")
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "scene": self.scene,
+            "attempt": self.attempt,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "outcome": self.outcome,
+            "error": self.error,
+        }
+
+
+@contextlib.contextmanager
+def span(stage, scene=None, attempt=None):
+    """
+    Measures the stage run inside the with block, an exception raised in it fails the span
+    :param stage: Name of the stage (string)
+    :param scene: Position of the scene, None for stages of the whole video (int)
+    :param attempt: Attempt of the stage (int)
+    """
+    record = Span(stage, scene, attempt)
+    try:
+        yield record
+    except (asyncio.CancelledError, GeneratorExit):
+        record.outcome = "cancelled"
+        raise
+    except Exception as e:
+        record.fail(e)
+        raise
+    finally:
+        record.finish()
+
+
+def summarize(spans):
+    """
+    Breaks down the time of a job per stage and per scene
+    :param spans: Finished spans of the job (list of dicts)
+    :return: count, seconds, bytes and errors per stage, and seconds per stage of every scene (dict)
+    """
+    stages = {}
+    scenes = {}
+    for record in spans:
+        summary = stages.setdefault(record["stage"], {"count": 0, "seconds": 0.0, "bytes": 0, "errors": {}})
+        summary["count"] += 1
+        summary["seconds"] += record["duration"]
+        summary["bytes"] += record["bytes"]
+        if record["error"] is not None:
+            summary["errors"][record["error"]] = summary["errors"].get(record["error"], 0) + 1
+        if record["scene"] is not None:
+            scene = scenes.setdefault(record["scene"], {})
+            scene[record["stage"]] = scene.get(record["stage"], 0.0) + record["duration"]
+    return {"stages": stages, "scenes": scenes}
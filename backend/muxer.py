@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+from logger import logger
+from limits import encode_limiter
+
+
+"""
+Attaches narration to rendered scenes and stitches scenes together with ffmpeg.
+
+Manim already produces h264 video, so neither step needs to decode and re-encode the scene video. Audio is attached with a video stream copy and scenes are joined with the concat demuxer, also as a stream copy. The only video that is ever encoded is the short freeze-frame tail that is appended when the narration outlasts the animation, encoded with the same parameters as the scene so it can be concatenated without re-encoding. If the scenes do not share the same stream parameters, concatenation falls back to a single re-encode.
+"""
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY") or "ffmpeg"
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY") or "ffprobe"
+
+AUDIO_CODEC = "aac"
+AUDIO_BITRATE = "128k"
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+# differences in duration below this are not worth padding for (seconds)
+DURATION_EPSILON = 0.05
+
+# ffprobe's names of the h264 profiles libx264 encodes, and libx264's names for them
+X264_PROFILES = {
+    "Baseline": "baseline",
+    # libx264's baseline is constrained baseline
+    "Constrained Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+
+
+async def run_command(*command):
+    """
+    Runs the given command in a subprocess without blocking the event loop
+    :param command: Executable and arguments (strings)
+    :return: stdout of the command (bytes)
+    :raises RuntimeError: if the command exits with a non zero exit code
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed with exit code {process.returncode}. Error: {stderr.decode(errors='replace').strip()}")
+    return stdout
+
+
+async def run_ffmpeg(*args):
+    async with encode_limiter.slot():
+        return await run_command(FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y", *args)
+
+
+async def probe(path):
+    """
+    Reads the container and stream parameters of a media file
+    :param path: Path to the media file (string)
+    :return: duration in seconds, first video stream and first audio stream as ffprobe dicts (float, dict or None, dict or None)
+    """
+    output = await run_command(
+        FFPROBE_BINARY, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path
+    )
+    info = json.loads(output)
+    streams = info.get("streams", [])
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+    return float(info["format"]["duration"]), video, audio
+
+
+def stream_signature(video, audio):
+    """
+    Returns the stream parameters that have to match for scenes to be concatenated with a stream copy
+    :param video: ffprobe video stream (dict or None)
+    :param audio: ffprobe audio stream (dict or None)
+    :return: comparable signature (tuple)
+    """
+    video_keys = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+    audio_keys = ("codec_name", "sample_rate", "channels")
+    return (
+        tuple((video or {}).get(key) for key in video_keys),
+        tuple((audio or {}).get(key) for key in audio_keys),
+    )
+
+
+async def concat_copy(input_paths, output_path):
+    """
+    Concatenates media files with the concat demuxer without re-encoding
+    :param input_paths: Paths of the files to concatenate, in order (list of strings)
+    :param output_path: Path of the concatenated file (string)
+    """
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w") as list_file:
+        for path in input_paths:
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+    try:
+        await run_ffmpeg("-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", "-movflags", "+faststart", output_path)
+    finally:
+        os.remove(list_path)
+
+
+async def concat_reencode(input_paths, output_path):
+    """
+    Concatenates media files whose streams do not match, re-encoding everything once
+    :param input_paths: Paths of the files to concatenate, in order (list of strings)
+    :param output_path: Path of the concatenated file (string)
+    """
+    inputs = []
+    for path in input_paths:
+        inputs += ["-i", path]
+    streams = "".join(f"[{index}:v:0][{index}:a:0]" for index in range(len(input_paths)))
+    await run_ffmpeg(
+        *inputs,
+        "-filter_complex", f"{streams}concat=n={len(input_paths)}:v=1:a=1[v][a]",
+        "-map", "[v]", "-map", "[a]",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        "-c:a", AUDIO_CODEC, "-b:a", AUDIO_BITRATE, "-ar", str(AUDIO_SAMPLE_RATE), "-ac", str(AUDIO_CHANNELS),
+        "-movflags", "+faststart",
+        output_path,
+    )
+
+
+async def encode_freeze_tail(video_path, video, duration, output_path):
+    """
+    Encodes a clip that holds the last frame of the video, using the same encoding parameters as the video so the two can be concatenated with a stream copy
+    :param video_path: Path to the video to take the last frame from (string)
+    :param video: ffprobe video stream of the video (dict)
+    :param duration: Length of the clip in seconds (float)
+    :param output_path: Path of the encoded clip (string)
+    """
+    frame_path = f"{output_path}.png"
+    # seek to just before the end and keep overwriting the image, leaving the last decoded frame
+    await run_ffmpeg("-sseof", "-1", "-i", video_path, "-update", "1", "-frames:v", "1000", frame_path)
+
+    timescale = video["time_base"].split("/")[1]
+    codec_args = ["-c:v", "libx264"]
+    # profiles libx264 can not encode are left to libx264, pix_fmt, size, frame rate and time base still match
+    profile = X264_PROFILES.get(video.get("profile")) if video.get("codec_name") == "h264" else None
+    if profile:
+        codec_args += ["-profile:v", profile]
+    try:
+        await run_ffmpeg(
+            "-loop", "1", "-framerate", video["r_frame_rate"], "-i", frame_path,
+            "-t", f"{duration:.3f}",
+            *codec_args,
+            "-pix_fmt", video["pix_fmt"],
+            "-vf", f"scale={video['width']}:{video['height']}",
+            "-r", video["r_frame_rate"],
+            "-video_track_timescale", timescale,
+            output_path,
+        )
+    finally:
+        os.remove(frame_path)
+
+
+async def mux_scene(video_path, audio_path, output_path):
+    """
+    Attaches the narration to a rendered scene. The video stream is copied, and if the narration is longer than the animation the last frame is held until the narration ends. If it is shorter, the narration is padded with silence.
+    :param video_path: Path to the rendered scene (string)
+    :param audio_path: Path to the narration (string)
+    :param output_path: Path of the scene with narration (string)
+    """
+    (video_duration, video, _), (audio_duration, _, _) = await asyncio.gather(probe(video_path), probe(audio_path))
+    logger.info(f"Video duration: {video_duration}, Audio duration: {audio_duration}")
+
+    temporary_paths = []
+    try:
+        if audio_duration > video_duration + DURATION_EPSILON:
+            logger.warning("Audio is longer than video, extending video by holding the last frame")
+            tail_path = f"{output_path}.tail.mp4"
+            extended_path = f"{output_path}.extended.mp4"
+            temporary_paths += [tail_path, extended_path]
+            await encode_freeze_tail(video_path, video, audio_duration - video_duration, tail_path)
+            await concat_copy([video_path, tail_path], extended_path)
+            video_path = extended_path
+
+        final_duration = max(video_duration, audio_duration)
+        await run_ffmpeg(
+            "-i", video_path, "-i", audio_path,
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "copy",
+            "-c:a", AUDIO_CODEC, "-b:a", AUDIO_BITRATE, "-ar", str(AUDIO_SAMPLE_RATE), "-ac", str(AUDIO_CHANNELS),
+            # pad the narration with silence so it covers the whole video
+            "-af", "apad",
+            "-t", f"{final_duration:.3f}",
+            "-movflags", "+faststart",
+            output_path,
+        )
+    finally:
+        for path in temporary_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def concat_scenes(scene_paths, output_path):
+    """
+    Concatenates the scenes into a single video, with a stream copy whenever all scenes share the same stream parameters
+    :param scene_paths: Paths of the scenes, in order (list of strings)
+    :param output_path: Path of the final video (string)
+    """
+    probes = await asyncio.gather(*(probe(path) for path in scene_paths))
+    signatures = {stream_signature(video, audio) for _, video, audio in probes}
+
+    if len(signatures) == 1:
+        await concat_copy(scene_paths, output_path)
+    else:
+        logger.warning("Scenes have different stream parameters, re-encoding while concatenating")
+        await concat_reencode(scene_paths, output_path)
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import uuid
+from logger import logger
+from render_pool import RenderPool, RENDER_WORKERS, VIDEO_INTERNAL_PATH
+from render_queue import SqliteRenderQueue, RENDER_LEASE_SECONDS, RENDER_POLL_INTERVAL
+
+
+"""
+Stateless render node of a render farm.
+
+Takes renders off the shared SqliteRenderQueue and renders them on a local RenderPool, RENDER_WORKERS at a time. The node keeps nothing between renders: the code comes from the queue, is rendered in a temporary directory, and the clip goes back into the queue directory. Start as many nodes as needed, on any machine that shares RENDER_QUEUE_DIR with the API servers, with the API running with RENDER_BACKEND=sqlite:
+
+    python render_node.py
+
+While rendering, the node renews its lease on the render a few times per lease period. If the lease can not be renewed, because the render was cancelled or another node took it over, the render is killed.
+"""
+
+
+class RenderNode:
+    """
+    Initializes the RenderNode for the given queue
+    :param queue: Queue to take renders from (SqliteRenderQueue)
+    :param workers: Number of renders that run at the same time (int)
+    """
+    def __init__(self, queue, workers=RENDER_WORKERS):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.pool = RenderPool(self.workers)
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def run(self):
+        """
+        Renders until the node is stopped
+        """
+        logger.info(f"Started render node {self.node_id} with {self.workers} workers on {self.queue.queue_dir}")
+        self.pool.start()
+        try:
+            await asyncio.gather(*(self.worker() for _ in range(self.workers)))
+        finally:
+            await self.pool.stop()
+
+    async def worker(self):
+        while True:
+            render = await asyncio.to_thread(self.queue.claim, self.node_id)
+            if render is None:
+                await asyncio.sleep(RENDER_POLL_INTERVAL)
+                continue
+            try:
+                await self.run_render(*render)
+            except Exception as e:
+                # the lease runs out and the render is retried, possibly on another node
+                logger.exception(f"Could not finish render {render[0]}: {e}")
+
+    async def run_render(self, render_id, code, dry_run):
+        """
+        Renders the code in a temporary directory, renewing the lease until the render finishes
+        :param render_id: Id of the render (string)
+        :param code: Manim code (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        """
+        logger.info(f"Rendering {render_id} on node {self.node_id}")
+        work_dir = tempfile.mkdtemp(prefix="render-")
+        try:
+            script_path = f"{work_dir}/video.py"
+            with open(script_path, "w") as script_file:
+                script_file.write(code)
+
+            render_task = asyncio.create_task(self.pool.render(script_path, work_dir, dry_run=dry_run))
+            try:
+                while True:
+                    done, _ = await asyncio.wait([render_task], timeout=RENDER_LEASE_SECONDS / 3)
+                    if done:
+                        break
+                    if not await asyncio.to_thread(self.queue.renew, render_id, self.node_id):
+                        logger.warning(f"Lost the lease on render {render_id}, it was cancelled or taken over")
+                        render_task.cancel()
+                        await asyncio.wait([render_task])
+                        return
+            except asyncio.CancelledError:
+                # the node is being stopped
+                render_task.cancel()
+                await asyncio.wait([render_task])
+                raise
+
+            ok, error = render_task.result()
+            clip_path = f"{work_dir}/{VIDEO_INTERNAL_PATH}" if ok and not dry_run else None
+            await asyncio.to_thread(self.queue.complete, render_id, self.node_id, ok, error, clip_path)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+
+if __name__ == "__main__":
+    asyncio.run(RenderNode(SqliteRenderQueue()).run())
@@ -0,0 +1,351 @@
+import abc
+import asyncio
+import collections
+import json
+import os
+import signal
+import sys
+import time
+from logger import logger
+from limits import ResourceLimiter
+
+
+"""
+Bounded pool of manim render processes.
+
+Rendering a scene is a blocking, CPU heavy `manim render` subprocess. Instead of running it inline on the event loop, scenes are put on a queue and picked up by a fixed number of async workers, each of which drives one manim process at a time. This keeps the API responsive while scenes from many concurrent jobs render in parallel across cores. Every manim process runs in its own process group, so killing a render also kills the latex and ffmpeg processes it started.
+
+By default every async worker keeps a warm render_worker.py process with manim already imported, so renders skip the interpreter startup and imports. Warm processes are recycled after a number of renders, and replaced when they crash, time out or are cancelled. If a warm process can not be started, renders fall back to the manim cli, and no warm process is started again for RENDER_WORKER_RETRY_SECONDS.
+
+RenderPool is the local implementation of the RenderQueue interface. render_queue.py picks the implementation the API uses, and render_node.py runs a RenderPool on each render node of a render farm.
+"""
+
+# number of manim processes that may run at the same time
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS") or os.cpu_count() or 1)
+
+# seconds a single render may take before its process is killed
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT") or 600)
+
+# manim quality flag, l = 480p15
+RENDER_QUALITY = "l"
+
+# where manim writes the clip inside the media directory, 480p15 is the resolution and frame rate of the video, change if we want to change the resolution
+VIDEO_INTERNAL_PATH = "videos/video/480p15/video.mp4"
+
+# keep manim loaded in long lived worker processes instead of starting the manim cli for every render
+RENDER_WARM_WORKERS = (os.getenv("RENDER_WARM_WORKERS") or "1") != "0"
+
+# renders after which a warm worker process is replaced, to contain leaks
+RENDER_WORKER_MAX_JOBS = int(os.getenv("RENDER_WORKER_MAX_JOBS") or 25)
+
+# seconds a warm worker may take to import manim
+RENDER_WORKER_STARTUP_TIMEOUT = float(os.getenv("RENDER_WORKER_STARTUP_TIMEOUT") or 60)
+
+# seconds renders go to the manim cli after a warm worker failed to start, before starting one is tried again
+RENDER_WORKER_RETRY_SECONDS = float(os.getenv("RENDER_WORKER_RETRY_SECONDS") or 60)
+
+RENDER_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_worker.py")
+
+
+def kill_process_group(process):
+    """
+    Kills the process and every process it started. The process has to be started with start_new_session=True.
+    :param process: Process to kill (asyncio.subprocess.Process)
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # the group is gone already, make sure the process itself is too
+        if process.returncode is None:
+            process.kill()
+
+
+class WarmWorkerStartError(RuntimeError):
+    pass
+
+
+class WarmWorker:
+    """
+    Initializes the WarmWorker, which manages a single render_worker.py process
+    :param max_jobs: Number of renders after which the process is replaced (int)
+    """
+    def __init__(self, max_jobs=RENDER_WORKER_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.process = None
+        self.jobs = 0
+        self.stderr_task = None
+        # last lines the process wrote to stderr, reported if it crashes
+        self.stderr_tail = collections.deque(maxlen=50)
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        """
+        Starts the worker process and waits until it has imported manim
+        """
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, RENDER_WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # responses carry tracebacks, allow long lines
+            limit=2 ** 24,
+            start_new_session=True,
+        )
+        self.jobs = 0
+        self.stderr_tail.clear()
+        self.stderr_task = asyncio.create_task(self.drain_stderr(self.process))
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout=RENDER_WORKER_STARTUP_TIMEOUT)
+            if not line or not json.loads(line).get("ready"):
+                raise WarmWorkerStartError(f"Render worker exited during startup: {self.crash_report()}")
+        except WarmWorkerStartError:
+            await self.stop()
+            raise
+        except Exception as e:
+            await self.stop()
+            raise WarmWorkerStartError(f"Render worker did not start: {e!r}") from e
+        except BaseException:
+            await self.stop()
+            raise
+        logger.info(f"Started warm render worker {self.process.pid}")
+
+    async def stop(self):
+        """
+        Kills the worker process
+        """
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            kill_process_group(self.process)
+        await self.process.wait()
+        if self.stderr_task is not None:
+            await asyncio.gather(self.stderr_task, return_exceptions=True)
+        self.process = None
+        self.stderr_task = None
+
+    async def drain_stderr(self, process):
+        # the pipe has to be read, or the process blocks once it is full
+        async for line in process.stderr:
+            self.stderr_tail.append(line.decode(errors="replace").rstrip())
+
+    def crash_report(self):
+        return "\n".join(self.stderr_tail)
+
+    async def render(self, script_path, media_dir, dry_run, timeout):
+        """
+        Renders the manim script in the worker process, starting the process if needed
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        if not self.running:
+            await self.start()
+
+        request = {"script_path": script_path, "media_dir": media_dir, "quality": RENDER_QUALITY, "dry_run": dry_run}
+        logger.info(f"Rendering {script_path} on warm render worker {self.process.pid}")
+        try:
+            self.process.stdin.write((json.dumps(request) + "\n").encode())
+            await self.process.stdin.drain()
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await self.stop()
+            return False, f"Render timed out after {timeout} seconds"
+        except (asyncio.CancelledError, ConnectionError):
+            # the process may be in the middle of a render, it can not be reused
+            await self.stop()
+            raise
+
+        if not line:
+            error = f"Render worker crashed. Error: {self.crash_report()}"
+            await self.stop()
+            return False, error
+
+        self.jobs += 1
+        if self.jobs >= self.max_jobs:
+            logger.info(f"Recycling warm render worker {self.process.pid} after {self.jobs} renders")
+            await self.stop()
+
+        response = json.loads(line)
+        if not response["ok"]:
+            return False, f"Render failed. Error: {response['error']}"
+        return True, ""
+
+
+class RenderQueue(abc.ABC):
+    """
+    Interface of the render stage: manim code goes in, a rendered clip comes out in the media directory
+    """
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def render(self, script_path, media_dir, dry_run=False):
+        """
+        Renders the manim script and waits for it to finish
+        :param script_path: Path to the manim python file (string)
+        :param media_dir: Directory the clip is written to, at VIDEO_INTERNAL_PATH (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class RenderPool(RenderQueue):
+    """
+    Initializes the RenderPool with the given number of workers
+    :param workers: Maximum number of concurrent manim processes (int)
+    :param timeout: Maximum number of seconds a render may take (float)
+    """
+    def __init__(self, workers=RENDER_WORKERS, timeout=RENDER_TIMEOUT):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.queue = None
+        self.worker_tasks = []
+        self.warm_workers = []
+        # when and why a warm worker last failed to start, renders use the manim cli for a while after that
+        self.warm_failed_at = None
+        self.warm_failure = None
+        # hands out the workers round robin across jobs, the queue itself is first come first served
+        self.limiter = ResourceLimiter("render_pool", self.workers)
+
+    def start(self):
+        """
+        Starts the worker tasks on the running event loop, if they are not running yet
+        """
+        if self.worker_tasks:
+            return
+        self.queue = asyncio.Queue()
+        self.warm_workers = [WarmWorker() for _ in range(self.workers)] if RENDER_WARM_WORKERS else []
+        self.worker_tasks = [asyncio.create_task(self.worker(index)) for index in range(self.workers)]
+        logger.info(f"Started render pool with {self.workers} workers")
+
+    async def stop(self):
+        """
+        Stops all worker tasks, killing any render that is still running
+        """
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        await asyncio.gather(*(warm_worker.stop() for warm_worker in self.warm_workers), return_exceptions=True)
+        self.worker_tasks = []
+        self.warm_workers = []
+        self.queue = None
+
+    def stats(self):
+        return {
+            "backend": "local",
+            "workers": self.workers,
+            "queued": self.queue.qsize() if self.queue else 0,
+        }
+
+    async def render(self, script_path, media_dir, dry_run=False):
+        """
+        Queues a render of the manim script and waits for it to finish
+        :param script_path: Path to the manim python file (string)
+        :param media_dir: Directory manim writes its output to (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        async with self.limiter.slot():
+            self.start()
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((script_path, media_dir, dry_run, future))
+            return await future
+
+    async def worker(self, index):
+        """
+        Takes renders off the queue and runs them one at a time
+        :param index: Index of the worker, used for logging (int)
+        """
+        while True:
+            script_path, media_dir, dry_run, future = await self.queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                render_task = asyncio.create_task(self.run_render(index, script_path, media_dir, dry_run))
+                # if whoever queued the render stops waiting for it, kill the render as well
+                future.add_done_callback(lambda f, task=render_task: task.cancel() if f.cancelled() else None)
+                try:
+                    await asyncio.wait([render_task])
+                except asyncio.CancelledError:
+                    # the worker itself is being stopped
+                    render_task.cancel()
+                    await asyncio.wait([render_task])
+                    future.cancel()
+                    raise
+                if render_task.cancelled():
+                    continue
+                try:
+                    result = render_task.result()
+                except Exception as e:
+                    result = (False, str(e))
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    async def run_render(self, index, script_path, media_dir, dry_run=False):
+        """
+        Renders the manim script on the worker's warm process, or with the manim cli if there is none
+        :param index: Index of the worker (int)
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        backing_off = self.warm_failed_at is not None and time.monotonic() - self.warm_failed_at < RENDER_WORKER_RETRY_SECONDS
+        if self.warm_workers and not backing_off:
+            try:
+                return await self.warm_workers[index].render(script_path, media_dir, dry_run, self.timeout)
+            except WarmWorkerStartError as e:
+                # starting another one for every render would fail the same way
+                self.warm_failed_at = time.monotonic()
+                if str(e) != self.warm_failure:
+                    logger.error(f"Warm render worker could not be started, using the manim cli for {RENDER_WORKER_RETRY_SECONDS:g}s: {e}")
+                else:
+                    logger.warning(f"Warm render worker still can not be started, using the manim cli for {RENDER_WORKER_RETRY_SECONDS:g}s")
+                self.warm_failure = str(e)
+            except (OSError, RuntimeError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"Warm render worker unavailable, falling back to the manim cli: {e}")
+        return await self.run_manim(script_path, media_dir, dry_run)
+
+    async def run_manim(self, script_path, media_dir, dry_run=False):
+        """
+        Runs manim on the given script in a subprocess
+        :param script_path: Path to the manim python file (string)
+        :param media_dir: Directory manim writes its output to (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        command = ["manim", "render", f"-q{RENDER_QUALITY}", script_path, "-o", "video", "--media_dir", media_dir]
+        if dry_run:
+            command.append("--dry_run")
+        logger.info(f"Running command: {' '.join(command)}")
+
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await process.wait()
+            return False, f"Render timed out after {self.timeout} seconds"
+        except asyncio.CancelledError:
+            kill_process_group(process)
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            error_message = stderr.decode(errors="replace").strip()
+            return False, f"Command failed with exit code {process.returncode}. Error: {error_message}"
+
+        logger.info(f"Command output: {stdout.decode(errors='replace')}")
+        return True, ""
@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from logger import logger
+from limits import ResourceLimiter
+from render_pool import RenderQueue, RenderPool, RENDER_WORKERS, VIDEO_INTERNAL_PATH
+
+
+"""
+Picks the render backend the API hands its renders to.
+
+The local backend renders on this machine with a RenderPool. The sqlite backend puts renders on a queue in a SQLite database inside RENDER_QUEUE_DIR, where any number of render nodes (render_node.py) pick them up, so rendering can scale beyond one machine independently of the API servers. The directory has to be shared by the API and the nodes, e.g. over NFS, on a filesystem with working POSIX locks. The database uses SQLite's rollback journal rather than WAL, which needs memory shared between the processes of one host and does not work over a network filesystem. A node claims a render in a BEGIN IMMEDIATE transaction, every other change is a single statement.
+
+A render on the queue carries the manim code, not a path, and the node writes the clip back into the queue directory, so nodes do not need access to the generated videos. A node leases a render and renews the lease while it renders. If the node dies, the lease runs out and another node takes the render over, until it has been attempted RENDER_MAX_ATTEMPTS times. When the API stops waiting for a render, e.g. because its job was cancelled, the render is removed from the queue, and the node rendering it notices when it tries to renew the lease and kills the render.
+"""
+
+# local renders on this machine, sqlite hands them to render nodes through a shared queue
+RENDER_BACKEND = os.getenv("RENDER_BACKEND") or "local"
+
+# directory shared by the API and the render nodes, holding the queue database and the rendered clips
+RENDER_QUEUE_DIR = os.getenv("RENDER_QUEUE_DIR") or "render_queue"
+
+# seconds a node may go without renewing its lease before the render is given to another node
+RENDER_LEASE_SECONDS = float(os.getenv("RENDER_LEASE_SECONDS") or 30)
+
+# attempts at a render before it is failed, so a scene that kills its node is not retried forever
+RENDER_MAX_ATTEMPTS = int(os.getenv("RENDER_MAX_ATTEMPTS") or 3)
+
+# seconds between checks of the queue, by the API for finished renders and by idle nodes for new ones
+RENDER_POLL_INTERVAL = float(os.getenv("RENDER_POLL_INTERVAL") or 0.5)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+ABANDONED_ERROR = f"Render node stopped responding, gave up after {RENDER_MAX_ATTEMPTS} attempts"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    render_id TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    dry_run INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    node TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_by_status ON renders (status, created_at);
+"""
+
+
+class SqliteRenderQueue(RenderQueue):
+    """
+    Initializes the SqliteRenderQueue in the given directory
+    :param queue_dir: Directory shared with the render nodes (string)
+    :param concurrency: Renders this API server may have on the queue at the same time, handed out round robin across jobs (int)
+    """
+    def __init__(self, queue_dir=RENDER_QUEUE_DIR, concurrency=RENDER_WORKERS):
+        self.queue_dir = queue_dir
+        self.database_path = f"{queue_dir}/queue.db"
+        self.clips_dir = f"{queue_dir}/clips"
+        self.limiter = ResourceLimiter("render_queue", concurrency)
+        self.initialized = False
+
+    def connect(self):
+        """
+        Opens a connection to the queue database, creating it if needed. Every call gets its own connection, so it can be used from any thread.
+        :return: connection in autocommit mode (sqlite3.Connection)
+        """
+        if not self.initialized:
+            os.makedirs(self.clips_dir, exist_ok=True)
+        connection = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        if not self.initialized:
+            # WAL does not work over a network filesystem, see above
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.executescript(SCHEMA)
+            self.initialized = True
+        return connection
+
+    def execute(self, query, parameters=()):
+        """
+        Runs a single statement
+        :return: rows of the result and number of changed rows (list, int)
+        """
+        with contextlib.closing(self.connect()) as connection:
+            cursor = connection.execute(query, parameters)
+            return cursor.fetchall(), cursor.rowcount
+
+    def get_clip_path(self, render_id, node):
+        # every node writes its own file, so a node that lost its lease can not overwrite the clip of the node that took over
+        return f"{self.clips_dir}/{render_id}.{node}.mp4"
+
+    async def render(self, script_path, media_dir, dry_run=False):
+        """
+        Puts a render of the manim script on the queue and waits for a render node to finish it
+        :param script_path: Path to the manim python file (string)
+        :param media_dir: Directory the clip is moved to, at VIDEO_INTERNAL_PATH (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
+        """
+        async with self.limiter.slot():
+            with open(script_path) as script_file:
+                code = script_file.read()
+            render_id = str(uuid.uuid4())
+            await asyncio.to_thread(self.submit, render_id, code, dry_run)
+            try:
+                while True:
+                    await asyncio.sleep(RENDER_POLL_INTERVAL)
+                    status, node, error = await asyncio.to_thread(self.get_status, render_id)
+                    if status != QUEUED and status != LEASED:
+                        break
+                if status == DONE and not dry_run:
+                    await asyncio.to_thread(self.collect_clip, render_id, node, media_dir)
+            finally:
+                # also stops the render on its node, which loses the lease
+                await asyncio.to_thread(self.remove, render_id)
+        if status == FAILED:
+            return False, error
+        if status is None:
+            return False, "Render was removed from the queue"
+        return True, ""
+
+    def submit(self, render_id, code, dry_run):
+        now = time.time()
+        self.execute(
+            "INSERT INTO renders (render_id, code, dry_run, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (render_id, code, int(dry_run), QUEUED, now, now),
+        )
+
+    def get_status(self, render_id):
+        """
+        :return: status of the render, the node that rendered it and the error message, all None if the render is gone (string, string, string)
+        """
+        rows, _ = self.execute(
+            "SELECT status, node, error, lease_expires_at, attempts FROM renders WHERE render_id = ?", (render_id,)
+        )
+        if not rows:
+            return None, None, None
+        status, node, error, lease_expires_at, attempts = rows[0]
+        # no node may be left to give up on the render
+        if status == LEASED and lease_expires_at < time.time() and attempts >= RENDER_MAX_ATTEMPTS:
+            return FAILED, node, ABANDONED_ERROR
+        return status, node, error
+
+    def collect_clip(self, render_id, node, media_dir):
+        video_path = f"{media_dir}/{VIDEO_INTERNAL_PATH}"
+        os.makedirs(os.path.dirname(video_path), exist_ok=True)
+        shutil.move(self.get_clip_path(render_id, node), video_path)
+
+    def remove(self, render_id):
+        rows, _ = self.execute("SELECT node FROM renders WHERE render_id = ?", (render_id,))
+        self.execute("DELETE FROM renders WHERE render_id = ?", (render_id,))
+        if rows and rows[0][0]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_clip_path(render_id, rows[0][0]))
+
+    def claim(self, node):
+        """
+        Leases the oldest render that is queued, or whose node stopped renewing its lease
+        :param node: Id of the render node (string)
+        :return: id, code and dry run flag of the render, None if there is nothing to render (string, string, bool)
+        """
+        now = time.time()
+        with contextlib.closing(self.connect()) as connection:
+            # the write lock is taken right away, so two nodes can not lease the same render
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "UPDATE renders SET status = ?, error = ?, updated_at = ? WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                    (FAILED, ABANDONED_ERROR, now, LEASED, now, RENDER_MAX_ATTEMPTS),
+                )
+                row = connection.execute(
+                    "SELECT render_id, code, dry_run, status, node FROM renders WHERE status = ? OR (status = ? AND lease_expires_at < ?) ORDER BY created_at LIMIT 1",
+                    (QUEUED, LEASED, now),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE renders SET status = ?, node = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ? WHERE render_id = ?",
+                        (LEASED, node, now + RENDER_LEASE_SECONDS, now, row[0]),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        render_id, code, dry_run, status, previous_node = row
+        if status == LEASED:
+            logger.warning(f"Render node {previous_node} stopped responding, taking over render {render_id}")
+        return render_id, code, bool(dry_run)
+
+    def renew(self, render_id, node):
+        """
+        Extends the lease of the node on the render
+        :return: false if the node lost the lease, because the render was removed or taken over (bool)
+        """
+        now = time.time()
+        _, changed = self.execute(
+            "UPDATE renders SET lease_expires_at = ?, updated_at = ? WHERE render_id = ? AND node = ? AND status = ?",
+            (now + RENDER_LEASE_SECONDS, now, render_id, node, LEASED),
+        )
+        return changed == 1
+
+    def complete(self, render_id, node, ok, error, clip_path=None):
+        """
+        Records the result of a render, moving its clip into the queue directory
+        :param ok: Whether the render succeeded (bool)
+        :param error: Error message of a failed render (string)
+        :param clip_path: Path of the rendered clip, None for dry runs and failed renders (string)
+        """
+        if clip_path is not None:
+            shutil.move(clip_path, self.get_clip_path(render_id, node))
+        _, changed = self.execute(
+            "UPDATE renders SET status = ?, error = ?, updated_at = ? WHERE render_id = ? AND node = ? AND status = ?",
+            (DONE if ok else FAILED, error or None, time.time(), render_id, node, LEASED),
+        )
+        if changed == 0 and clip_path is not None:
+            # the lease was lost while the clip was being moved, nobody will collect it
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.get_clip_path(render_id, node))
+
+    def stats(self):
+        rows, _ = self.execute("SELECT status, COUNT(*), COUNT(DISTINCT node) FROM renders GROUP BY status")
+        counts = {status: (count, nodes) for status, count, nodes in rows}
+        return {
+            "backend": "sqlite",
+            "queued": counts.get(QUEUED, (0, 0))[0],
+            "rendering": counts.get(LEASED, (0, 0))[0],
+            "busy_nodes": counts.get(LEASED, (0, 0))[1],
+            "limiter": self.limiter.stats(),
+        }
+
+
+def create_render_queue(backend=RENDER_BACKEND):
+    """
+    Creates the render queue for the given backend
+    :param backend: local or sqlite (string)
+    :return: the render queue (RenderQueue)
+    """
+    if backend == "local":
+        return RenderPool()
+    if backend == "sqlite":
+        return SqliteRenderQueue()
+    raise ValueError(f"Unknown render backend {backend}, expected local or sqlite")
+
+
+render_queue = create_render_queue()
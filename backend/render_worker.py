@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+import traceback
+
+
+"""
+Long lived manim render worker.
+
+Started by the RenderPool with manim already imported, so the interpreter startup, the manim, numpy, cairo and pango imports and the config parsing are paid once per worker instead of once per render. Requests are read from stdin and answered on stdout, one JSON object per line:
+
+    {"script_path": ..., "media_dir": ..., "quality": "l", "dry_run": false}
+    {"ok": true} or {"ok": false, "error": "<traceback>"}
+
+Every render runs in a fresh namespace under a temporary manim config, so scenes do not leak state into each other. The pool recycles a worker after a number of renders, or when it crashes or times out.
+
+With --names, the worker prints the names manim exports as a JSON list and exits, for the validator, so the API process never has to import manim.
+"""
+
+QUALITIES = {
+    "l": "low_quality",
+    "m": "medium_quality",
+    "h": "high_quality",
+    "p": "production_quality",
+    "k": "fourk_quality",
+}
+
+# class the generated code defines its scene in, shared with the validator, the duration estimator and the autofixer
+SCENE_CLASS_NAME = "VideoScene"
+
+MAX_ERROR_LENGTH = 20000
+
+
+def find_scene_class(namespace, scene_base):
+    """
+    Picks the scene to render like the manim cli does for a file with a single scene, preferring VideoScene
+    """
+    if isinstance(namespace.get(SCENE_CLASS_NAME), type):
+        return namespace[SCENE_CLASS_NAME]
+    scenes = [
+        value for value in namespace.values()
+        if isinstance(value, type) and issubclass(value, scene_base) and value.__module__ == namespace["__name__"]
+    ]
+    if len(scenes) != 1:
+        raise RuntimeError(f"Expected a single scene class called {SCENE_CLASS_NAME}, found {len(scenes)} scenes")
+    return scenes[0]
+
+
+def render(request):
+    from manim import Scene, tempconfig
+
+    script_path = request["script_path"]
+    options = {
+        "media_dir": request["media_dir"],
+        "input_file": script_path,
+        "output_file": "video",
+        "quality": QUALITIES[request.get("quality", "l")],
+        "dry_run": request.get("dry_run", False),
+        "progress_bar": "none",
+    }
+    try:
+        with open(script_path) as script_file:
+            source = script_file.read()
+        with tempconfig(options):
+            namespace = {"__name__": "__manim_scene__", "__file__": script_path}
+            exec(compile(source, script_path, "exec"), namespace)
+            find_scene_class(namespace, Scene)().render()
+    except (Exception, SystemExit):
+        # the end of the traceback is the useful part
+        return {"ok": False, "error": traceback.format_exc()[-MAX_ERROR_LENGTH:]}
+    return {"ok": True}
+
+
+def get_exported_names(module):
+    return sorted(getattr(module, "__all__", None) or (name for name in dir(module) if not name.startswith("_")))
+
+
+def main():
+    if sys.argv[1:] == ["--names"]:
+        import manim
+        print(json.dumps(get_exported_names(manim)))
+        return
+
+    # keep stdout for the protocol, anything the scene or manim prints ends up on stderr
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # preloaded so renders do not pay for the import
+    import manim
+
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        protocol.write(json.dumps(render(json.loads(line))) + "\n")
+
+
+if __name__ == "__main__":
+    main()
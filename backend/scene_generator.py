@@ -1,29 +1,41 @@
-import dotenv
-dotenv.load_dotenv()
-
 import uuid
 from client import client
 from logger import logger
 import os
-import subprocess
-from moviepy.editor import VideoFileClip, concatenate_videoclips, AudioFileClip, CompositeAudioClip, ImageClip, CompositeVideoClip
-from moviepy.audio.AudioClip import AudioClip
-from speech import speech_client
+from speech import speech_synthesizer
+from render_pool import RENDER_QUALITY, VIDEO_INTERNAL_PATH
+from render_queue import render_queue
+import muxer
+from validator import validate_scene_code
+from duration import get_audio_duration, fit_scene_duration
+from conversation import Conversation
+from autofix import autofixer
+from limits import llm_limiter
+from manifest import Manifest
+from metrics import span
+from hls import HlsPublisher
+from cache import DiskCache, hash_key, normalize_text, link_or_copy
+import hashlib
+import shutil
 import asyncio
+import contextlib
 
 
 """
 Takes in generated scene transcriptions, then generates manim animation and according text-to-speech for each scene, then stitches it together to create a full video.
 
-To generate manim animation, it uses LLMs to generate manim code from the scene descriptions. When generating a scene, it generates the code, then tries to run it. If it fails, it feeds the generated code + error message to the LLM to regenerate the code. This process is repeated until the code runs successfully with a max of 5 tries.
+The speech of each scene is synthesized first, and its duration is given to the LLM as the target length of the animation. To generate manim animation, it uses LLMs to generate manim code from the scene descriptions. When generating a scene, it generates the code, then tries to run it. If it fails, it feeds the latest generated code + the trimmed error message to the LLM to regenerate the code. Mechanical errors are patched by the rule based autofixer and retried without asking the LLM. This process is repeated until the code runs successfully with a max of 5 tries. In speculative mode several candidates go through this loop at the same time, and the first one that renders wins.
 
-Saves videos in generated_videos folder, and returns the id of the video.
+Saves videos in generated_videos folder, and returns the id of the video. The progress of every scene is recorded in the video's manifest, and stages the manifest records as done are skipped, so an interrupted video can be resumed.
 """
 
-GENERATIONS_PATH = "generated"
+GENERATIONS_PATH = os.getenv("GENERATIONS_PATH") or "generated"
 
 MAX_ITERATIONS = 5
 
+# repairs without an LLM round trip per candidate, on top of MAX_ITERATIONS
+MAX_AUTOFIXES = int(os.getenv("MAX_AUTOFIXES") or 3)
+
 SYSTEM_SCENE_PROMPT = """
 You are an expert teacher of simple and complex topics, similar to 3 Blue 1 Brown. Given a transcription for a video scene, you are to generate Manim code that will create an animation for the scene. The code should be able to run without errors. The file will be run with the manim cli tool.
 
@@ -34,7 +46,7 @@ You are an expert teacher of simple and complex topics, similar to 3 Blue 1 Brow
 - Remember that the color BROWN is not defined
 - All elements should be inside the bounds of the video
 - Make sure that all the functions you use exist and are imported
-- Match the length of the animation to the length of the transcription. If it is a long transcription, it should be a long animation
+- Match the length of the animation to the length of the transcription. If it is a long transcription, it should be a long animation. When the duration of the narration is given, time the animation with run_time and self.wait so it lasts exactly that long
 - PAY SPECIAL ATTENTION TO THE POSITION AND SIZE OF THE ELEMENTS. Make use of Manim's positioning and alignment features so that elements are properly contained within or relative to each other.
 - If you are using ANY assets, such as SVGs, you need to create it yourself from scratch from the python code you generate, as that is all that will be run.
 - The classname of the root animation should always be VideoScene.
@@ -267,54 +279,155 @@ class VideoScene(Scene):
 VOICE_ID = "7d21119e-bb5d-4416-8164-9170ec4952c2"
 # VOICE_ID = "caleb"
 
-# 480p15 is the resolution and frame rate of the video, change if we want to change the resolution
-VIDEO_INTERNAL_PATH = "videos/video/480p15/video.mp4"
+# directory inside a video's folder that holds its HLS playlist and segments
+HLS_PATH = "hls"
+
+# changes whenever the prompt changes, so code generated with an old prompt is not reused
+PROMPT_VERSION = hashlib.sha256(SYSTEM_SCENE_PROMPT.encode()).hexdigest()[:12]
+
+# run the scene's construct without writing frames before the full render, catching runtime errors early
+VALIDATE_DRY_RUN = os.getenv("VALIDATE_DRY_RUN") == "1"
+
+SCENE_CACHE_PATH = os.getenv("SCENE_CACHE_PATH") or "cache/scenes"
+SCENE_CACHE_MAX_BYTES = int(os.getenv("SCENE_CACHE_MAX_BYTES") or 2 * 1024 ** 3)
+
+# working code and rendered clips of previously generated scenes
+scene_cache = DiskCache(SCENE_CACHE_PATH, SCENE_CACHE_MAX_BYTES)
+
+# number of code candidates generated and rendered at the same time for every scene, 1 turns speculative codegen off
+SPECULATIVE_CANDIDATES = int(os.getenv("SPECULATIVE_CANDIDATES") or 1)
+
+# codegen attempts a job may spend on candidates beyond the first one
+SPECULATIVE_BUDGET = int(os.getenv("SPECULATIVE_BUDGET") or 20)
 
 class SceneGenerator:
     """
     Initializes the SceneGenerator with the given scene descriptions
     :param scene_transcriptions: List of scene transcriptions (strings)
+    :param video_id: Id of the video, a new one is generated if not given (string)
+    :param progress: Called with (stage, state, scene index, details) whenever a stage of the pipeline starts or finishes (callable)
+    :param candidates: Number of code candidates generated at the same time for every scene (int)
+    :param speculative_budget: Codegen attempts the video may spend on candidates beyond the first one (int)
+    :param manifest: Manifest of the video, the scenes it records are resumed (Manifest)
     """
-    def __init__(self, scene_transcriptions):
-        self.scene_transcriptions = {uuid.uuid4(): scene_transcription for scene_transcription in scene_transcriptions}
-        self.video_id = str(uuid.uuid4())
+    def __init__(self, scene_transcriptions, video_id=None, progress=None, candidates=SPECULATIVE_CANDIDATES, speculative_budget=SPECULATIVE_BUDGET, manifest=None):
+        self.video_id = video_id or (manifest.data["video_id"] if manifest else str(uuid.uuid4()))
+        self.manifest = manifest or Manifest.create(f"{GENERATIONS_PATH}/{self.video_id}", self.video_id)
+        self.progress = progress
+        self.candidates = max(1, candidates)
+        self.speculative_budget = speculative_budget
+        self.publisher = HlsPublisher(f"{GENERATIONS_PATH}/{self.video_id}/{HLS_PATH}")
+
+        # scenes of an earlier run keep their ids and order, so their outputs are found again
+        self.scene_transcriptions = {scene["scene_id"]: scene["transcription"] for scene in self.manifest.scenes}
+        self.scene_indexes = {scene["scene_id"]: scene["index"] for scene in self.manifest.scenes}
+        for scene_transcription in scene_transcriptions:
+            self.add_scene(scene_transcription)
+
+    def add_scene(self, scene_transcription):
+        """
+        Adds a scene to the end of the video
+        :param scene_transcription: Scene transcription (string)
+        :return: position and id of the new scene (int, string)
+        """
+        scene_id = str(uuid.uuid4())
+        self.scene_transcriptions[scene_id] = scene_transcription
+        self.scene_indexes[scene_id] = len(self.scene_indexes)
+        self.manifest.add_scene(scene_id, scene_transcription)
+        return self.scene_indexes[scene_id], scene_id
+
+    def report(self, stage, state, scene_id=None, **details):
+        """
+        Reports progress of a pipeline stage, for the whole video or a single scene
+        :param stage: Name of the stage, e.g. codegen, render, tts, mux or concat (string)
+        :param state: running, done or failed (string)
+        :param scene_id: Scene the stage belongs to, None for stages of the whole video (string)
+        """
+        if self.progress is not None:
+            self.progress(stage, state, self.scene_indexes.get(scene_id), details)
 
     def get_scene_path(self, scene_id, video_id):
         return f"{GENERATIONS_PATH}/{video_id}/{scene_id}/{VIDEO_INTERNAL_PATH}"
     
     def get_audio_path(self, scene_id, video_id):
         return f"{GENERATIONS_PATH}/{video_id}/{scene_id}/audio.wav"
+
+    def get_narrated_scene_path(self, scene_id, video_id):
+        return f"{GENERATIONS_PATH}/{video_id}/{scene_id}/scene.mp4"
+
+    def get_candidate_path(self, scene_id, candidate):
+        """
+        Folder the code and render of a codegen candidate go to. The first candidate uses the scene's folder itself.
+        """
+        scene_path = f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}"
+        return scene_path if candidate == 0 else f"{scene_path}/candidates/{candidate}"
+
+    def promote_candidate(self, scene_id, candidate):
+        """
+        Moves the code and render of the winning candidate into the scene's folder
+        """
+        candidate_path = self.get_candidate_path(scene_id, candidate)
+        scene_path = self.get_scene_path(scene_id, self.video_id)
+        os.makedirs(os.path.dirname(scene_path), exist_ok=True)
+        os.replace(f"{candidate_path}/video.py", f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py")
+        os.replace(f"{candidate_path}/{VIDEO_INTERNAL_PATH}", scene_path)
         
-    def render_scene(self, scene_id):
+    def get_scene_cache_key(self, scene_id, target_duration=None):
+        return hash_key(
+            normalize_text(self.scene_transcriptions[scene_id]),
+            PROMPT_VERSION,
+            os.getenv("LLM_MODEL"),
+            RENDER_QUALITY,
+            # scenes are timed to their narration
+            round(target_duration, 1) if target_duration else None,
+        )
+
+    def is_done(self, scene_id, stage, path):
+        """
+        Checks whether an earlier run finished the stage of the scene and its output is still there
+        :param stage: speech, render or mux (string)
+        :param path: Output of the stage (string)
         """
-        Renders the scene with the given scene id
+        scene = self.manifest.get_scene(scene_id)
+        return bool(scene and scene[stage]) and os.path.exists(path)
+
+    def get_scene_code(self, scene_id):
+        with open(f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py") as code_file:
+            return code_file.read()
+
+    def restore_cached_scene(self, scene_id, entry_path):
+        """
+        Copies the code and rendered clip of a cached scene into the scene's folder
+        """
+        scene_path = self.get_scene_path(scene_id, self.video_id)
+        os.makedirs(os.path.dirname(scene_path), exist_ok=True)
+        link_or_copy(f"{entry_path}/video.py", f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py")
+        link_or_copy(f"{entry_path}/video.mp4", scene_path)
+
+    async def render_scene(self, scene_id, dry_run=False, candidate=0):
+        """
+        Renders the scene with the given scene id on the render queue
         :param scene_id: Scene id (string)
+        :param dry_run: Only run the scene's construct, without writing any frames (bool)
+        :param candidate: Codegen candidate to render (int)
         :return: true if the scene was rendered successfully, false otherwise, including the error message (bool, string)
         """
-        command = f"manim render -ql {GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py -o video --media_dir {GENERATIONS_PATH}/{self.video_id}/{scene_id}"
-        
-        print(f"Running command: {command}")
+        candidate_path = self.get_candidate_path(scene_id, candidate)
+        return await render_queue.render(f"{candidate_path}/video.py", candidate_path, dry_run=dry_run)
 
-        try:
-            # Use subprocess.run instead of os.system
-            result = subprocess.run(
-                command,
-                shell=True,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            logger.info(f"Command output: {result.stdout}")
-            return True, ""
-        except subprocess.CalledProcessError as e:
-            # Capture the error output
-            error_message = e.stderr.strip()
-            return False, f"Command failed with exit code {e.returncode}. Error: {error_message}"
-        except Exception as e:
-            # Catch any other exceptions
-            return False, str(e)
-        
+    async def validate_scene(self, scene_id, code, candidate=0):
+        """
+        Checks the generated code of the scene before it is rendered
+        :param scene_id: Scene id (string)
+        :param code: Generated manim code (string)
+        :param candidate: Codegen candidate the code belongs to (int)
+        :return: true if no problem was found, false otherwise, including the error message (bool, string)
+        """
+        # the first validation waits for the names manim exports, see validator.py
+        valid, error = await asyncio.to_thread(validate_scene_code, code)
+        if valid and VALIDATE_DRY_RUN:
+            valid, error = await self.render_scene(scene_id, dry_run=True, candidate=candidate)
+        return valid, error
 
     async def generate_speech(self, scene_id, video_id):
         """
@@ -323,7 +436,19 @@ class SceneGenerator:
         :param video_id: Video id (string)
         """
         scene_transcription = self.scene_transcriptions[scene_id]
-        synthesis = await speech_client.synthesize(scene_transcription, voice=VOICE_ID, format='wav', temperature=0.3)
+        if self.is_done(scene_id, "speech", self.get_audio_path(scene_id, video_id)):
+            self.report("tts", "done", scene_id, resumed=True)
+            return scene_id
+
+        self.report("tts", "running", scene_id)
+        try:
+            with span("tts", self.scene_indexes[scene_id]) as tts_span:
+                synthesis = await speech_synthesizer.synthesize(scene_transcription, voice=VOICE_ID, format='wav', temperature=0.3)
+                tts_span.bytes = len(synthesis['audio'])
+        except Exception as e:
+            logger.error(f"Error generating speech for scene {scene_id}: {e}")
+            self.report("tts", "failed", scene_id, error=str(e))
+            return None
         audio_path = f"{GENERATIONS_PATH}/{video_id}/{scene_id}/audio.wav"
         # if audio path does not exist, create it
         if not os.path.exists(f"{GENERATIONS_PATH}/{video_id}/{scene_id}"):
@@ -332,175 +457,339 @@ class SceneGenerator:
             audio_file.write(synthesis['audio'])
         
         logger.info(f"Successfully generated speech for scene {scene_id}")
+        # the narration changed, the scene has to be muxed again
+        self.manifest.update_scene(scene_id, speech=True, mux=False)
+        self.report("tts", "done", scene_id)
         return scene_id
         
             
 
-    async def generate_manim(self, scene_id):
+    async def generate_manim(self, scene_id, target_duration=None):
         """
-        Generates manim code from the scene description
-        :param scene_description: Scene description (string)
+        Generates manim code from the scene description. With more than one candidate, the candidates are generated and rendered at the same time, and the first one that renders wins.
+        :param scene_id: Scene id (string)
+        :param target_duration: Length of the scene's narration in seconds, the animation is timed to it (float)
         :return: scene_id (string)
         """
-        iteration = 0
         scene_transcription = self.scene_transcriptions[scene_id]
-        messages = [{
-            "role": "system", "content": SYSTEM_SCENE_PROMPT
-        }, {
-            "role": "user", "content": scene_transcription
-        }]
 
-        while iteration < MAX_ITERATIONS:
-            response = await client.chat.completions.create(
-                model=os.getenv("LLM_MODEL"),
-                messages=messages
-            )
-            logger.info(f"Generated response: {response}")
-            
-            # get output from last message
-            output = response.choices[0].message.content
+        if self.is_done(scene_id, "render", self.get_scene_path(scene_id, self.video_id)):
+            logger.info(f"Scene {scene_id} was rendered before the video was interrupted")
+            self.report("codegen", "done", scene_id, resumed=True)
+            return scene_id
 
-            # strip code block markdown
-            output = output.strip("```")
+        # identical transcriptions skip both the LLM and the render
+        cache_key = self.get_scene_cache_key(scene_id, target_duration)
+        cache_entry = await asyncio.to_thread(scene_cache.get, cache_key)
+        if cache_entry is not None:
+            try:
+                await asyncio.to_thread(self.restore_cached_scene, scene_id, cache_entry)
+                logger.info(f"Scene {scene_id} was restored from the cache")
+                self.manifest.update_scene(scene_id, render=True, mux=False, code=self.get_scene_code(scene_id))
+                self.report("codegen", "done", scene_id, cached=True)
+                return scene_id
+            except OSError as e:
+                logger.warning(f"Could not restore scene {scene_id} from the cache: {e}")
+
+        if target_duration:
+            scene_transcription = f"{scene_transcription}\n\nThe narration of this scene lasts {target_duration:.1f} seconds."
 
-            logger.info(f"Generated code: {output}")
+        tasks = [
+            asyncio.create_task(self.generate_candidate(scene_id, candidate, scene_transcription, target_duration))
+            for candidate in range(self.candidates)
+        ]
+        winner = None
+        errors = []
+        try:
+            for next_task in asyncio.as_completed(tasks):
+                try:
+                    result = await next_task
+                except Exception as e:
+                    logger.error(f"Codegen candidate for scene {scene_id} failed: {e}")
+                    errors.append(e)
+                    continue
+                if result is not None:
+                    winner = result
+                    break
+        finally:
+            # the first success wins, stop the LLM calls and renders of the other candidates
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if winner is None:
+            if len(errors) == len(tasks):
+                raise errors[0]
+            # scene was not rendered successfully after MAX_ITERATIONS
+            self.report("codegen", "failed", scene_id)
+            return None
 
-            # append output to messages
-            messages.append({"role": "assistant", "content": output})
+        try:
+            if winner > 0:
+                logger.info(f"Candidate {winner} won for scene {scene_id}")
+                await asyncio.to_thread(self.promote_candidate, scene_id, winner)
+            await asyncio.to_thread(scene_cache.put, cache_key, {
+                "video.py": f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py",
+                "video.mp4": self.get_scene_path(scene_id, self.video_id),
+            })
+        except OSError as e:
+            logger.warning(f"Could not cache scene {scene_id}: {e}")
+        finally:
+            if self.candidates > 1:
+                await asyncio.to_thread(shutil.rmtree, f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/candidates", True)
+        self.manifest.update_scene(scene_id, render=True, mux=False, code=self.get_scene_code(scene_id))
+        self.report("codegen", "done", scene_id, candidate=winner)
+        return scene_id
+
+    async def generate_candidate(self, scene_id, candidate, request, target_duration=None):
+        """
+        Generates code for the scene and renders it, feeding errors back to the LLM until it renders or MAX_ITERATIONS is reached
+        :param scene_id: Scene id (string)
+        :param candidate: Index of the candidate, candidates beyond the first spend the speculative budget (int)
+        :param request: Scene transcription, with the target duration if there is one (string)
+        :param target_duration: Length of the scene's narration in seconds (float)
+        :return: the candidate if it rendered successfully, None otherwise (int)
+        """
+        iteration = 0
+        autofixes = 0
+        candidate_path = self.get_candidate_path(scene_id, candidate)
+        # only the latest attempt is sent back, so the prompt does not grow with every retry
+        conversation = Conversation(SYSTEM_SCENE_PROMPT, request)
+        # code patched by the autofixer, tried again before asking the LLM
+        output = None
+
+        while iteration < MAX_ITERATIONS:
+            if output is None:
+                if candidate > 0:
+                    if self.speculative_budget <= 0:
+                        logger.info(f"Speculative budget of video {self.video_id} is used up, stopping candidate {candidate} of scene {scene_id}")
+                        return None
+                    self.speculative_budget -= 1
+
+                self.report("codegen", "running", scene_id, attempt=iteration + 1, candidate=candidate)
+                async with llm_limiter.slot():
+                    with span("codegen", self.scene_indexes[scene_id], attempt=iteration + 1) as codegen_span:
+                        response = await client.chat.completions.create(
+                            model=os.getenv("LLM_MODEL"),
+                            messages=conversation.get_messages()
+                        )
+                        # get output from last message
+                        output = response.choices[0].message.content
+                        codegen_span.bytes = len(output.encode())
+                logger.info(f"Generated {len(output)} characters of code for scene {scene_id} in attempt {iteration + 1}, usage: {getattr(response, 'usage', None)}")
+
+                # strip code block markdown
+                output = output.strip("```")
+
+                logger.debug(f"Generated code: {output}")
+
+            # pad animations that are a little short with a final wait, so the clip already matches the narration
+            # checked again after every autofix, since a patch can change the length of the animation
+            duration_error = None
+            if target_duration:
+                output, duration_error = fit_scene_duration(output, target_duration)
 
             # put code in a file
             try:
-                if not os.path.exists(f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}"):
-                    os.makedirs(f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}")
-                with open(f"{GENERATIONS_PATH}/{self.video_id}/{scene_id}/video.py", "w") as f:
+                if not os.path.exists(candidate_path):
+                    os.makedirs(candidate_path)
+                with open(f"{candidate_path}/video.py", "w") as f:
                     f.write(output)
             except Exception as e:
                 logger.error(f"Error writing to file: {e}")
                 return None
 
-            render_output = self.render_scene(scene_id)
+            # catch trivial errors in milliseconds instead of a full render
+            self.report("validate", "running", scene_id, attempt=iteration + 1, candidate=candidate)
+            with span("validate", self.scene_indexes[scene_id], attempt=iteration + 1) as validate_span:
+                valid, validation_error = await self.validate_scene(scene_id, output, candidate)
+                # an animation that is far too long is only worth another attempt if there is one left
+                too_long = valid and duration_error is not None and iteration < MAX_ITERATIONS - 1
+                if too_long:
+                    valid, validation_error = False, duration_error
+                if not valid:
+                    validate_span.fail(validation_error)
+            if not valid:
+                logger.info(f"Validation failed for scene {scene_id}: {validation_error}")
+                self.report("validate", "failed", scene_id, attempt=iteration + 1, candidate=candidate)
+                # mechanical errors are patched and tried again without an LLM round trip, only the LLM can shorten an animation
+                fixed_output = autofixer.fix(output, validation_error) if autofixes < MAX_AUTOFIXES and not too_long else None
+                if fixed_output is not None:
+                    autofixes += 1
+                    output = fixed_output
+                    continue
+                conversation.add_attempt(output, validation_error)
+                output = None
+                iteration += 1
+                continue
+            self.report("validate", "done", scene_id, attempt=iteration + 1, candidate=candidate)
+
+            self.report("render", "running", scene_id, attempt=iteration + 1, candidate=candidate)
+            with span("render", self.scene_indexes[scene_id], attempt=iteration + 1) as render_span:
+                render_output = await self.render_scene(scene_id, candidate=candidate)
+                if render_output[0]:
+                    if os.path.exists(f"{candidate_path}/{VIDEO_INTERNAL_PATH}"):
+                        render_span.bytes = os.path.getsize(f"{candidate_path}/{VIDEO_INTERNAL_PATH}")
+                else:
+                    render_span.fail(render_output[1])
 
             logger.info(f"Status for scene {scene_id}: {render_output}")
 
             # note render_output is either True or (False, string)
             if render_output[0]:
                 logger.info(f"Scene {scene_id} was rendered successfully")
-                return scene_id
+                self.report("render", "done", scene_id, attempt=iteration + 1, candidate=candidate)
+                return candidate
             
             # scene was not rendered successfully
-            # add error message to messages
-            messages.append({"role": "user", "content": f"Error: {render_output[1]}"})
+            self.report("render", "failed", scene_id, attempt=iteration + 1, candidate=candidate)
+            # mechanical errors are patched and tried again without an LLM round trip
+            fixed_output = autofixer.fix(output, render_output[1]) if autofixes < MAX_AUTOFIXES else None
+            if fixed_output is not None:
+                autofixes += 1
+                output = fixed_output
+                continue
+            # keep the code and error message for the next attempt
+            conversation.add_attempt(output, render_output[1])
+            output = None
             iteration += 1
             
-        # scene was not rendered successfully after MAX_ITERATIONS
         return None
     
-    def combine_manim_and_speech(self, scene_id, video_id):
+    async def combine_manim_and_speech(self, scene_id, video_id):
         """
-        Combines the manim code and speech synthesis for the scene with the given scene id
+        Combines the manim animation and speech synthesis for the scene with the given scene id, without re-encoding the animation
         :param scene_id: Scene id (string)
-        :param manim_result: Manim code (string)
-        :param speech_result: Speech synthesis (string)
+        :param video_id: Video id (string)
+        :return: true if the scene was combined successfully, false otherwise (bool)
         """
-        scene_path = self.get_scene_path(scene_id, video_id)
-        audio_path = self.get_audio_path(scene_id, video_id)
-
-        video = VideoFileClip(scene_path)
-        audio = AudioFileClip(audio_path)
-
-        # Get durations
-        video_duration = video.duration
-        audio_duration = audio.duration
-
-        logger.info(f"Video duration: {video_duration}, Audio duration: {audio_duration}")
+        if self.is_done(scene_id, "mux", self.get_narrated_scene_path(scene_id, video_id)):
+            self.report("mux", "done", scene_id, resumed=True)
+            return True
 
-        # If audio is shorter than video, append silence
-        if audio_duration < video_duration:
-            silence_duration = video_duration - audio_duration
-            silence = AudioClip(lambda t: 0, duration=silence_duration)
-            audio = CompositeAudioClip([audio, silence.set_start(audio_duration)])
-        
-        # If audio is longer than video, extend the video by holding the last frame
-        elif audio_duration > video_duration:
-            logger.warning("Audio is longer than video, extending video by holding the last frame")
-            last_frame = video.get_frame(video_duration - 0.1)
-            frozen_clip = ImageClip(last_frame).set_duration(audio_duration - video_duration)
-            video = CompositeVideoClip([video, frozen_clip.set_start(video_duration)])
-            video = video.set_duration(audio_duration)
-
-        # Ensure both clips have the same duration
-        final_duration = min(video.duration, audio.duration)
-        video = video.subclip(0, final_duration)
-        audio = audio.subclip(0, final_duration)
-
-        # Composite the video with the audio
-        final_clip = video.set_audio(audio)
-
-        # Write the final video with audio
-        # wipe scene file
-        os.remove(scene_path)
-
-        final_clip.write_videofile(scene_path, codec="libx264")
-
-        # Step 3: Profit
-        # Close the clips to free up system resources
-        video.close()
-        audio.close()
-        final_clip.close()
+        self.report("mux", "running", scene_id)
+        try:
+            with span("mux", self.scene_indexes[scene_id]) as mux_span:
+                await muxer.mux_scene(
+                    self.get_scene_path(scene_id, video_id),
+                    self.get_audio_path(scene_id, video_id),
+                    self.get_narrated_scene_path(scene_id, video_id),
+                )
+                mux_span.bytes = os.path.getsize(self.get_narrated_scene_path(scene_id, video_id))
+        except Exception as e:
+            logger.error(f"Error adding audio to scene {scene_id}: {e}")
+            self.report("mux", "failed", scene_id, error=str(e))
+            return False
 
         logger.info(f"Successfully added audio to scene {scene_id}")
+        self.manifest.update_scene(scene_id, mux=True)
+        self.report("mux", "done", scene_id)
+        return True
 
-    def combine_video_scenes(self):
+    async def combine_video_scenes(self):
         """
         Combines all the video scenes into a single video
         """
-        scene_ids = []
-        video_clips = []
+        scene_paths = []
 
         for scene_id in self.scene_transcriptions.keys():
-            scene_path = self.get_scene_path(scene_id, self.video_id)
+            scene_path = self.get_narrated_scene_path(scene_id, self.video_id)
             if os.path.exists(scene_path):
-                video_clips.append(VideoFileClip(scene_path))
-                scene_ids.append(scene_id)
+                scene_paths.append(scene_path)
             else:
                 logger.error(f"Video file does not exist at path: {scene_path}")
 
-        if not video_clips:
+        if not scene_paths:
             logger.error("No scenes were successfully generated.")
+            self.report("concat", "failed", error="No scenes were successfully generated")
             return None
 
-        final_video = concatenate_videoclips(video_clips)
         final_video_path = f"{GENERATIONS_PATH}/{self.video_id}/final_video.mp4"
-        final_video.write_videofile(final_video_path, codec="libx264")
+        self.report("concat", "running")
+        try:
+            with span("concat") as concat_span:
+                await muxer.concat_scenes(scene_paths, final_video_path)
+                concat_span.bytes = os.path.getsize(final_video_path)
+        except Exception as e:
+            logger.error(f"Error combining scenes: {e}")
+            self.report("concat", "failed", error=str(e))
+            return None
 
         logger.info(f"Final video path: {final_video_path}")
+        self.report("concat", "done")
         return final_video_path
 
+    async def generate_scene(self, index, scene_id):
+        """
+        Generates the manim animation and speech for a single scene, combines them and publishes the scene to the playlist
+        :param index: Position of the scene in the video (int)
+        :param scene_id: Scene id (string)
+        :return: scene_id if the scene was generated successfully, None otherwise (string)
+        """
+        # the narration comes first, its length is the target length of the animation
+        speech_result = await self.generate_speech(scene_id, self.video_id)
+        manim_result = None
+        if speech_result is not None:
+            target_duration = await asyncio.to_thread(get_audio_duration, self.get_audio_path(scene_id, self.video_id))
+            manim_result = await self.generate_manim(scene_id, target_duration)
+
+        if manim_result is None or speech_result is None or not await self.combine_manim_and_speech(scene_id, self.video_id):
+            logger.error(f"Scene {scene_id} was not generated successfully")
+            await self.publisher.skip(index)
+            return None
+
+        await self.publisher.publish(index, self.get_narrated_scene_path(scene_id, self.video_id))
+        return scene_id
+
     async def generate_all_scenes(self):
         """
-        Generates manim code for all scenes and stitches them together into a single video.
-        :return: Path to the final stitched video.
+        Generates all scenes, publishing each one to the playlist as soon as it and the scenes before it are ready, and stitches them together into a single video.
+        :return: Id of the video, None if no scene could be generated (string)
         """
-        tasks = []
-        for scene_id, transcription in self.scene_transcriptions.items():
-            manim_task = asyncio.create_task(self.generate_manim(scene_id))
-            speech_task = asyncio.create_task(self.generate_speech(scene_id, self.video_id))
-            tasks.append((manim_task, speech_task))
+        await self.publisher.start()
+        self.manifest.update(transcript_done=True)
 
-        # Wait for all tasks to complete
-        results = await asyncio.gather(*(asyncio.gather(*task_pair[:2]) for task_pair in tasks))
+        results = await asyncio.gather(*(
+            self.generate_scene(index, scene_id) for index, scene_id in enumerate(self.scene_transcriptions.keys())
+        ))
 
+        return await self.finish(results)
+
+    async def generate_streamed_scenes(self, scene_transcriptions):
+        """
+        Like generate_all_scenes, but for scenes that are still being written. Every scene starts generating as soon as it arrives.
+        :param scene_transcriptions: Async iterator of scene transcriptions (strings)
+        :return: Id of the video, None if no scene could be generated (string)
+        """
+        await self.publisher.start()
+
+        tasks = []
+        try:
+            # closed right away when this stops early, the transcript stream holds an llm slot
+            async with contextlib.aclosing(scene_transcriptions):
+                async for scene_transcription in scene_transcriptions:
+                    index, scene_id = self.add_scene(scene_transcription)
+                    tasks.append(asyncio.create_task(self.generate_scene(index, scene_id)))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # the job's folder is removed once this returns, the scenes must not write to it anymore
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        self.manifest.update(transcript_done=True)
+
+        results = await asyncio.gather(*tasks)
+
+        return await self.finish(results)
+
+    async def finish(self, results):
         logger.info(f"Results: {results}")
 
-        for (manim_result, speech_result), scene_id in zip(results, self.scene_transcriptions.keys()):
-            if manim_result is None or speech_result is None:
-                logger.error(f"Scene {scene_id} was not generated successfully")
-                continue
-            self.combine_manim_and_speech(scene_id, self.video_id)
+        final_video_path = await self.combine_video_scenes()
+        self.manifest.update(final_video=final_video_path)
+        await self.publisher.finish()
+        return self.video_id if final_video_path else None
 
-        self.combine_video_scenes()
-        return self.video_id
-        
 
 
 async def main():
@@ -519,4 +808,7 @@ async def main():
     await sg.generate_all_scenes()
 
 if __name__ == "__main__":
+    # the API keys are read when the clients are first used
+    import dotenv
+    dotenv.load_dotenv()
     asyncio.run(main())
\ No newline at end of file
@@ -1,8 +1,108 @@
 
-from lmnt.api import Speech
-import os 
-from dotenv import load_dotenv
+import os
+import asyncio
+from cache import DiskCache, hash_key
+from lazy import LazyObject
+from logger import logger
+from limits import tts_limiter
 
-load_dotenv()
 
-speech_client = Speech(os.getenv("LMNT_API_KEY"))
\ No newline at end of file
+def create_speech_client(choice=None):
+    """
+    Creates the client of the speech provider, importing its SDK
+    :param choice: fake or lmnt, the default, TTS_CLIENT if not given (string)
+    :return: client with an async synthesize method
+    """
+    choice = choice or os.getenv("TTS_CLIENT")
+    if choice == "fake":
+        # synthetic narration for benchmarks and offline development, see fakes.py
+        from fakes import FakeSpeech
+        return FakeSpeech()
+    from lmnt.api import Speech
+    return Speech(os.getenv("LMNT_API_KEY"))
+
+
+# the SDK is imported on the first synthesis, see lazy.py
+speech_client = LazyObject(create_speech_client)
+
+SPEECH_CACHE_PATH = os.getenv("SPEECH_CACHE_PATH") or "cache/speech"
+SPEECH_CACHE_MAX_BYTES = int(os.getenv("SPEECH_CACHE_MAX_BYTES") or 1024 ** 3)
+
+
+class CachedSpeech:
+    """
+    Wraps a speech client with a disk cache, and makes concurrent requests for the same audio share a single synthesis
+    :param client: Speech client with an async synthesize method (Speech)
+    :param cache: Cache for the synthesized audio (DiskCache)
+    """
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+        self.in_flight = {}
+        self.waiters = {}
+        self.coalesced = 0
+
+    async def synthesize(self, text, voice, format, temperature):
+        """
+        Synthesizes the text, reusing earlier or in flight syntheses with the same parameters
+        :return: synthesis with the audio under the 'audio' key (dict)
+        """
+        key = hash_key(" ".join(text.split()), voice, format, temperature)
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.load_or_synthesize(key, text, voice, format, temperature))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            self.coalesced += 1
+            logger.info("Sharing an in flight speech synthesis")
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            # a waiter that gives up must not cancel the synthesis for everyone else
+            return {"audio": await asyncio.shield(task)}
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1:
+                # but once nobody is waiting any more, there is no point in finishing it
+                task.cancel()
+                # the next caller for the same audio must start a new synthesis instead of sharing the dying one
+                self.forget(key, task)
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+
+    def forget(self, key, task):
+        # a synthesis that was given up on may finish after a new one for the same key started
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+
+    async def load_or_synthesize(self, key, text, voice, format, temperature):
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None:
+            try:
+                return await asyncio.to_thread(read_file, f"{entry}/audio.{format}")
+            except OSError as e:
+                logger.warning(f"Could not read cached speech: {e}")
+
+        async with tts_limiter.slot():
+            synthesis = await self.client.synthesize(text, voice=voice, format=format, temperature=temperature)
+        audio = synthesis['audio']
+        try:
+            await asyncio.to_thread(self.cache.put, key, {f"audio.{format}": audio})
+        except OSError as e:
+            logger.warning(f"Could not cache speech: {e}")
+        return audio
+
+    def stats(self):
+        return {**self.cache.stats(), "coalesced": self.coalesced}
+
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+speech_synthesizer = CachedSpeech(speech_client, DiskCache(SPEECH_CACHE_PATH, SPEECH_CACHE_MAX_BYTES))
@@ -0,0 +1,76 @@
+import ast
+
+from autofix import AutoFixer, parse_errors, replace_names
+
+
+SCENE = """from manim import *
+
+class VideoScene(Scene):
+    def construct(self):
+        self.play(Create(Circle(color=BLUE)))
+"""
+
+
+def test_parse_errors():
+    errors = parse_errors("NameError: name 'BROWN' is not defined (line 5)\nNameError: name 'np' is not defined (line 7)")
+    assert errors == {"NameError": ["BROWN", "np"]}
+    assert "SyntaxError" in parse_errors("IndentationError: unexpected indent (line 3)")
+    assert "SceneClassError" in parse_errors("The root scene class must be called VideoScene, found MyScene")
+
+
+def test_replace_names_leaves_strings_and_comments():
+    code = 'x = BROWN  # BROWN\ny = Text("BROWN")\nBROWNISH = 1\n'
+    assert replace_names(code, {"BROWN": "DARK_BROWN"}) == 'x = DARK_BROWN  # BROWN\ny = Text("BROWN")\nBROWNISH = 1\n'
+
+
+def test_markdown_fence_is_stripped():
+    fixed = AutoFixer().fix(f"```python\n{SCENE}```\n", "SyntaxError: invalid syntax (line 1)")
+    assert fixed.strip() == SCENE.strip()
+
+
+def test_leading_language_name_is_stripped():
+    fixed = AutoFixer().fix(f"python\n{SCENE}", "NameError: name 'python' is not defined (line 1)")
+    assert fixed.strip() == SCENE.strip()
+
+
+def test_undefined_color_is_replaced():
+    code = SCENE.replace("BLUE", "BROWN")
+    fixed = AutoFixer().fix(code, "NameError: name 'BROWN' is not defined (line 5)")
+    assert fixed == SCENE.replace("BLUE", "DARK_BROWN")
+
+
+def test_missing_import_is_added_after_the_imports():
+    code = SCENE.replace("color=BLUE", "radius=np.sqrt(2)")
+    fixed = AutoFixer().fix(code, "NameError: name 'np' is not defined (line 5)")
+    assert fixed.splitlines()[:2] == ["from manim import *", "import numpy as np"]
+    ast.parse(fixed)
+
+
+def test_only_scene_class_is_renamed():
+    code = SCENE.replace("class VideoScene(Scene)", "class Helper:\n    pass\n\nclass CircleScene(MovingCameraScene)")
+    fixed = AutoFixer().fix(code, "The root scene class must be called VideoScene, found Helper, CircleScene")
+    assert "class VideoScene(MovingCameraScene)" in fixed
+    assert "class Helper:" in fixed
+
+
+def test_ambiguous_scene_classes_are_left_alone():
+    code = SCENE + "\nclass OtherScene(Scene):\n    pass\n"
+    code = code.replace("class VideoScene(Scene)", "class FirstScene(Scene)")
+    assert AutoFixer().fix(code, "The root scene class must be called VideoScene, found FirstScene, OtherScene") is None
+
+
+def test_errors_without_a_rule_are_left_to_the_llm():
+    fixer = AutoFixer()
+    assert fixer.fix(SCENE, "NameError: name 'UNKNOWN_THING' is not defined (line 5)") is None
+    assert fixer.fix(SCENE, "The animation lasts about 30.0 seconds, but the narration only lasts 10.0 seconds.") is None
+    assert fixer.stats()["fixed"] == 0
+
+
+def test_several_rules_apply_to_one_error_and_are_counted():
+    code = SCENE.replace("color=BLUE", "color=BROWN, radius=np.sqrt(2)")
+    fixer = AutoFixer()
+    fixed = fixer.fix(code, "NameError: name 'BROWN' is not defined (line 5)\nNameError: name 'np' is not defined (line 5)")
+    assert "DARK_BROWN" in fixed and "import numpy as np" in fixed
+    stats = fixer.stats()
+    assert stats["errors"] == 1 and stats["fixed"] == 1 and stats["hit_rate"] == 1.0
+    assert stats["rules"]["undefined_color"] == 1 and stats["rules"]["missing_import"] == 1
@@ -0,0 +1,63 @@
+import os
+
+from cache import DiskCache, hash_key, normalize_text
+
+
+def put(cache, name, size, last_use=None):
+    path = cache.put(hash_key(name), {"data.bin": b"x" * size})
+    if last_use is not None:
+        os.utime(path, (last_use, last_use))
+    return path
+
+
+def test_entries_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    source = tmp_path / "source.py"
+    source.write_text("print('hi')")
+    path = cache.put(hash_key("scene"), {"audio.wav": b"RIFF", "video.py": str(source)})
+    # later changes to the source do not reach the entry
+    source.write_text("changed")
+
+    assert cache.get(hash_key("scene")) == path
+    assert open(f"{path}/audio.wav", "rb").read() == b"RIFF"
+    assert open(f"{path}/video.py").read() == "print('hi')"
+    assert cache.get(hash_key("other")) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = DiskCache(str(tmp_path), 250)
+    put(cache, "a", 100, last_use=1000)
+    put(cache, "b", 100, last_use=2000)
+    # reading a makes it the most recently used entry
+    assert cache.get(hash_key("a")) is not None
+    put(cache, "c", 100)
+
+    assert cache.get(hash_key("b")) is None
+    assert cache.get(hash_key("a")) is not None
+    assert cache.get(hash_key("c")) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_removes_as_many_entries_as_needed(tmp_path):
+    cache = DiskCache(str(tmp_path), 250)
+    for index, name in enumerate("abc"):
+        put(cache, name, 80, last_use=1000 + index)
+    put(cache, "d", 200)
+
+    assert [cache.get(hash_key(name)) is not None for name in "abcd"] == [False, False, False, True]
+    assert cache.stats()["evictions"] == 3
+
+
+def test_replacing_an_entry_keeps_a_single_copy(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024)
+    put(cache, "a", 10)
+    path = put(cache, "a", 20)
+
+    assert os.path.getsize(f"{path}/data.bin") == 20
+    assert [entry[1] for entry in cache.entries()] == [20]
+
+
+def test_keys_ignore_case_and_whitespace_of_text():
+    assert hash_key(normalize_text("Hello  World\n")) == hash_key(normalize_text("hello world"))
+    assert hash_key("a", 1) != hash_key("a", 2)
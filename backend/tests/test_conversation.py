@@ -0,0 +1,76 @@
+import conversation
+from conversation import Conversation, summarize_error, trim_traceback
+
+
+TRACEBACK = """Traceback (most recent call last):
+  File "/usr/lib/python3.11/site-packages/manim/cli/render/commands.py", line 120, in render
+    scene.render()
+  File "/usr/lib/python3.11/site-packages/manim/scene/scene.py", line 229, in render
+    self.construct()
+  File "/tmp/generated/video.py", line 7, in construct
+    circle = Circle(color=BROWN)
+  File "/usr/lib/python3.11/site-packages/manim/mobject/geometry/arc.py", line 50, in __init__
+    self.helper()
+  File "/usr/lib/python3.11/site-packages/manim/utils/color.py", line 12, in helper
+    raise ValueError("bad color")
+ValueError: bad color"""
+
+
+def test_trim_traceback_keeps_generated_code_and_raising_frame():
+    trimmed = trim_traceback(TRACEBACK)
+    assert trimmed.splitlines() == [
+        "Traceback (most recent call last):",
+        "  ...",
+        '  File "/tmp/generated/video.py", line 7, in construct',
+        "    circle = Circle(color=BROWN)",
+        "  ...",
+        '  File "/usr/lib/python3.11/site-packages/manim/utils/color.py", line 12, in helper',
+        '    raise ValueError("bad color")',
+        "ValueError: bad color",
+    ]
+
+
+def test_trim_traceback_drops_manim_log_lines():
+    error = "[10/18/26 18:30:00] INFO     Animation 0 : Partial movie file written\nNameError: name 'BROWN' is not defined"
+    assert trim_traceback(error) == "NameError: name 'BROWN' is not defined"
+
+
+def test_trim_traceback_keeps_the_end_of_long_errors(monkeypatch):
+    monkeypatch.setattr(conversation, "MAX_ERROR_LENGTH", 20)
+    trimmed = trim_traceback("x" * 100 + "\nKeyError: 'end'")
+    assert trimmed == "..." + ("x" * 100 + "\nKeyError: 'end'")[-20:]
+
+
+def test_summarize_error_takes_the_last_line():
+    assert summarize_error(TRACEBACK) == "ValueError: bad color"
+    assert summarize_error("╰──────╯\n│ NameError: name 'x' │\n╰──╯") == "NameError: name 'x'"
+
+
+def test_first_attempt_is_system_prompt_and_request():
+    messages = Conversation("system", "request").get_messages()
+    assert messages == [{"role": "system", "content": "system"}, {"role": "user", "content": "request"}]
+
+
+def test_only_latest_attempt_is_sent_back():
+    chat = Conversation("system", "request")
+    for attempt in range(6):
+        chat.add_attempt(f"code {attempt}", f"Traceback\nError{attempt}: failed {attempt}")
+
+    messages = chat.get_messages()
+    assert len(messages) == 4
+    assert messages[0]["content"] == "system"
+    assert messages[2] == {"role": "assistant", "content": "code 5"}
+    feedback = messages[3]["content"]
+    assert feedback.startswith("Error: Traceback\nError5: failed 5")
+    # the most recent earlier errors are summarized, bounded by MAX_EARLIER_ERRORS
+    assert "Error0" not in feedback
+    assert [line for line in feedback.splitlines() if line.startswith("- ")] == [
+        f"- Error{attempt}: failed {attempt}" for attempt in range(1, 5)
+    ]
+
+
+def test_repeated_errors_are_summarized_once():
+    chat = Conversation("system", "request")
+    for attempt in range(3):
+        chat.add_attempt(f"code {attempt}", "NameError: name 'BROWN' is not defined")
+    assert chat.earlier_errors == ["NameError: name 'BROWN' is not defined"]
@@ -0,0 +1,88 @@
+import ast
+import wave
+
+import pytest
+
+from duration import append_wait, estimate_scene_duration, fit_scene_duration, get_audio_duration
+
+
+def scene(body, helpers=""):
+    return f"from manim import *\n\nclass VideoScene(Scene):\n    def construct(self):\n{body}{helpers}"
+
+
+@pytest.mark.parametrize("body, expected, exact", [
+    ("        self.play(Create(c))\n", 1.0, True),
+    ("        self.play(Create(c), run_time=2.5)\n        self.wait(0.5)\n", 3.0, True),
+    ("        self.play(Create(c, run_time=3), FadeIn(d))\n", 3.0, True),
+    ("        self.wait()\n        self.wait(duration=2 * 1.5)\n", 4.0, True),
+    ("        for i in range(3):\n            self.play(Create(c), run_time=0.5)\n", 1.5, True),
+    ("        for d in [a, b]:\n            self.wait(2)\n", 4.0, True),
+    ("        for d in dots:\n            self.wait(2)\n", 2.0, False),
+    ("        if flag:\n            self.wait(3)\n        else:\n            self.wait(1)\n", 3.0, False),
+    ("        self.play(Create(c), run_time=t)\n", 1.0, False),
+    ("        self.intro()\n        self.wait(1)\n", 3.0, True),
+])
+def test_estimate_scene_duration(body, expected, exact):
+    helpers = "\n    def intro(self):\n        self.play(Write(t), run_time=2)\n"
+    assert estimate_scene_duration(scene(body, helpers)) == (pytest.approx(expected), exact)
+
+
+def test_recursion_is_not_followed():
+    code = scene("        self.loop()\n", "\n    def loop(self):\n        self.wait(1)\n        self.loop()\n")
+    assert estimate_scene_duration(code) == (1.0, False)
+
+
+def test_code_without_a_scene_is_not_estimated():
+    assert estimate_scene_duration("def f(:") == (None, False)
+    assert estimate_scene_duration("x = 1\n") == (None, False)
+
+
+@pytest.mark.parametrize("code", [
+    "class VideoScene(Scene):\n    def construct(self): self.play(A())\n",
+    "class VideoScene(Scene):\n    def construct(self):\n        self.play(A()); self.play(B())  # comment\n",
+    "class VideoScene(Scene):\n\tdef construct(self):\n\t\tfor i in range(2):\n\t\t\tself.play(A())\n",
+    "class VideoScene(Scene):\n    def construct(self):\n        self.play(Write(Text('π'))); return\n",
+    "class VideoScene(Scene):\n    def construct(self):\n        self.play(A(\n            'x'))\n        return\n",
+])
+def test_append_wait_adds_a_running_wait(code):
+    before, _ = estimate_scene_duration(code)
+    padded = append_wait(code, 1.5)
+    ast.parse(padded)
+    assert estimate_scene_duration(padded)[0] == pytest.approx(before + 1.5)
+
+
+def test_short_scene_is_padded_once():
+    code = scene("        self.play(Create(c), run_time=2)\n")
+    padded, error = fit_scene_duration(code, 5)
+    assert error is None
+    assert estimate_scene_duration(padded)[0] == pytest.approx(5)
+    # fitting the padded code again, e.g. after an autofix, changes nothing
+    assert fit_scene_duration(padded, 5) == (padded, None)
+
+
+def test_long_scene_is_reported():
+    code, error = fit_scene_duration(scene("        self.wait(30)\n"), 10)
+    assert "lasts about 30.0 seconds" in error
+
+
+def test_approximate_scene_is_not_padded():
+    code = scene("        self.play(Create(c), run_time=t)\n")
+    assert fit_scene_duration(code, 5) == (code, None)
+
+
+def write_wav(path, seconds, rate=16000):
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(b"\0\0" * int(seconds * rate))
+
+
+def test_get_audio_duration(tmp_path):
+    write_wav(tmp_path / "speech.wav", 2.5)
+    assert get_audio_duration(str(tmp_path / "speech.wav")) == pytest.approx(2.5)
+
+
+def test_get_audio_duration_of_an_invalid_file(tmp_path):
+    (tmp_path / "speech.wav").write_bytes(b"not a wav file")
+    assert get_audio_duration(str(tmp_path / "speech.wav")) is None
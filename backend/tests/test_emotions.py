@@ -0,0 +1,48 @@
+import asyncio
+import base64
+import contextlib
+
+from emotions import EmotionSmoother, HumePool, HumeProvider
+
+
+class FakeSocket:
+    """
+    Answers like the Hume StreamSocket, which decodes its payload as utf-8 and expects base64
+    """
+    def __init__(self):
+        self.payloads = []
+
+    async def send_bytes(self, bytes_data):
+        self.payloads.append(base64.b64decode(bytes_data.decode("utf-8"), validate=True))
+        return {"face": {"predictions": [{"emotions": [{"name": "Joy", "score": 0.7}]}]}}
+
+
+class FakePool(HumePool):
+    def __init__(self, socket):
+        super().__init__(size=1)
+        self.socket = socket
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        yield self.socket
+
+
+def test_analyze_sends_frame_base64_encoded():
+    socket = FakeSocket()
+    frame = b"\xff\xd8\xff\xe0 not utf-8 \x80\x81"
+
+    result = asyncio.run(FakePool(socket).analyze(frame))
+
+    assert socket.payloads == [frame]
+    assert HumeProvider(FakePool(socket)).parse(result) == {"Joy": 0.7}
+
+
+def test_parse_without_face_is_empty():
+    assert HumeProvider(FakePool(FakeSocket())).parse({"face": {"warning": "No faces detected."}}) == {}
+
+
+def test_smoother_keeps_last_emotions_without_face():
+    smoother = EmotionSmoother(smoothing=0.5, top_k=2)
+    assert smoother.update({"Joy": 0.9, "Calmness": 0.5, "Sadness": 0.1}) == "Joy, Calmness"
+    assert smoother.update({}) == "Joy, Calmness"
+    assert smoother.update({"Joy": 0, "Calmness": 0.9, "Sadness": 1.0}) == "Calmness, Sadness"
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import fakes
+from duration import get_audio_duration
+from fakes import FakeCompletions, FakeSpeech
+from transcript_generator import SceneArrayParser
+
+TRANSCRIPT_MESSAGES = [{"role": "system", "content": "Write a transcript"}, {"role": "user", "content": "Sorting  algorithms"}]
+CODEGEN_MESSAGES = [{"role": "system", "content": "Write Manim code"}, {"role": "user", "content": "A scene"}]
+
+
+def test_transcripts_are_a_json_array_of_scenes_about_the_topic():
+    async def main():
+        completions = FakeCompletions(latency=0)
+        response = await completions.create("model", TRANSCRIPT_MESSAGES)
+        stream = await completions.create("model", TRANSCRIPT_MESSAGES, stream=True)
+        parser = SceneArrayParser()
+        streamed = [scene async for chunk in stream for scene in parser.feed(chunk.choices[0].delta.content)]
+        return response, streamed
+
+    response, streamed = asyncio.run(main())
+    scenes = json.loads(response.choices[0].message.content)
+    assert len(scenes) == fakes.FAKE_TRANSCRIPT_SCENES
+    assert all("Sorting algorithms" in scene for scene in scenes)
+    assert streamed == scenes
+    assert response.usage.prompt_tokens > 0
+
+
+def test_codegen_replays_the_same_programs_for_the_same_seed():
+    async def generate(seed):
+        completions = FakeCompletions(latency=0, failure_rate=0, seed=seed)
+        return [(await completions.create("model", CODEGEN_MESSAGES)).choices[0].message.content for _ in range(5)]
+
+    first = asyncio.run(generate(1))
+    assert first == asyncio.run(generate(1))
+    assert all("class VideoScene(" in code for code in first)
+
+
+def test_broken_responses_are_counted_by_failure():
+    async def main():
+        completions = FakeCompletions(latency=0, failure_rate=1)
+        for _ in range(20):
+            await completions.create("model", CODEGEN_MESSAGES)
+        return completions.failures
+
+    failures = asyncio.run(main())
+    assert sum(failures.values()) == 20
+    assert set(failures) == set(fakes.FAILURES)
+
+
+def test_narration_lasts_as_long_as_the_text_takes_to_read(tmp_path):
+    audio = asyncio.run(FakeSpeech(latency=0).synthesize("one two three four five", "lily"))["audio"]
+    path = tmp_path / "audio.wav"
+    path.write_bytes(audio)
+    assert abs(get_audio_duration(str(path)) - 5 / fakes.FAKE_TTS_WORDS_PER_SECOND) < 0.01
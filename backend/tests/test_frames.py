@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import io
+import time
+
+from PIL import Image
+
+import frames
+from frames import FrameThrottle, LatestFrame, decode_frame, difference_hash
+
+
+def encode(image, format="JPEG"):
+    output = io.BytesIO()
+    image.save(output, format=format)
+    return output.getvalue()
+
+
+def gradient(width=320, height=240, mirrored=False):
+    """
+    Grayscale image that gets brighter from left to right, or from right to left
+    """
+    image = Image.new("L", (width, height))
+    image.putdata([
+        255 * (width - 1 - x if mirrored else x) // (width - 1) for y in range(height) for x in range(width)
+    ])
+    return image.convert("RGB")
+
+
+def distance(first, second):
+    return bin(first ^ second).count("1")
+
+
+def test_binary_frames_are_passed_on_as_they_are():
+    assert decode_frame({"bytes": b"\xff\xd8jpeg"}) == b"\xff\xd8jpeg"
+
+
+def test_data_url_frames_are_decoded():
+    text = "data:image/jpeg;base64," + base64.b64encode(b"\xff\xd8jpeg").decode()
+    assert decode_frame({"text": text}) == b"\xff\xd8jpeg"
+
+
+def test_unusable_frames_are_dropped(monkeypatch):
+    monkeypatch.setattr(frames, "MAX_FRAME_BYTES", 8)
+    assert decode_frame({"text": "hello"}) is None
+    assert decode_frame({"text": "data:image/png;base64,not base64!"}) is None
+    assert decode_frame({"bytes": b""}) is None
+    assert decode_frame({"bytes": b"x" * 9}) is None
+
+
+def test_similar_frames_have_close_hashes():
+    frame_hash = difference_hash(encode(gradient()))
+    # same picture, at another size and compression
+    assert distance(frame_hash, difference_hash(encode(gradient(640, 480), format="PNG"))) <= frames.FRAME_CHANGE_THRESHOLD
+    assert distance(frame_hash, difference_hash(encode(gradient(mirrored=True)))) > frames.FRAME_CHANGE_THRESHOLD
+
+
+def test_frames_that_can_not_be_decoded_have_no_hash():
+    assert difference_hash(b"not an image") is None
+
+
+def test_unchanged_frames_are_skipped_until_the_analysis_is_old(monkeypatch):
+    throttle = FrameThrottle()
+    frame_hash = difference_hash(encode(gradient()))
+    # nothing was analyzed yet
+    assert not throttle.is_unchanged(frame_hash)
+
+    throttle.record(time.monotonic(), frame_hash)
+    assert throttle.is_unchanged(frame_hash)
+    assert throttle.is_unchanged(frame_hash ^ 0b111)
+    assert not throttle.is_unchanged(difference_hash(encode(gradient(mirrored=True))))
+    assert not throttle.is_unchanged(None)
+    assert throttle.skipped == 2
+
+    monkeypatch.setattr(frames, "FRAME_REFRESH_SECONDS", 0)
+    assert not throttle.is_unchanged(frame_hash)
+
+
+def test_interval_follows_the_latency_of_the_emotion_backend(monkeypatch):
+    monkeypatch.setattr(frames, "FRAME_MIN_INTERVAL", 1)
+    monkeypatch.setattr(frames, "FRAME_MAX_INTERVAL", 5)
+    monkeypatch.setattr(frames, "FRAME_LATENCY_FACTOR", 2)
+    throttle = FrameThrottle()
+    assert throttle.interval == 1
+
+    throttle.record(time.monotonic() - 2, None)
+    assert 4 <= throttle.interval <= 5
+    throttle.record(time.monotonic() - 10, None)
+    assert throttle.interval == 5
+
+
+def test_only_the_newest_frame_is_kept():
+    async def main():
+        latest = LatestFrame()
+        latest.put(b"first")
+        latest.put(b"second")
+        frame = await latest.get()
+        waiting = asyncio.create_task(latest.get())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        latest.put(b"third")
+        return frame, await waiting, latest.superseded
+
+    assert asyncio.run(main()) == (b"second", b"third", 1)
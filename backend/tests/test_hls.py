@@ -0,0 +1,68 @@
+import asyncio
+
+from hls import HlsPublisher
+
+
+class RecordingPublisher(HlsPublisher):
+    """
+    Publishes scenes as a single segment each, without ffmpeg
+    """
+    def __init__(self, output_dir, durations):
+        super().__init__(output_dir)
+        self.durations = durations
+        self.published = []
+
+    async def segment_scene(self, index, scene_path):
+        self.published.append(scene_path)
+        self.segments.append((f"scene{index:02d}_000.ts", self.durations[index], bool(self.segments)))
+        self.first_segment.set()
+
+
+def read_playlist(publisher):
+    with open(publisher.playlist_path) as playlist_file:
+        return playlist_file.read().splitlines()
+
+
+def test_scenes_are_published_in_order_as_soon_as_the_scenes_before_them_are_ready(tmp_path):
+    publisher = RecordingPublisher(str(tmp_path), durations=[4.0, 7.5, 3.0])
+
+    async def main():
+        await publisher.start()
+        assert read_playlist(publisher)[-1] == "#EXT-X-MEDIA-SEQUENCE:0"
+        await publisher.publish(1, "scene1.mp4")
+        # held back by the first scene
+        assert publisher.published == []
+        await publisher.publish(0, "scene0.mp4")
+        assert publisher.published == ["scene0.mp4", "scene1.mp4"]
+        await publisher.publish(2, "scene2.mp4")
+        await publisher.finish()
+
+    asyncio.run(main())
+    assert read_playlist(publisher) == [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        "#EXT-X-TARGETDURATION:8",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXTINF:4.000,",
+        "scene00_000.ts",
+        "#EXT-X-DISCONTINUITY",
+        "#EXTINF:7.500,",
+        "scene01_000.ts",
+        "#EXT-X-DISCONTINUITY",
+        "#EXTINF:3.000,",
+        "scene02_000.ts",
+        "#EXT-X-ENDLIST",
+    ]
+
+
+def test_failed_scenes_do_not_hold_back_later_ones(tmp_path):
+    publisher = RecordingPublisher(str(tmp_path), durations=[4.0, 5.0])
+
+    async def main():
+        await publisher.publish(1, "scene1.mp4")
+        await publisher.skip(0)
+
+    asyncio.run(main())
+    assert publisher.published == ["scene1.mp4"]
+    assert "#EXT-X-ENDLIST" not in read_playlist(publisher)
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import stat
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import jobs
+import render_pool
+import scene_generator
+import transcript_generator
+import validator
+from cache import DiskCache
+from fakes import FakeCompletions, FakeSpeech
+from jobs import CANCELLED, JobScheduler
+from render_pool import RenderPool
+
+# stands in for the manim cli: records its pid and the pid of a child it started, then renders forever
+FAKE_MANIM = """#!/bin/sh
+echo $$ >> "$RENDER_PIDS"
+sleep 60 &
+echo $! >> "$RENDER_PIDS"
+wait
+"""
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a killed child of the fake manim may linger as a zombie until init reaps it
+    with open(f"/proc/{pid}/stat") as stat_file:
+        return stat_file.read().split(")")[-1].split()[0] != "Z"
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """
+    Runs jobs in tmp_path with the fake LLM and speech providers and a render pool whose manim never finishes
+    """
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "manim").write_text(FAKE_MANIM)
+    (bin_path / "manim").chmod(stat.S_IRWXU)
+    pids_path = tmp_path / "render_pids"
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("RENDER_PIDS", str(pids_path))
+
+    generations_path = str(tmp_path / "generated")
+    monkeypatch.setattr(jobs, "GENERATIONS_PATH", generations_path)
+    monkeypatch.setattr(scene_generator, "GENERATIONS_PATH", generations_path)
+    llm = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(latency=0, failure_rate=0)))
+    monkeypatch.setattr(scene_generator, "client", llm)
+    monkeypatch.setattr(transcript_generator, "client", llm)
+    monkeypatch.setattr(scene_generator, "speech_synthesizer", FakeSpeech(latency=0))
+    monkeypatch.setattr(scene_generator, "scene_cache", DiskCache(str(tmp_path / "cache"), 1024 ** 2))
+    monkeypatch.setattr(render_pool, "RENDER_WARM_WORKERS", False)
+    monkeypatch.setattr(scene_generator, "render_queue", RenderPool(workers=2))
+    # no manim to ask for the names it exports, the validator skips its name checks
+    monkeypatch.setattr(validator, "manim_names", frozenset())
+    return generations_path, pids_path
+
+
+async def wait_for(condition, timeout=10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_cancelling_a_rendering_job_kills_its_renders_and_removes_its_files(pipeline):
+    generations_path, pids_path = pipeline
+
+    async def main():
+        scheduler = JobScheduler()
+        job = scheduler.submit("Sorting algorithms", "curious")
+        try:
+            # every scene of the fake transcript starts a render, each with a child process
+            await wait_for(lambda: pids_path.exists() and len(pids_path.read_text().split()) == 2 * scene_generator.render_queue.workers)
+            assert os.path.isdir(f"{generations_path}/{job.job_id}")
+            assert await scheduler.cancel(job)
+        finally:
+            await scheduler.stop()
+            await scene_generator.render_queue.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == CANCELLED
+    assert not os.path.exists(f"{generations_path}/{job.job_id}")
+    assert not any(is_alive(int(pid)) for pid in pids_path.read_text().split())
+
+
+def test_cancelling_a_queued_job_removes_its_files(pipeline):
+    generations_path, _ = pipeline
+
+    async def main():
+        scheduler = JobScheduler()
+        job = scheduler.submit("Sorting algorithms", "curious")
+        # the worker has not picked the job up yet
+        assert job.task is None
+        assert await scheduler.cancel(job)
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == CANCELLED and job.task is None
+    assert not os.path.exists(f"{generations_path}/{job.job_id}")
+
+
+def test_scenes_are_stopped_before_the_files_of_a_cancelled_job_are_removed(pipeline, monkeypatch):
+    generations_path, _ = pipeline
+    # the transcript is still being written when the job is cancelled
+    llm = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(latency=2, failure_rate=0)))
+    monkeypatch.setattr(transcript_generator, "client", llm)
+    started = []
+
+    async def generate_scene(self, index, scene_id):
+        started.append(scene_id)
+        try:
+            await asyncio.sleep(60)
+        finally:
+            # a scene that is slow to stop writes into the job's folder while it winds down
+            await asyncio.sleep(0.1)
+            os.makedirs(f"{generations_path}/{self.video_id}/{scene_id}", exist_ok=True)
+
+    monkeypatch.setattr(scene_generator.SceneGenerator, "generate_scene", generate_scene)
+
+    async def main():
+        scheduler = JobScheduler()
+        job = scheduler.submit("Sorting algorithms", "curious")
+        try:
+            await wait_for(lambda: started)
+            assert await scheduler.cancel(job)
+            # long enough for any scene still winding down to write
+            await asyncio.sleep(0.3)
+        finally:
+            await scheduler.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job.status == CANCELLED
+    assert not os.path.exists(f"{generations_path}/{job.job_id}")
+
+
+@pytest.fixture
+def scheduler_jobs(tmp_path, monkeypatch):
+    """
+    Runs jobs in tmp_path that wait until the test lets them finish, instead of running the pipeline
+    """
+    generations_path = str(tmp_path / "generated")
+    monkeypatch.setattr(jobs, "GENERATIONS_PATH", generations_path)
+    finish = {}
+
+    async def run(self, job):
+        job.set_status(jobs.RUNNING)
+        finish[job.job_id] = asyncio.Event()
+        try:
+            await finish[job.job_id].wait()
+        except asyncio.CancelledError:
+            job.set_status(CANCELLED, "Cancelled")
+            raise
+        job.set_status(jobs.DONE)
+
+    monkeypatch.setattr(JobScheduler, "run", run)
+    return generations_path, finish
+
+
+def test_jobs_beyond_the_queue_limit_are_turned_away(scheduler_jobs, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_QUEUED_JOBS", 1)
+    _, finish = scheduler_jobs
+
+    async def main():
+        scheduler = JobScheduler(workers=1)
+        running = scheduler.submit("First", "happy")
+        await wait_for(lambda: running.job_id in finish)
+        queued = scheduler.submit("Second", "happy")
+        turned_away = scheduler.submit("Third", "happy")
+        finish[running.job_id].set()
+        await wait_for(lambda: queued.job_id in finish)
+        statuses = running.status, queued.status
+        await scheduler.stop()
+        return statuses, turned_away
+
+    assert asyncio.run(main()) == ((jobs.DONE, jobs.RUNNING), None)
+
+
+def test_clients_are_woken_up_by_every_change_of_a_job(scheduler_jobs):
+    async def main():
+        scheduler = JobScheduler()
+        job = scheduler.submit("Topic", "happy")
+        changed = job.changed
+        job.add_scene("First scene")
+        await asyncio.wait_for(changed.wait(), 1)
+        changed = job.changed
+        job.report("tts", "running", 0)
+        await asyncio.wait_for(changed.wait(), 1)
+        await scheduler.stop()
+        return job.to_dict()
+
+    status = asyncio.run(main())
+    assert status["scenes"][0]["stages"]["tts"]["state"] == "running"
+    assert status["video"] is None and not status["playlist_ready"]
+
+
+def test_unfinished_jobs_of_an_earlier_run_are_resumed(scheduler_jobs):
+    _, finish = scheduler_jobs
+
+    async def main():
+        earlier = JobScheduler()
+        unfinished = earlier.submit("Unfinished", "happy")
+        finished = earlier.submit("Finished", "happy")
+        await wait_for(lambda: finished.job_id in finish)
+        finish[finished.job_id].set()
+        await wait_for(lambda: finished.status == jobs.DONE)
+        await earlier.stop()
+        await unfinished.manifest.flush()
+        await finished.manifest.flush()
+
+        # a new server starts
+        later = JobScheduler()
+        resumed = later.resume()
+        await wait_for(lambda: later.jobs[unfinished.job_id].status == jobs.RUNNING)
+        restored = later.get(finished.job_id)
+        await later.stop()
+        return resumed, restored.status, later.get(str(uuid.uuid4())), later.get("../etc")
+
+    assert asyncio.run(main()) == (1, jobs.DONE, None, None)
+
+
+def test_jobs_nobody_asks_about_are_cancelled(scheduler_jobs, monkeypatch):
+    generations_path, finish = scheduler_jobs
+    monkeypatch.setattr(jobs, "JOB_ABANDON_SECONDS", 0.2)
+    monkeypatch.setattr(jobs, "JOB_REAP_INTERVAL", 0.05)
+
+    async def main():
+        scheduler = JobScheduler()
+        abandoned = scheduler.submit("Abandoned", "happy")
+        watched = scheduler.submit("Watched", "happy")
+        watched.watchers += 1
+        polled = scheduler.submit("Polled", "happy")
+        for _ in range(8):
+            polled.touch()
+            await asyncio.sleep(0.05)
+        statuses = abandoned.status, watched.status, polled.status
+        await scheduler.stop()
+        return statuses, abandoned
+
+    statuses, abandoned = asyncio.run(main())
+    assert statuses == (jobs.CANCELLED, jobs.RUNNING, jobs.RUNNING)
+    assert not os.path.exists(f"{generations_path}/{abandoned.job_id}")
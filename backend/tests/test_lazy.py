@@ -0,0 +1,58 @@
+import threading
+import time
+
+from lazy import LazyObject
+
+
+def test_the_object_is_created_on_first_use_only():
+    created = []
+
+    def factory():
+        created.append(True)
+        return "Hello"
+
+    lazy = LazyObject(factory)
+    assert created == []
+    assert lazy.upper() == "HELLO"
+    assert lazy.lower() == "hello"
+    assert lazy.load() == "Hello"
+    assert created == [True]
+
+
+def test_concurrent_first_uses_create_a_single_object():
+    created = []
+
+    def factory():
+        # as slow as importing an SDK
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    lazy = LazyObject(factory)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lazy.load())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+
+
+def test_a_failed_creation_is_retried_on_the_next_use():
+    attempts = []
+
+    def factory():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise ImportError("No module named 'openai'")
+        return "client"
+
+    lazy = LazyObject(factory)
+    try:
+        lazy.load()
+    except ImportError:
+        pass
+    assert lazy.load() == "client"
+    assert len(attempts) == 2
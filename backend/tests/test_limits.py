@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import limits
+from limits import FairSemaphore, ResourceLimiter, TokenBucket, current_job
+
+
+async def run_waiters(semaphore, owners):
+    """
+    Queues a waiter per owner behind a held slot, releases the slot, and records the order the waiters got their slots in
+    """
+    order = []
+
+    async def waiter(owner):
+        await semaphore.acquire(owner)
+        order.append(owner)
+        await asyncio.sleep(0)
+        semaphore.release()
+
+    await semaphore.acquire("holder")
+    tasks = [asyncio.create_task(waiter(owner)) for owner in owners]
+    await asyncio.sleep(0)
+    semaphore.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_slots_are_handed_out_round_robin_across_owners():
+    order = asyncio.run(run_waiters(FairSemaphore(1), ["a", "a", "a", "b", "c", "b"]))
+    assert order == ["a", "b", "c", "a", "b", "a"]
+
+
+def test_limit_is_respected():
+    async def main():
+        semaphore = FairSemaphore(2)
+        running, peak = 0, 0
+
+        async def work(owner):
+            nonlocal running, peak
+            await semaphore.acquire(owner)
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            semaphore.release()
+
+        await asyncio.gather(*(work(index % 3) for index in range(10)))
+        return peak, semaphore.active, semaphore.waiting
+
+    assert asyncio.run(main()) == (2, 0, 0)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        semaphore = FairSemaphore(1)
+        await semaphore.acquire("a")
+        task = asyncio.create_task(semaphore.acquire("b"))
+        await asyncio.sleep(0)
+        assert semaphore.waiting == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert semaphore.waiting == 0 and not semaphore.waiters
+        semaphore.release()
+        return semaphore.active
+
+    assert asyncio.run(main()) == 0
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def main():
+        semaphore = FairSemaphore(1)
+        await semaphore.acquire("a")
+        cancelled = asyncio.create_task(semaphore.acquire("b"))
+        next_waiter = asyncio.create_task(semaphore.acquire("c"))
+        await asyncio.sleep(0)
+        # the slot goes to b, which gives up before it runs
+        semaphore.release()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.wait_for(next_waiter, timeout=1)
+        return semaphore.active
+
+    assert asyncio.run(main()) == 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(limits.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(limits.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    async def main():
+        bucket = TokenBucket(rate=2, burst=3)
+        times = []
+        for _ in range(6):
+            await bucket.take()
+            times.append(clock.now)
+        return times
+
+    assert asyncio.run(main()) == pytest.approx([0, 0, 0, 0.5, 1.0, 1.5])
+
+
+def test_token_bucket_refills_while_idle(clock):
+    async def main():
+        bucket = TokenBucket(rate=1, burst=2)
+        await bucket.take()
+        await bucket.take()
+        clock.now += 10
+        start = clock.now
+        await bucket.take()
+        await bucket.take()
+        return clock.now - start
+
+    # refilled to the burst, not beyond it
+    assert asyncio.run(main()) == 0
+
+
+def test_resource_limiter_queues_by_current_job():
+    async def main():
+        limiter = ResourceLimiter("test", 1)
+        order = []
+
+        async def job(job_id, count):
+            current_job.set(job_id)
+            await asyncio.gather(*(request(job_id) for _ in range(count)))
+
+        async def request(job_id):
+            async with limiter.slot():
+                order.append(job_id)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(job("a", 3), job("b", 2))
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(main())
+    limits.limiters.pop("test")
+    assert order == ["a", "a", "b", "a", "b"]
+    assert stats == {"limit": 1, "active": 0, "waiting": 0, "waiting_jobs": 0}
@@ -0,0 +1,27 @@
+import asyncio
+
+from manifest import Manifest
+
+
+def test_saves_outside_the_event_loop_are_written_right_away(tmp_path):
+    manifest = Manifest.create(str(tmp_path / "video"), "video", "Topic", "happy")
+    manifest.add_scene("a", "First scene")
+    assert Manifest.load(str(tmp_path / "video")).scenes[0]["scene_id"] == "a"
+
+
+def test_saves_on_the_event_loop_are_written_in_order(tmp_path):
+    async def main():
+        manifest = Manifest.create(str(tmp_path / "video"), "video")
+        for index in range(50):
+            manifest.update(status=f"step {index}")
+        await manifest.flush()
+
+    asyncio.run(main())
+    assert Manifest.load(str(tmp_path / "video")).data["status"] == "step 49"
+
+
+def test_missing_or_broken_manifests_are_not_loaded(tmp_path):
+    assert Manifest.load(str(tmp_path / "missing")) is None
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "manifest.json").write_text("{")
+    assert Manifest.load(str(tmp_path / "broken")) is None
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import media
+from media import file_response, iter_file, parse_range
+
+
+def make_request(method="GET", **headers):
+    return SimpleNamespace(method=method, headers={name.replace("_", "-"): value for name, value in headers.items()})
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(range(256)) * 4)
+    return str(path)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("bytes=-24", (1000, 1023)),
+    ("bytes=-5000", (0, 1023)),
+    (" Bytes = 5-9", (5, 9)),
+])
+def test_parse_range_satisfiable(header, expected):
+    assert parse_range(header, 1024) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=10-5", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    assert parse_range(header, 1024) is None
+
+
+@pytest.mark.parametrize("header", ["items=0-9", "bytes=0-9,20-29", "bytes=a-b"])
+def test_parse_range_ignored(header):
+    assert parse_range(header, 1024) == ()
+
+
+def test_iter_file_reads_range_in_chunks(video, monkeypatch):
+    monkeypatch.setattr(media, "CHUNK_SIZE", 100)
+    chunks = list(iter_file(video, 10, 250))
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert b"".join(chunks) == (bytes(range(256)) * 4)[10:260]
+
+
+def test_full_response(video):
+    response = file_response(make_request(), video, "video/mp4")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == "1024"
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_range_response(video):
+    response = file_response(make_request(range="bytes=0-99"), video, "video/mp4")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 0-99/1024"
+    assert response.headers["content-length"] == "100"
+
+
+def test_unsatisfiable_range(video):
+    response = file_response(make_request(range="bytes=2000-"), video, "video/mp4")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_etag_revalidation(video):
+    etag = file_response(make_request(), video, "video/mp4").headers["etag"]
+    assert file_response(make_request(if_none_match=etag), video, "video/mp4").status_code == 304
+    assert file_response(make_request(if_none_match=f"W/{etag}"), video, "video/mp4").status_code == 304
+    assert file_response(make_request(if_none_match='"other"'), video, "video/mp4").status_code == 200
+
+
+def test_if_modified_since(video):
+    last_modified = file_response(make_request(), video, "video/mp4").headers["last-modified"]
+    assert file_response(make_request(if_modified_since=last_modified), video, "video/mp4").status_code == 304
+    assert file_response(make_request(if_modified_since="Thu, 01 Jan 1970 00:00:00 GMT"), video, "video/mp4").status_code == 200
+
+
+def test_if_range_with_outdated_etag_gets_full_file(video):
+    etag = file_response(make_request(), video, "video/mp4").headers["etag"]
+    current = file_response(make_request(range="bytes=0-9", if_range=etag), video, "video/mp4")
+    outdated = file_response(make_request(range="bytes=0-9", if_range='"outdated"'), video, "video/mp4")
+    assert current.status_code == 206
+    assert outdated.status_code == 200
+
+
+def test_head_has_no_body(video):
+    response = file_response(make_request("HEAD", range="bytes=0-9"), video, "video/mp4")
+    assert response.status_code == 206
+    assert response.body == b""
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        file_response(make_request(), str(tmp_path / "missing.mp4"), "video/mp4")
+    assert error.value.status_code == 404
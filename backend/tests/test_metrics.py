@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, current_spans, get_error_class, span, summarize
+
+
+def test_spans_are_recorded_on_the_spans_of_the_current_job():
+    spans = []
+    token = current_spans.set(spans)
+    try:
+        with span("tts", scene=1) as tts_span:
+            tts_span.bytes = 100
+        with pytest.raises(ValueError):
+            with span("codegen", scene=1, attempt=2):
+                raise ValueError("bad code")
+        with span("render", scene=0) as render_span:
+            render_span.fail("Traceback ...\nNameError: name 'Circel' is not defined")
+    finally:
+        current_spans.reset(token)
+
+    assert [(record["stage"], record["outcome"], record["error"]) for record in spans] == [
+        ("tts", "ok", None), ("codegen", "error", "ValueError"), ("render", "error", "NameError"),
+    ]
+    assert spans[0]["bytes"] == 100 and spans[1]["attempt"] == 2
+
+
+def test_cancelled_spans_are_not_counted_as_errors():
+    spans = []
+
+    async def stage():
+        current_spans.set(spans)
+        with span("render"):
+            await asyncio.sleep(1)
+
+    async def main():
+        task = asyncio.create_task(stage())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert [(record["outcome"], record["error"]) for record in spans] == [("cancelled", None)]
+
+
+def test_error_classes_are_read_from_messages():
+    assert get_error_class(KeyError("x")) == "KeyError"
+    assert get_error_class("ValueError: bad\nTypeError: worse") == "TypeError"
+    assert get_error_class("Render timed out after 600 seconds") == "Error"
+    assert get_error_class(None) == "Error"
+
+
+def test_summary_breaks_the_time_down_per_stage_and_scene():
+    def record(stage, scene, duration, error=None):
+        return {"stage": stage, "scene": scene, "duration": duration, "bytes": 10, "error": error}
+
+    summary = summarize([
+        record("transcript", None, 2.0),
+        record("render", 0, 1.0, "NameError"),
+        record("render", 0, 3.0),
+        record("render", 1, 2.0),
+    ])
+    assert summary["stages"]["render"] == {"count": 3, "seconds": 6.0, "bytes": 30, "errors": {"NameError": 1}}
+    assert summary["scenes"] == {0: {"render": 4.0}, 1: {"render": 2.0}}
+
+
+def test_metrics_are_rendered_in_the_prometheus_text_format(monkeypatch):
+    # kept out of the metrics the server exports
+    monkeypatch.setattr(metrics, "metrics", [])
+    histogram = Histogram("test_duration_seconds", "Test durations", buckets=(1, 5))
+    histogram.observe(0.5, stage="render")
+    histogram.observe(3, stage="render")
+    histogram.observe(10, stage="render")
+    counter = Counter("test_errors_total", "Test errors")
+    counter.inc(stage="render", error='Say "hi"')
+
+    assert histogram.render() == [
+        "# HELP test_duration_seconds Test durations",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{stage="render",le="1"} 1',
+        'test_duration_seconds_bucket{stage="render",le="5"} 2',
+        'test_duration_seconds_bucket{stage="render",le="+Inf"} 3',
+        'test_duration_seconds_sum{stage="render"} 13.5',
+        'test_duration_seconds_count{stage="render"} 3',
+    ]
+    assert counter.render()[-1] == 'test_errors_total{error="Say \\"hi\\"",stage="render"} 1'
+    assert metrics.render_metrics().count("# TYPE") == 2
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import muxer
+
+VIDEO = {
+    "codec_type": "video", "codec_name": "h264", "profile": "High", "width": 854, "height": 480,
+    "pix_fmt": "yuv420p", "r_frame_rate": "15/1", "time_base": "1/15360",
+}
+AUDIO = {"codec_type": "audio", "codec_name": "aac", "sample_rate": "44100", "channels": 2}
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    """
+    Records the ffmpeg commands instead of running them, and probes files from a table
+    """
+    commands = []
+    probes = {}
+
+    async def run_ffmpeg(*args):
+        commands.append(args)
+        if "-update" in args:
+            # the extracted last frame, removed by the muxer once it is encoded
+            open(args[-1], "wb").close()
+        if "concat" in args:
+            commands.append(("list", open(args[args.index("-i") + 1]).read()))
+
+    async def probe(path):
+        return probes[path]
+
+    monkeypatch.setattr(muxer, "run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr(muxer, "probe", probe)
+    return commands, probes
+
+
+def test_scenes_with_matching_streams_are_concatenated_without_re_encoding(ffmpeg, tmp_path):
+    commands, probes = ffmpeg
+    paths = [str(tmp_path / "scene 1.mp4"), str(tmp_path / "it's scene 2.mp4")]
+    for path in paths:
+        probes[path] = (5.0, VIDEO, AUDIO)
+
+    asyncio.run(muxer.concat_scenes(paths, str(tmp_path / "final.mp4")))
+    assert commands[0][commands[0].index("-c") + 1] == "copy"
+    assert commands[1] == ("list", f"file '{paths[0]}'\nfile '{tmp_path}/it'\\''s scene 2.mp4'\n")
+    assert not (tmp_path / "final.mp4.txt").exists()
+
+
+def test_scenes_with_different_streams_are_re_encoded_once(ffmpeg, tmp_path):
+    commands, probes = ffmpeg
+    probes["a.mp4"] = (5.0, VIDEO, AUDIO)
+    probes["b.mp4"] = (5.0, {**VIDEO, "width": 1280, "height": 720}, AUDIO)
+
+    asyncio.run(muxer.concat_scenes(["a.mp4", "b.mp4"], str(tmp_path / "final.mp4")))
+    assert len(commands) == 1
+    filter_graph = commands[0][commands[0].index("-filter_complex") + 1]
+    assert filter_graph == "[0:v:0][0:a:0][1:v:0][1:a:0]concat=n=2:v=1:a=1[v][a]"
+
+
+def test_narration_is_muxed_onto_the_copied_video(ffmpeg, tmp_path):
+    commands, probes = ffmpeg
+    probes["video.mp4"] = (10.0, VIDEO, None)
+    probes["audio.wav"] = (9.98, None, AUDIO)
+
+    asyncio.run(muxer.mux_scene("video.mp4", "audio.wav", str(tmp_path / "scene.mp4")))
+    assert len(commands) == 1
+    assert commands[0][commands[0].index("-c:v") + 1] == "copy"
+    assert commands[0][commands[0].index("-t") + 1] == "10.000"
+
+
+def test_a_longer_narration_holds_the_last_frame(ffmpeg, tmp_path):
+    commands, probes = ffmpeg
+    probes["video.mp4"] = (8.0, VIDEO, None)
+    probes["audio.wav"] = (10.0, None, AUDIO)
+    output_path = str(tmp_path / "scene.mp4")
+
+    asyncio.run(muxer.mux_scene("video.mp4", "audio.wav", output_path))
+    tail = commands[1]
+    assert tail[tail.index("-t") + 1] == "2.000"
+    assert tail[tail.index("-profile:v") + 1] == "high"
+    assert tail[tail.index("-video_track_timescale") + 1] == "15360"
+    # the extended video is muxed, and the intermediate files are gone
+    assert commands[-1][commands[-1].index("-i") + 1] == f"{output_path}.extended.mp4"
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("video, profile", [
+    ({**VIDEO, "profile": "Constrained Baseline"}, "baseline"),
+    ({**VIDEO, "profile": "High 4:4:4 Predictive"}, "high444"),
+    ({**VIDEO, "profile": "Progressive High"}, None),
+    ({**VIDEO, "codec_name": "hevc", "profile": "Main"}, None),
+])
+def test_the_held_frame_is_encoded_with_a_matching_profile(ffmpeg, tmp_path, video, profile):
+    commands, _ = ffmpeg
+    asyncio.run(muxer.encode_freeze_tail("video.mp4", video, 1.0, str(tmp_path / "tail.mp4")))
+    encode = commands[1]
+    assert (encode[encode.index("-profile:v") + 1] if "-profile:v" in encode else None) == profile
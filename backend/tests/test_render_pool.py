@@ -0,0 +1,104 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+import render_pool
+from render_pool import RenderPool, WarmWorker
+
+# stands in for render_worker.py: records its pid, then answers every request, or hangs on scripts called hang.py
+FAKE_WORKER = """
+import json, os, sys, time
+with open(os.environ["WORKER_STARTS"], "a") as starts:
+    starts.write(f"{os.getpid()}\\n")
+if os.environ.get("WORKER_BROKEN"):
+    sys.exit("ModuleNotFoundError: No module named 'manim'")
+print(json.dumps({"ready": True}), flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    if request["script_path"].endswith("hang.py"):
+        time.sleep(60)
+    ok = not request["script_path"].endswith("broken.py")
+    print(json.dumps({"ok": ok, "error": "" if ok else "NameError: name 'Circel' is not defined"}), flush=True)
+"""
+
+# stands in for the manim cli
+FAKE_MANIM = """#!/bin/sh
+echo manim >> "$WORKER_STARTS"
+"""
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    worker_path = tmp_path / "render_worker.py"
+    worker_path.write_text(FAKE_WORKER)
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "manim").write_text(FAKE_MANIM)
+    (bin_path / "manim").chmod(stat.S_IRWXU)
+    starts_path = tmp_path / "starts"
+    starts_path.touch()
+    monkeypatch.setattr(render_pool, "RENDER_WORKER_SCRIPT", str(worker_path))
+    monkeypatch.setattr(render_pool, "RENDER_WARM_WORKERS", True)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("WORKER_STARTS", str(starts_path))
+    return starts_path
+
+
+def read_starts(starts_path):
+    return starts_path.read_text().split()
+
+
+def is_running(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_renders_reuse_the_warm_worker_until_it_is_recycled(workers):
+    async def main():
+        worker = WarmWorker(max_jobs=2)
+        results = [await worker.render(f"scene{index}.py", "media", False, 5) for index in range(3)]
+        results.append(await worker.render("broken.py", "media", False, 5))
+        await worker.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert results[:3] == [(True, "")] * 3
+    assert results[3] == (False, "Render failed. Error: NameError: name 'Circel' is not defined")
+    # a new process after every two renders
+    assert len(read_starts(workers)) == 2
+
+
+def test_a_render_that_times_out_kills_the_worker(workers):
+    async def main():
+        pool = RenderPool(workers=1, timeout=0.5)
+        try:
+            return await pool.render("hang.py", "media"), await pool.render("scene.py", "media")
+        finally:
+            await pool.stop()
+
+    timed_out, next_render = asyncio.run(main())
+    assert timed_out == (False, "Render timed out after 0.5 seconds")
+    assert next_render == (True, "")
+    first, second = read_starts(workers)
+    assert not is_running(first) and not is_running(second)
+
+
+def test_renders_use_the_manim_cli_while_workers_can_not_be_started(workers, monkeypatch):
+    monkeypatch.setenv("WORKER_BROKEN", "1")
+
+    async def main():
+        pool = RenderPool(workers=1)
+        try:
+            return [await pool.render("scene.py", "media") for _ in range(3)]
+        finally:
+            await pool.stop()
+
+    assert asyncio.run(main()) == [(True, "")] * 3
+    # the worker is not started again for every render
+    starts = read_starts(workers)
+    assert starts.count("manim") == 3 and len(starts) == 4
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import render_queue
+from render_pool import VIDEO_INTERNAL_PATH
+from render_queue import ABANDONED_ERROR, DONE, FAILED, LEASED, QUEUED, SqliteRenderQueue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_queue, "RENDER_LEASE_SECONDS", 0.05)
+    monkeypatch.setattr(render_queue, "RENDER_POLL_INTERVAL", 0.01)
+    return SqliteRenderQueue(str(tmp_path / "queue"), concurrency=2)
+
+
+def test_renders_are_claimed_oldest_first_and_only_once(queue):
+    queue.submit("first", "code 1", False)
+    queue.submit("second", "code 2", True)
+    assert queue.get_status("first") == (QUEUED, None, None)
+
+    assert queue.claim("a") == ("first", "code 1", False)
+    assert queue.claim("b") == ("second", "code 2", True)
+    assert queue.claim("c") is None
+    assert queue.get_status("first") == (LEASED, "a", None)
+
+
+def test_renewed_leases_are_not_taken_over(queue):
+    queue.submit("render", "code", False)
+    queue.claim("a")
+    for _ in range(3):
+        time.sleep(0.03)
+        assert queue.renew("render", "a")
+    assert queue.claim("b") is None
+
+
+def test_an_expired_lease_is_claimed_by_another_node(queue):
+    queue.submit("render", "code", False)
+    queue.claim("a")
+    time.sleep(0.1)
+
+    assert queue.claim("b") == ("render", "code", False)
+    # the node that lost the lease can neither renew it nor report a result
+    assert not queue.renew("render", "a")
+    queue.complete("render", "a", False, "too late")
+    assert queue.get_status("render") == (LEASED, "b", None)
+    queue.complete("render", "b", True, "")
+    assert queue.get_status("render") == (DONE, "b", None)
+
+
+def test_a_render_whose_nodes_keep_dying_is_failed(queue, monkeypatch):
+    monkeypatch.setattr(render_queue, "RENDER_MAX_ATTEMPTS", 2)
+    queue.submit("render", "code", False)
+    queue.claim("a")
+    time.sleep(0.1)
+    queue.claim("b")
+    time.sleep(0.1)
+
+    assert queue.get_status("render") == (FAILED, "b", ABANDONED_ERROR)
+    assert queue.claim("c") is None
+
+
+def test_removed_renders_lose_their_lease(queue):
+    queue.submit("render", "code", False)
+    queue.claim("a")
+    queue.remove("render")
+
+    assert not queue.renew("render", "a")
+    assert queue.get_status("render") == (None, None, None)
+
+
+def test_render_waits_for_a_node_and_collects_its_clip(queue, tmp_path):
+    script_path = tmp_path / "video.py"
+    script_path.write_text("code")
+    media_dir = tmp_path / "media"
+
+    async def node():
+        while (claimed := queue.claim("a")) is None:
+            await asyncio.sleep(0.01)
+        render_id, code, _ = claimed
+        clip_path = tmp_path / "clip.mp4"
+        clip_path.write_bytes(code.encode())
+        queue.complete(render_id, "a", True, "", str(clip_path))
+
+    async def main():
+        result, _ = await asyncio.gather(queue.render(str(script_path), str(media_dir)), node())
+        return result
+
+    assert asyncio.run(main()) == (True, "")
+    assert (media_dir / VIDEO_INTERNAL_PATH).read_bytes() == b"code"
+    # the render and its clip are gone from the queue
+    assert queue.execute("SELECT COUNT(*) FROM renders")[0] == [(0,)]
+    assert os.listdir(queue.clips_dir) == []
+
+
+def test_failed_renders_report_the_error_of_the_node(queue, tmp_path):
+    script_path = tmp_path / "video.py"
+    script_path.write_text("code")
+
+    async def node():
+        while (claimed := queue.claim("a")) is None:
+            await asyncio.sleep(0.01)
+        queue.complete(claimed[0], "a", False, "NameError: name 'Circel' is not defined")
+
+    async def main():
+        result, _ = await asyncio.gather(queue.render(str(script_path), str(tmp_path / "media"), dry_run=True), node())
+        return result
+
+    assert asyncio.run(main()) == (False, "NameError: name 'Circel' is not defined")
+    assert queue.stats()["queued"] == 0
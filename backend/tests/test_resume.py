@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import scene_generator
+from manifest import Manifest
+from scene_generator import SceneGenerator
+
+
+class RecordingSpeech:
+    def __init__(self):
+        self.texts = []
+
+    async def synthesize(self, text, voice, format, temperature):
+        self.texts.append(text)
+        return {"audio": b"new audio"}
+
+
+@pytest.fixture
+def generations(tmp_path, monkeypatch):
+    monkeypatch.setattr(scene_generator, "GENERATIONS_PATH", str(tmp_path))
+    speech = RecordingSpeech()
+    monkeypatch.setattr(scene_generator, "speech_synthesizer", speech)
+    return tmp_path, speech
+
+
+def resume(path, scenes):
+    """
+    Writes a manifest with the given scenes, as an earlier run would have left it, and reads it back
+    """
+    manifest = Manifest.create(f"{path}/video", "video", "Topic", "happy")
+    for scene_id, stages in scenes.items():
+        manifest.add_scene(scene_id, f"Narration of {scene_id}")
+        manifest.update_scene(scene_id, **stages)
+    return Manifest.load(f"{path}/video")
+
+
+def test_scenes_keep_their_ids_and_order(generations):
+    path, _ = generations
+    generator = SceneGenerator([], manifest=resume(path, {"b": {}, "a": {}}))
+    assert generator.video_id == "video"
+    assert generator.scene_indexes == {"b": 0, "a": 1}
+    assert generator.scene_transcriptions["a"] == "Narration of a"
+
+
+def test_finished_speech_is_not_synthesized_again(generations):
+    path, speech = generations
+    (path / "video" / "a").mkdir(parents=True)
+    (path / "video" / "a" / "audio.wav").write_bytes(b"old audio")
+    reports = []
+    generator = SceneGenerator([], manifest=resume(path, {"a": {"speech": True}}), progress=lambda *report: reports.append(report))
+
+    assert asyncio.run(generator.generate_speech("a", "video")) == "a"
+    assert speech.texts == []
+    assert (path / "video" / "a" / "audio.wav").read_bytes() == b"old audio"
+    assert reports == [("tts", "done", 0, {"resumed": True})]
+
+
+def test_stages_whose_output_is_gone_run_again(generations):
+    path, speech = generations
+    generator = SceneGenerator([], manifest=resume(path, {"a": {"speech": True, "mux": True}}))
+
+    async def main():
+        result = await generator.generate_speech("a", "video")
+        await generator.manifest.flush()
+        return result
+
+    assert asyncio.run(main()) == "a"
+    assert speech.texts == ["Narration of a"]
+    assert (path / "video" / "a" / "audio.wav").read_bytes() == b"new audio"
+    # the new narration has to be muxed again
+    assert Manifest.load(f"{path}/video").get_scene("a")["mux"] is False
@@ -0,0 +1,62 @@
+import asyncio
+
+from cache import DiskCache
+from speech import CachedSpeech
+
+
+class SlowSpeech:
+    """
+    Speech client whose syntheses wait until they are released, and take a while to wind down when cancelled
+    """
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def synthesize(self, text, voice, format, temperature):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            # like a client that closes its connection before giving up
+            await asyncio.sleep(0.05)
+            raise
+        return {"audio": f"{text} {self.calls}".encode()}
+
+
+def test_concurrent_requests_share_a_synthesis(tmp_path):
+    async def main():
+        client = SlowSpeech()
+        speech = CachedSpeech(client, DiskCache(str(tmp_path), 1024 ** 2))
+        tasks = [asyncio.create_task(speech.synthesize("Hello  world", "lily", "wav", 1)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        client.release.set()
+        results = await asyncio.gather(*tasks)
+        return client.calls, speech.coalesced, results
+
+    calls, coalesced, results = asyncio.run(main())
+    assert (calls, coalesced) == (1, 2)
+    assert results == [{"audio": b"Hello  world 1"}] * 3
+
+
+def test_caller_after_the_last_waiter_gave_up_gets_a_new_synthesis(tmp_path):
+    async def main():
+        client = SlowSpeech()
+        speech = CachedSpeech(client, DiskCache(str(tmp_path), 1024 ** 2))
+        first = asyncio.create_task(speech.synthesize("Hello", "lily", "wav", 1))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.wait([first])
+        # the abandoned synthesis is still winding down
+        second = asyncio.create_task(speech.synthesize("Hello", "lily", "wav", 1))
+        await asyncio.sleep(0.01)
+        # once the abandoned synthesis is gone, later callers still share the new one
+        await asyncio.sleep(0.1)
+        third = asyncio.create_task(speech.synthesize("Hello", "lily", "wav", 1))
+        await asyncio.sleep(0.01)
+        client.release.set()
+        return first.cancelled(), await second, await third, client.calls
+
+    cancelled, second, third, calls = asyncio.run(main())
+    assert cancelled
+    assert second == third == {"audio": b"Hello 2"}
+    assert calls == 2
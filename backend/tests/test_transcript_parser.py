@@ -0,0 +1,95 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import scene_generator
+import transcript_generator
+from limits import llm_limiter
+from scene_generator import SceneGenerator
+from transcript_generator import SceneArrayParser, TranscriptGenerator
+
+
+def parse(chunks):
+    parser = SceneArrayParser()
+    scenes = []
+    for chunk in chunks:
+        scenes.extend(parser.feed(chunk))
+    return scenes
+
+
+SCENES = [
+    'A "quoted" word, a back\\slash and [brackets], in one scene.',
+    "A second scene\nover two lines, café and π.",
+    "",
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+def test_scenes_survive_any_chunking(chunk_size):
+    text = json.dumps(SCENES, indent=4)
+    chunks = [text[start:start + chunk_size] for start in range(0, len(text), chunk_size)]
+    assert parse(chunks) == SCENES
+
+
+def test_scene_is_returned_as_soon_as_it_is_closed():
+    parser = SceneArrayParser()
+    assert parser.feed('["first scene", "sec') == ["first scene"]
+    assert parser.feed('ond scene"') == ["second scene"]
+    assert parser.feed("]") == []
+
+
+def test_escape_split_across_chunks():
+    assert parse(['["say \\', '"hi\\', '" now"]']) == ['say "hi" now']
+
+
+def test_unicode_escape():
+    assert parse(['["caf\\u00e9"]']) == ["café"]
+
+
+def test_markdown_fence_before_the_array_is_ignored():
+    assert parse(['```json\n', '["only scene"]\n```']) == ["only scene"]
+
+
+def test_text_after_the_array_is_ignored():
+    assert parse(['["only scene"] and then "something else"']) == ["only scene"]
+
+
+def test_unfinished_string_is_not_returned():
+    assert parse(['["complete", "cut o']) == ["complete"]
+
+
+class StreamingClient:
+    """
+    Stands in for the openai client, streaming the chunks and then waiting for more that never come
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model, messages, temperature=None, stream=False):
+        async def stream():
+            for text in self.chunks:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+            await asyncio.Event().wait()
+        return stream()
+
+
+def test_a_stopped_stream_gives_its_llm_slot_back_right_away(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_generator, "client", StreamingClient(['["First scene", ', '"Second']))
+    monkeypatch.setattr(scene_generator, "GENERATIONS_PATH", str(tmp_path))
+    generator = SceneGenerator([])
+
+    def add_scene(scene_transcription):
+        raise OSError("disk full")
+
+    generator.add_scene = add_scene
+
+    async def main():
+        with pytest.raises(OSError):
+            await generator.generate_streamed_scenes(TranscriptGenerator().stream_transcript("Topic", "happy"))
+        # checked before the event loop gets a chance to finalize the abandoned stream
+        return llm_limiter.semaphore.active
+
+    assert asyncio.run(main()) == 0
@@ -1,14 +1,58 @@
-import dotenv
-dotenv.load_dotenv()
-
 from client import client
 from logger import logger
+from conversation import Conversation
+from limits import llm_limiter
+from metrics import span
 import json
 import asyncio
 import os
 
 MAX_ITERATIONS = 5
 
+
+class SceneArrayParser:
+    """
+    Incrementally parses a JSON array of strings as it is streamed in, returning every string as soon as its closing quote arrives.
+    Anything before the opening bracket, like markdown or a language name, is ignored.
+    """
+    def __init__(self):
+        self.in_array = False
+        self.in_string = False
+        self.escaped = False
+        self.finished = False
+        self.current = []
+
+    def feed(self, chunk):
+        """
+        Feeds the next chunk of streamed text to the parser
+        :param chunk: Next piece of the model output (string)
+        :return: List of strings that were completed by this chunk (list of strings)
+        """
+        completed = []
+        for character in chunk:
+            if self.finished:
+                break
+            if not self.in_array:
+                self.in_array = character == "["
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif character == "\\":
+                    self.escaped = True
+                elif character == '"':
+                    self.in_string = False
+                    # let json handle escape sequences
+                    completed.append(json.loads('"' + "".join(self.current) + '"', strict=False))
+                    self.current = []
+                    continue
+                self.current.append(character)
+            elif character == '"':
+                self.in_string = True
+            elif character == "]":
+                self.finished = True
+        return completed
+
+
 class TranscriptGenerator:
     """
     Initializes the TranscriptGenerator with the given user topic
@@ -51,36 +95,86 @@ Format example:
         :return: List of scene transcriptions (strings)
         """
         iteration = 0
-        messages = [{
-            "role": "system", "content": self.generate_emotion_system_prompt(emotions)
-        }, {
-            "role": "user", "content": user_topic
-        }]
+        conversation = Conversation(self.generate_emotion_system_prompt(emotions), user_topic)
 
         while iteration < MAX_ITERATIONS:
-            response = await client.chat.completions.create(
-                model=os.getenv("LLM_MODEL"),
-                messages=messages,
-                temperature=round(iteration/MAX_ITERATIONS, 1) # temperature increase heuristic
-            )            
-            output = response.choices[0].message.content.strip().strip('python').strip("```")
+            async with llm_limiter.slot():
+                with span("transcript", attempt=iteration + 1) as transcript_span:
+                    response = await client.chat.completions.create(
+                        model=os.getenv("LLM_MODEL"),
+                        messages=conversation.get_messages(),
+                        temperature=round(iteration/MAX_ITERATIONS, 1) # temperature increase heuristic
+                    )
+                    output = response.choices[0].message.content.strip().strip('python').strip("```")
+                    transcript_span.bytes = len(output.encode())
 
             logger.info(f"Generated transcript: {output}")
 
-            messages.append({"role": "assistant", "content": output})
             try:
                 self.scene_transcriptions = list(json.loads(output))
                 return self.scene_transcriptions
             except Exception as e:
                 try:
                     self.populate_transcriptions_array(output)
-                    return 
+                    return self.scene_transcriptions
                 except Exception as e:
-                    messages.append({"role": "user", "content": f"Error: Did not follow correct format. Please create an array of strings for scenes."})
+                    conversation.add_attempt(output, "Did not follow correct format. Please create an array of strings for scenes.")
             iteration += 1
 
+    async def stream_transcript(self, user_topic, emotions):
+        """
+        Streams the transcript for the user topic, yielding every scene as soon as the model has finished writing it.
+        Falls back to generate_transcript if the streamed output does not contain any scene.
+        :return: Async iterator of scene transcriptions (strings)
+        """
+        self.scene_transcriptions = []
+        messages = [{
+            "role": "system", "content": self.generate_emotion_system_prompt(emotions)
+        }, {
+            "role": "user", "content": user_topic
+        }]
+
+        parser = SceneArrayParser()
+        output = []
+        try:
+            async with llm_limiter.slot():
+                # includes the time the scenes take to be handed out, which only starts their tasks
+                with span("transcript", attempt=1) as transcript_span:
+                    stream = await client.chat.completions.create(
+                        model=os.getenv("LLM_MODEL"),
+                        messages=messages,
+                        temperature=0,
+                        stream=True,
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        text = chunk.choices[0].delta.content
+                        output.append(text)
+                        transcript_span.bytes += len(text.encode())
+                        for scene_transcription in parser.feed(text):
+                            logger.info(f"Streamed scene transcription: {scene_transcription}")
+                            self.scene_transcriptions.append(scene_transcription)
+                            yield scene_transcription
+        except Exception as e:
+            if self.scene_transcriptions:
+                # scenes that were already handed out can not be taken back, go with what we have
+                logger.error(f"Transcript stream failed after {len(self.scene_transcriptions)} scenes: {e}")
+                return
+            logger.warning(f"Transcript stream failed: {e}")
+
+        logger.info(f"Generated transcript: {''.join(output)}")
+
+        if not self.scene_transcriptions:
+            logger.warning("Streamed transcript did not contain any scenes, retrying without streaming")
+            for scene_transcription in await self.generate_transcript(user_topic, emotions) or []:
+                yield scene_transcription
+
 
 if __name__ == "__main__":
+    # the API keys are read when the clients are first used
+    import dotenv
+    dotenv.load_dotenv()
     # example usage for transcript generation
     user_topic = input("Enter user topic: ")
     transcript_generator = TranscriptGenerator()
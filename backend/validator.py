@@ -0,0 +1,137 @@
+import ast
+import builtins
+import json
+import subprocess
+import sys
+import threading
+from logger import logger
+from render_worker import SCENE_CLASS_NAME
+from render_pool import RENDER_WORKER_SCRIPT, RENDER_WORKER_STARTUP_TIMEOUT
+
+
+"""
+Cheap static checks of generated manim code, run before spending a full manim render on it.
+
+Catches the failures that do not need a render to be found: syntax errors, a missing VideoScene class, names that are never defined (like BROWN) and names imported from manim that manim does not export. Errors are phrased like the Python errors a render would have produced, so they can be fed back to the LLM as is.
+
+The names manim exports are asked from a render worker process once, instead of importing manim into the API process, which would take seconds and a few hundred megabytes. validate_scene_code blocks until they are known, so it is run off the event loop, and the server asks for them when it starts.
+"""
+
+manim_names_lock = threading.Lock()
+# None until loaded, then the names, or an empty set if manim is not available
+manim_names = None
+
+
+def get_manim_names():
+    """
+    Returns the names exported by manim, or None if manim is not available
+    """
+    global manim_names
+    with manim_names_lock:
+        if manim_names is None:
+            manim_names = frozenset(load_manim_names() or ())
+    return manim_names or None
+
+
+def load_manim_names():
+    try:
+        result = subprocess.run(
+            [sys.executable, RENDER_WORKER_SCRIPT, "--names"],
+            capture_output=True, text=True, timeout=RENDER_WORKER_STARTUP_TIMEOUT,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}")
+        return json.loads(result.stdout)
+    except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not get the names manim exports, skipping name checks: {e}")
+        return None
+
+
+def get_bound_names(tree):
+    """
+    Collects every name the module binds in any scope. Scopes are not told apart, which can miss an error but never reports a false one.
+    """
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bound.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+    return bound
+
+
+def check_imports(tree, manim_names):
+    """
+    Checks the star imports of the module and the names it imports from manim
+    :return: whether name resolution is possible, and the first import error if any (bool, string or None)
+    """
+    resolvable = True
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.ImportFrom):
+            continue
+        for alias in node.names:
+            if alias.name == "*":
+                # names from any other star import can not be known without importing it
+                resolvable = resolvable and node.module == "manim"
+            elif node.module == "manim" and alias.name not in manim_names:
+                return resolvable, f"ImportError: cannot import name '{alias.name}' from 'manim' (line {node.lineno})"
+    return resolvable, None
+
+
+def validate_scene_code(code):
+    """
+    Statically checks generated manim code
+    :param code: Generated manim code (string)
+    :return: true if no problem was found, false otherwise, including the error message (bool, string)
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        return False, f"SyntaxError: {e.msg} (line {e.lineno})\n{line}"
+
+    scene_classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+    if not any(node.name == SCENE_CLASS_NAME for node in scene_classes):
+        found = ", ".join(node.name for node in scene_classes) or "no classes"
+        return False, f"The root scene class must be called {SCENE_CLASS_NAME}, found {found}"
+
+    manim_names = get_manim_names()
+    if manim_names is None:
+        return True, ""
+
+    resolvable, import_error = check_imports(tree, manim_names)
+    if import_error:
+        return False, import_error
+    if not resolvable:
+        return True, ""
+
+    has_star_import = any(
+        isinstance(node, ast.ImportFrom) and node.module == "manim" and any(alias.name == "*" for alias in node.names)
+        for node in ast.walk(tree)
+    )
+    known = get_bound_names(tree) | set(dir(builtins)) | {"__name__", "__file__"}
+    if has_star_import:
+        known |= manim_names
+
+    undefined = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in known:
+            undefined.setdefault(node.id, node.lineno)
+
+    if undefined:
+        errors = [f"NameError: name '{name}' is not defined (line {line})" for name, line in sorted(undefined.items(), key=lambda item: item[1])]
+        return False, "\n".join(errors)
+    return True, ""
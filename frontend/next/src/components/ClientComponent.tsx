@@ -24,6 +24,7 @@ interface Message {
 export function ClientComponent({ accessToken }: { accessToken: string }) {
   const textareaRef: RefObject<HTMLInputElement> = useRef(null);
   const [videoID, setVideoID] = useState<string>("");
+  const [videoSrc, setVideoSrc] = useState<string>("");
   const [emotions, setEmotions] = useState<string>(""); // string of comma-separated emotions
   const [videoPlaying, setVideoPlaying] = useState<boolean>(false);
   const [loading, setLoading] = useState<boolean>(false);
@@ -45,14 +46,9 @@ export function ClientComponent({ accessToken }: { accessToken: string }) {
     ws.onmessage = (event) => {
       const result = JSON.parse(event.data);
 
-      if (result?.face?.predictions) {
-        setEmotions(
-          result.face.predictions[0]?.emotions
-            ?.sort((a: any, b: any) => b.score - a.score)
-            .slice(0, 3)
-            .map((emotion: any) => emotion.name)
-            .join(", ")
-        );
+      // top emotions, smoothed over the recent frames by the server
+      if (result?.emotions) {
+        setEmotions(result.emotions);
       }
     };
 
@@ -70,10 +66,52 @@ export function ClientComponent({ accessToken }: { accessToken: string }) {
     };
   }, []);
 
+  function followJob(jobID: string) {
+    // the playlist starts playing once the first scene is ready, browsers without
+    // native HLS support wait for every scene to be stitched together instead
+    const nativeHls = document
+      .createElement("video")
+      .canPlayType("application/vnd.apple.mpegurl");
+    const events = new EventSource(
+      `http://localhost:8000/jobs/${jobID}/events`
+    );
+
+    // nobody will watch the video once the page is closed, stop generating it
+    const cancelJob = () => {
+      navigator.sendBeacon(`http://localhost:8000/jobs/${jobID}/cancel`);
+    };
+    window.addEventListener("pagehide", cancelJob);
+
+    events.onmessage = (event) => {
+      const job = JSON.parse(event.data);
+      console.log(job);
+
+      if (nativeHls && job.playlist_ready) {
+        setVideoSrc(`http://localhost:8000${job.playlist}`);
+      } else if (job.status === "done") {
+        setVideoSrc(`http://localhost:8000${job.video}`);
+      }
+
+      if (
+        job.status === "done" ||
+        job.status === "failed" ||
+        job.status === "cancelled"
+      ) {
+        events.close();
+        window.removeEventListener("pagehide", cancelJob);
+        if (job.status !== "done") {
+          console.error("Video generation failed:", job.error);
+          setLoading(false);
+        }
+      }
+    };
+  }
+
   function generateVideo() {
     setStarting(false);
     setVideoPlaying(false);
     setVideoID("");
+    setVideoSrc("");
     const textarea = textareaRef.current;
 
     if (textarea) {
@@ -109,6 +147,7 @@ export function ClientComponent({ accessToken }: { accessToken: string }) {
           // Handle the data received from the backend
           console.log(data);
           setVideoID(data.video_id);
+          followJob(data.job_id);
         })
         .catch((error) => {
           // Handle errors
@@ -128,7 +167,7 @@ export function ClientComponent({ accessToken }: { accessToken: string }) {
     return (
       <div className="w-full h-full flex flex-col p-4 gap-4">
         <div className="flex flex-col gap-4 items-center justify-center">
-          {videoID ? (
+          {videoSrc ? (
             <Button onClick={startPlayingVideo} variant="outline">
               <VideoIcon className="w-6 h-6 mr-2" />
               Watch the explainer video
@@ -177,10 +216,10 @@ export function ClientComponent({ accessToken }: { accessToken: string }) {
   const StartingComponent = () => {
     return (
       <div className="w-full h-full flex relative items-center align-middle justify-center">
-        {videoPlaying && videoID && (
+        {videoPlaying && videoSrc && (
           <div className="w-full h-full flex flex-col items-center justify-center object-cover">
             <video
-              src={`http://localhost:8000/videos/${videoID}/`}
+              src={videoSrc}
               className="w-full h-full"
               controls
               autoPlay
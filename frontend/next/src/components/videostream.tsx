@@ -35,13 +35,17 @@ const VideoStream: React.FC<VideoStreamProps> = ({
   }, []);
 
   useEffect(() => {
+    // one canvas for all frames, instead of a new one every second
+    const canvas = document.createElement("canvas");
+    canvas.width = 300;
+    canvas.height = 200;
+    const context = canvas.getContext("2d");
+    let timeout: ReturnType<typeof setTimeout> | undefined;
+
     const captureFrame = () => {
       if (videoRef.current && socket && isSocketOpen) {
-        const canvas = document.createElement("canvas");
-        canvas.width = 300; // Use width and height props directly
-        canvas.height = 200;
-        const context = canvas.getContext("2d");
-        if (context) {
+        // skip the frame while the previous one is still being sent
+        if (context && socket.bufferedAmount === 0) {
           context.drawImage(
             videoRef.current,
             0,
@@ -49,17 +53,25 @@ const VideoStream: React.FC<VideoStreamProps> = ({
             canvas.width,
             canvas.height
           );
-          const frameData = canvas.toDataURL("image/png");
-          console.log("Sending frame data...");
-          socket.send(frameData);
+          // a binary JPEG is a fraction of the size of a base64 PNG data URL
+          canvas.toBlob(
+            (blob) => {
+              if (blob && socket.readyState === WebSocket.OPEN) {
+                socket.send(blob);
+              }
+            },
+            "image/jpeg",
+            0.8
+          );
         }
 
-        setTimeout(captureFrame, 1000); // Adjust interval as needed
+        timeout = setTimeout(captureFrame, 1000); // Adjust interval as needed
       }
     };
 
     captureFrame();
-  }, [socket, isSocketOpen]); // Include width and height in dependencies
+    return () => clearTimeout(timeout);
+  }, [socket, isSocketOpen]);
 
   return (
     <div>